@@ -0,0 +1,221 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Benchmarks for the main phases of sphinx-automodapi, run on synthetic
+packages generated by `synthetic_package`.
+
+The following phases are timed separately, for each combination of the
+package sizes given on the command line:
+
+* ``import``: importing the modules of the package (timed only once).
+* ``introspection``: finding the public attributes of each module, and their
+  kind, as done by the ``automodapi``, ``automodsumm`` and ``automod-diagram``
+  directives.
+* ``automodapi_replace``: expanding one ``automodapi`` directive per module.
+* ``automodsumm_to_autosummary_lines``: scanning the expanded document for
+  ``automodsumm`` directives.
+* ``generate_automodsumm_docs``: rendering and writing the stub files.
+* ``automod-diagram``: building the inheritance graph of each module and
+  generating its dot source, as done by the ``automod-diagram`` directive.
+* ``build``: a full ``sphinx-build`` of the generated documentation with the
+  ``dummy`` builder (only with ``--full-build``).
+
+Except for ``introspection``, the phases reuse the results of module
+introspection cached during the build, so that each of them only measures
+its own work. Each phase is repeated and the best time is reported.
+
+Example::
+
+    python benchmarks/bench_automodapi.py --modules 10 50 100 --classes 20
+
+"""
+
+import argparse
+import importlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sphinx.application import Sphinx
+from sphinx.ext.inheritance_diagram import InheritanceGraph
+
+from sphinx_automodapi.automodapi import automodapi_replace, _clear_replace_cache
+from sphinx_automodapi.automodsumm import (automodsumm_to_autosummary_lines,
+                                           generate_automodsumm_docs, SPHINX_LT_8_2)
+from sphinx_automodapi.utils import mod_objs_cache
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic_package import generate_package, generate_docs, index_source  # noqa: E402
+
+PHASES = ['import', 'introspection', 'automodapi_replace',
+          'automodsumm_to_autosummary_lines', 'generate_automodsumm_docs',
+          'automod-diagram', 'build']
+
+
+def make_app(srcdir, buildername='dummy', freshenv=True):
+    return Sphinx(srcdir, srcdir, os.path.join(srcdir, '_build', buildername),
+                  os.path.join(srcdir, '_build', 'doctrees'), buildername,
+                  status=None, warning=io.StringIO(), freshenv=freshenv)
+
+
+def best_time(func, setup=None, repeat=3):
+    """
+    Returns the best time (in seconds) out of ``repeat`` calls to ``func``,
+    calling ``setup`` (untimed) before each of them.
+    """
+    times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def run_benchmark(workdir, package, n_modules, n_classes, n_methods, depth,
+                  repeat=3, full_build=False):
+    """
+    Generates a synthetic package in ``workdir`` and times each phase of the
+    automodapi pipeline on it.
+
+    Returns
+    -------
+    timings : dict
+        The best time (in seconds) for each phase.
+    """
+    srcpath = os.path.join(workdir, 'src')
+    modnames = generate_package(srcpath, package, n_modules=n_modules,
+                                n_classes=n_classes, n_methods=n_methods, depth=depth)
+    sys.path.insert(0, srcpath)
+
+    timings = {}
+
+    start = time.perf_counter()
+    for modname in modnames:
+        importlib.import_module(modname)
+    timings['import'] = time.perf_counter() - start
+
+    # The documents are written after the application is created, so that
+    # they are not processed by the builder-inited event.
+    projdir = os.path.join(workdir, 'project')
+    generate_docs(projdir, [], diagrams=True)
+    app = make_app(projdir)
+
+    def introspect():
+        for modname in modnames:
+            mod_objs_cache.find_mod_kinds(modname)
+
+    timings['introspection'] = best_time(introspect, setup=mod_objs_cache.invalidate,
+                                         repeat=repeat)
+    introspect()
+
+    source = index_source(modnames)
+    timings['automodapi_replace'] = best_time(lambda: automodapi_replace(source, app),
+                                              setup=lambda: _clear_replace_cache(app),
+                                              repeat=repeat)
+
+    with open(os.path.join(projdir, 'expanded.rst'), 'w', encoding='utf8') as f:
+        f.write(automodapi_replace(source, app))
+
+    timings['automodsumm_to_autosummary_lines'] = best_time(
+        lambda: automodsumm_to_autosummary_lines('expanded.rst', app),
+        setup=lambda: _clear_replace_cache(app), repeat=repeat)
+
+    lines = automodsumm_to_autosummary_lines('expanded.rst', app)
+
+    def generate():
+        generate_automodsumm_docs(lines, 'expanded.rst', app=app, builder=app.builder,
+                                  base_path=app.srcdir)
+
+    timings['generate_automodsumm_docs'] = best_time(
+        generate, setup=lambda: shutil.rmtree(os.path.join(projdir, 'api'), ignore_errors=True),
+        repeat=repeat)
+
+    def diagrams():
+        for modname in modnames:
+            fqns, kinds = mod_objs_cache.find_mod_kinds(modname, onlylocals=True)[1:]
+            clsnms = [fqn for fqn, kind in zip(fqns, kinds) if kind == 'class']
+            graph = InheritanceGraph(clsnms, modname)
+            urls = {clsnm: f'api/{clsnm}.html' for clsnm in clsnms}
+            # Same call as in the HTML writer of sphinx.ext.inheritance_diagram
+            if SPHINX_LT_8_2:
+                graph.generate_dot(modname, urls, env=app.env)
+            else:
+                graph._generate_dot(modname, urls, config=app.config)
+
+    timings['automod-diagram'] = best_time(diagrams, repeat=repeat)
+
+    if full_build:
+        builddir = os.path.join(workdir, 'build')
+        generate_docs(builddir, modnames, diagrams=True)
+
+        def clean():
+            shutil.rmtree(os.path.join(builddir, '_build'), ignore_errors=True)
+            shutil.rmtree(os.path.join(builddir, 'api'), ignore_errors=True)
+
+        timings['build'] = best_time(lambda: make_app(builddir).build(),
+                                     setup=clean, repeat=repeat)
+
+    sys.path.remove(srcpath)
+
+    return timings
+
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(
+        description='Time the phases of sphinx-automodapi on synthetic packages.')
+    parser.add_argument('--modules', type=int, nargs='+', default=[10],
+                        help='Number(s) of modules in the package')
+    parser.add_argument('--classes', type=int, nargs='+', default=[10],
+                        help='Number(s) of classes per module')
+    parser.add_argument('--methods', type=int, nargs='+', default=[5],
+                        help='Number(s) of methods per class')
+    parser.add_argument('--depth', type=int, nargs='+', default=[3],
+                        help='Length(s) of the inheritance chains')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of times each phase is repeated')
+    parser.add_argument('--full-build', action='store_true',
+                        help='Also time a full Sphinx build')
+    parser.add_argument('--json', help='Write the results to this JSON file')
+    args = parser.parse_args(args)
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for n_modules in args.modules:
+            for n_classes in args.classes:
+                for n_methods in args.methods:
+                    for depth in args.depth:
+                        params = {'modules': n_modules, 'classes': n_classes,
+                                  'methods': n_methods, 'depth': depth}
+                        # Each package gets a new name, since modules can't be
+                        # unloaded
+                        package = f'automodapi_bench{len(results)}'
+                        workdir = os.path.join(tmpdir, package)
+                        timings = run_benchmark(workdir, package, n_modules, n_classes,
+                                                n_methods, depth, repeat=args.repeat,
+                                                full_build=args.full_build)
+                        results.append({'params': params, 'timings': timings})
+
+    phases = [phase for phase in PHASES if phase in results[0]['timings']]
+    header = ['modules', 'classes', 'methods', 'depth'] + phases
+    widths = [max(len(column), 8) for column in header]
+    print('  '.join(column.rjust(width) for column, width in zip(header, widths)))
+    for result in results:
+        row = [str(value) for value in result['params'].values()]
+        row += [f"{result['timings'][phase]:.4f}" for phase in phases]
+        print('  '.join(value.rjust(width) for value, width in zip(row, widths)))
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Generator for synthetic packages used to benchmark sphinx-automodapi.
+
+The generated packages are structured like the modules in
+``sphinx_automodapi/tests/example_module``, but their size can be scaled: each
+package contains ``n_modules`` modules, each of which defines ``n_classes``
+classes with ``n_methods`` methods, as well as a few functions and variables.
+The classes of each module form inheritance chains of ``depth`` classes, the
+first class of each chain inheriting from a base class defined in a private
+module of the package (so that the inheritance diagrams include classes
+that are not documented in the module itself).
+"""
+
+import os
+
+__all__ = ['generate_package', 'generate_docs']
+
+BASE_MODULE = '''\
+__all__ = ['Base']
+
+
+class Base:
+    """
+    Base class of all the classes in this package.
+    """
+
+    def base_method(self, x):
+        """
+        A method defined on the base class.
+        """
+        return x
+'''
+
+CLASS_TEMPLATE = '''
+
+class {name}({base}):
+    """
+    Class {name}, at depth {level} of its inheritance chain.
+
+    Parameters
+    ----------
+    value : int
+        Some value.
+    """
+
+    #: A class attribute
+    attr_{name} = {level}
+
+    def __init__(self, value=0):
+        self.value = value
+
+    @property
+    def prop_{name}(self):
+        """
+        A property of {name}.
+        """
+        return self.value
+{methods}'''
+
+METHOD_TEMPLATE = '''
+    def method_{index}(self, x, y=None):
+        """
+        Method number {index}.
+
+        Parameters
+        ----------
+        x : float
+            The first argument.
+        y : float, optional
+            The second argument.
+
+        Returns
+        -------
+        result : float
+            The result.
+        """
+        return x
+'''
+
+FUNCTION_TEMPLATE = '''
+
+def {name}(x):
+    """
+    Function {name}.
+    """
+    return x
+'''
+
+DOCS_CONF = '''\
+extensions = ['sphinx_automodapi.automodapi']
+master_doc = 'index'
+automodapi_toctreedirnm = 'api'
+automodapi_inheritance_diagram = {diagrams!r}
+suppress_warnings = ['app.add_directive', 'app.add_node']
+'''
+
+
+def module_names(package, n_modules):
+    """
+    Returns the names of the public modules of a package generated by
+    `generate_package`.
+    """
+    return [f'{package}.mod{imod}' for imod in range(n_modules)]
+
+
+def _class_name(imod, icls):
+    return f'Class{imod}_{icls}'
+
+
+def generate_module(imod, n_classes=10, n_methods=5, depth=3, n_functions=3):
+    """
+    Returns the source code of a module of the synthetic package.
+    """
+    names = []
+    parts = ['from ._base import Base\n']
+
+    for icls in range(n_classes):
+        level = icls % max(depth, 1)
+        base = 'Base' if level == 0 else _class_name(imod, icls - 1)
+        name = _class_name(imod, icls)
+        methods = ''.join(METHOD_TEMPLATE.format(index=imeth) for imeth in range(n_methods))
+        parts.append(CLASS_TEMPLATE.format(name=name, base=base, level=level, methods=methods))
+        names.append(name)
+
+    for ifunc in range(n_functions):
+        name = f'function{imod}_{ifunc}'
+        parts.append(FUNCTION_TEMPLATE.format(name=name))
+        names.append(name)
+
+    parts.append(f'\n\nVARIABLE{imod} = {imod}\n')
+    names.append(f'VARIABLE{imod}')
+
+    parts.insert(0, f'__all__ = {names!r}\n\n')
+
+    return ''.join(parts)
+
+
+def generate_package(path, package, n_modules=10, n_classes=10, n_methods=5, depth=3):
+    """
+    Writes a synthetic package named ``package`` in the directory ``path``,
+    which should then be added to `sys.path` for the package to be importable.
+
+    Parameters
+    ----------
+    path : str
+        The directory in which to create the package.
+    package : str
+        The name of the package.
+    n_modules : int
+        The number of public modules in the package.
+    n_classes : int
+        The number of classes in each module.
+    n_methods : int
+        The number of methods of each class.
+    depth : int
+        The length of the inheritance chains of the classes in each module.
+
+    Returns
+    -------
+    modnames : list of str
+        The names of the public modules of the package.
+    """
+    pkgdir = os.path.join(path, package)
+    os.makedirs(pkgdir, exist_ok=True)
+
+    with open(os.path.join(pkgdir, '__init__.py'), 'w') as f:
+        f.write('')
+
+    with open(os.path.join(pkgdir, '_base.py'), 'w') as f:
+        f.write(BASE_MODULE)
+
+    for imod in range(n_modules):
+        with open(os.path.join(pkgdir, f'mod{imod}.py'), 'w') as f:
+            f.write(generate_module(imod, n_classes=n_classes,
+                                    n_methods=n_methods, depth=depth))
+
+    return module_names(package, n_modules)
+
+
+def generate_docs(path, modnames, diagrams=True):
+    """
+    Writes a Sphinx project in the directory ``path`` with an index page
+    containing an ``automodapi`` directive for each of the modules
+    ``modnames``.
+    """
+    os.makedirs(path, exist_ok=True)
+
+    with open(os.path.join(path, 'conf.py'), 'w') as f:
+        f.write(DOCS_CONF.format(diagrams=diagrams))
+
+    with open(os.path.join(path, 'index.rst'), 'w') as f:
+        f.write(index_source(modnames))
+
+
+def index_source(modnames):
+    """
+    Returns the source of a document with an ``automodapi`` directive for
+    each of the modules ``modnames``.
+    """
+    lines = ['Synthetic package', '=================', '']
+    for modname in modnames:
+        lines.extend([f'.. automodapi:: {modname}', ''])
+    return '\n'.join(lines)
@@ -2,10 +2,45 @@
 Miscellaneous enhancements to help autodoc along.
 """
 import dataclasses
+import weakref
 
 __all__ = []
 
 
+# The properties defined on each class or inherited from its bases, keyed by
+# attribute name, so that autodoc doesn't walk the MRO again for each member.
+# Classes are only weakly referenced so that they can still be garbage
+# collected.
+_class_properties = weakref.WeakKeyDictionary()
+
+
+def _find_class_properties(cls):
+    """
+    Returns a dictionary mapping the names of the attributes of ``cls`` for
+    which the first definition in the MRO is a `property` to that property.
+    """
+    properties = {}
+    seen = set()
+    for base in cls.__mro__:
+        for name, value in base.__dict__.items():
+            if name not in seen:
+                seen.add(name)
+                if isinstance(value, property):
+                    properties[name] = value
+    return properties
+
+
+def _get_class_properties(cls):
+    try:
+        return _class_properties[cls]
+    except KeyError:
+        properties = _class_properties[cls] = _find_class_properties(cls)
+        return properties
+    except TypeError:
+        # Classes whose metaclass makes them unhashable can't be cached
+        return _find_class_properties(cls)
+
+
 # See
 # https://github.com/astropy/astropy-helpers/issues/116#issuecomment-71254836
 # for further background on this.
@@ -46,14 +81,12 @@ def type_object_attrgetter(obj, attr, *defargs):
     of autodoc.
     """
 
-    for base in obj.__mro__:
-        if attr in base.__dict__:
-            if isinstance(base.__dict__[attr], property):
-                # Note, this should only be used for properties--for any other
-                # type of descriptor (classmethod, for example) this can mess
-                # up existing expectations of what getattr(cls, ...) returns
-                return base.__dict__[attr]
-            break
+    # Note, this should only be used for properties--for any other type of
+    # descriptor (classmethod, for example) this can mess up existing
+    # expectations of what getattr(cls, ...) returns
+    prop = _get_class_properties(obj).get(attr)
+    if prop is not None:
+        return prop
 
     try:
         return getattr(obj, attr, *defargs)
@@ -120,14 +120,14 @@ This extension also adds five sphinx configuration options:
 # use the "builder-inited" event, which comes before the directives are
 # actually built.
 
-import inspect
 import os
 import re
-import sys
+import hashlib
 
 from sphinx.util import logging
 
-from .utils import find_mod_objs
+from .instrumentation import build_stats, import_profiler
+from .utils import mod_objs_cache
 
 __all__ = []
 
@@ -182,6 +182,9 @@ _automodapirex = re.compile(r'^(?:\.\.\s+automodapi::\s*)([A-Za-z0-9_.]+)'
 # the last group of the above regex is intended to go into finall with the below
 _automodapiargsrex = re.compile(r':([a-zA-Z_\-]+):(.*)$', flags=re.MULTILINE)
 
+# Memoized results of automodapi_replace, see _expand_automodapi
+_replace_cache = {}
+
 
 def automodapi_replace(sourcestr, app, dotoctree=True, docname=None,
                        warnings=True):
@@ -223,6 +226,44 @@ def automodapi_replace(sourcestr, app, dotoctree=True, docname=None,
 
     logger = logging.getLogger(__name__)
 
+    # The same document is expanded during builder-inited (by automodsumm)
+    # and again during source-read, so the result of the expansion is
+    # memoized, along with the warnings to re-issue.
+    if docname is None:
+        key = None
+        result = None
+    else:
+        key = (docname, hashlib.sha1(sourcestr.encode('utf8')).hexdigest(),
+               dotoctree, str(app.srcdir), app.config.automodapi_toctreedirnm,
+               app.config.automodapi_inheritance_diagram)
+        result = _replace_cache.get(key)
+
+    if result is None:
+        with build_stats.timer('automodapi expansion'):
+            result = _expand_automodapi(sourcestr, app, dotoctree, docname)
+        build_stats.count('automodapi expansions computed')
+        if key is not None:
+            _replace_cache[key] = result
+    else:
+        build_stats.count('automodapi expansions reused')
+
+    newsourcestr, warns = result
+    if warnings:
+        for msg, location in warns:
+            logger.warning(msg, location)
+
+    return sourcestr if newsourcestr is None else newsourcestr
+
+
+def _expand_automodapi(sourcestr, app, dotoctree, docname):
+    """
+    Does the actual work for `automodapi_replace`. Returns the new source
+    string (or `None` if there is no automodapi entry in the source) and the
+    list of ``(message, location)`` warnings to issue.
+    """
+
+    warns = []
+
     spl = _automodapirex.split(sourcestr)
     if len(spl) > 1:  # automodsumm is in this document
 
@@ -307,8 +348,7 @@ def automodapi_replace(sourcestr, app, dotoctree=True, docname=None,
             hds = hds.strip()
             if len(hds) < 2:
                 msg = 'Not enough headings (got {0}, need 2), using default -^'
-                if warnings:
-                    logger.warning(msg.format(len(hds)), location)
+                warns.append((msg.format(len(hds)), location))
                 hds = '-^'
             h1, h2 = hds[:2]
 
@@ -316,11 +356,11 @@ def automodapi_replace(sourcestr, app, dotoctree=True, docname=None,
             if len(unknownops) > 0 and app is not None:
                 opsstrs = ','.join(unknownops)
                 msg = 'Found additional options ' + opsstrs + ' in automodapi.'
-                if warnings:
-                    logger.warning(msg, location)
+                warns.append((msg, location))
 
-            ispkg, hascls, hasfuncs, hasother, toskip = _mod_info(
-                modnm, toskip, includes, onlylocals=onlylocals)
+            with import_profiler.trigger('automodapi:: ' + modnm, docname):
+                ispkg, hascls, hasfuncs, hasother, toskip = _mod_info(
+                    modnm, toskip, includes, onlylocals=onlylocals)
 
             # add automodule directive only if no-main-docstr isn't present
             if maindocstr:
@@ -422,9 +462,13 @@ def automodapi_replace(sourcestr, app, dotoctree=True, docname=None,
                           encoding='utf8') as f:
                     f.write(ustr)
 
-        return newsourcestr
+        return newsourcestr, warns
     else:
-        return sourcestr
+        return None, warns
+
+
+def _clear_replace_cache(app, *args):
+    _replace_cache.clear()
 
 
 def _mod_info(modname, toskip=[], include=[], onlylocals=True):
@@ -436,24 +480,18 @@ def _mod_info(modname, toskip=[], include=[], onlylocals=True):
     hascls = hasfunc = hasother = False
 
     skips = toskip.copy()
-    for localnm, fqnm, obj in zip(*find_mod_objs(modname, onlylocals=onlylocals)):
+    for localnm, fqnm, kind in zip(*mod_objs_cache.find_mod_kinds(modname, onlylocals=onlylocals)):
         if include and localnm not in include and localnm not in skips:
             skips.append(localnm)
 
         elif localnm not in toskip:
-            hascls = hascls or inspect.isclass(obj)
-            hasfunc = hasfunc or inspect.isroutine(obj)
-            hasother = hasother or (not inspect.isclass(obj) and
-                                    not inspect.isroutine(obj))
+            hascls = hascls or kind == 'class'
+            hasfunc = hasfunc or kind == 'routine'
+            hasother = hasother or kind == 'other'
             if hascls and hasfunc and hasother:
                 break
 
-    # find_mod_objs has already imported modname
-    # TODO: There is probably a cleaner way to do this, though this is pretty
-    # reliable for all Python versions for most cases that we care about.
-    pkg = sys.modules[modname]
-    ispkg = (hasattr(pkg, '__file__') and isinstance(pkg.__file__, str) and
-             os.path.split(pkg.__file__)[1].startswith('__init__.py'))
+    ispkg = mod_objs_cache.is_package(modname)
 
     return ispkg, hascls, hasfunc, hasother, skips
 
@@ -472,6 +510,11 @@ def setup(app):
     app.setup_extension(automodsumm.__name__)
 
     app.connect('source-read', process_automodapi)
+    # The memoized expansions only need to be kept while documents are read.
+    # Use a high priority so that the cache is cleared before automodsumm
+    # fills it again in its own builder-inited handler.
+    app.connect('builder-inited', _clear_replace_cache, priority=400)
+    app.connect('env-updated', _clear_replace_cache)
 
     app.add_config_value('automodapi_inheritance_diagram', True, True)
     app.add_config_value('automodapi_toctreedirnm', 'api', True)
@@ -52,7 +52,7 @@ options:
         using `dir`, which always gives a sorted list).
 
 
-This extension also adds three sphinx configuration options:
+This extension also adds the following sphinx configuration options:
 
 * ``automodsumm_writereprocessed``
     Should be a bool, and if ``True``, will cause `automodsumm`_ to write files
@@ -79,6 +79,138 @@ This extension also adds three sphinx configuration options:
     documentation meaning that no property specific documentation is generated.
     Defaults to ``True``.
 
+* ``automodsumm_parallel_generation``
+    Should be a bool and if ``True``, the objects that stub files are
+    generated for are imported, and their members classified, in worker
+    processes, using as many processes at a time as given to
+    ``sphinx-build -j``, as with ``automodsumm_introspection_workers``. The
+    stub files are then rendered from the descriptions sent back by the
+    workers, and written, in the Sphinx process, so they are the same as when
+    the objects are introspected serially. This has no effect if Sphinx is
+    not run in parallel, or with Sphinx < 9. Defaults to ``False``.
+
+* ``automodsumm_incremental_generation``
+    Should be a bool and if ``True``, the stub files generated by
+    `automodsumm`_ are recorded, along with a hash of their content, in a
+    manifest in the doctree directory. On subsequent builds, these stubs are
+    regenerated (rather than skipped because they already exist) and only
+    rewritten if their content changed or if they were modified since they
+    were written, so that Sphinx does not re-read unchanged stubs. Stubs for
+    objects that are no longer documented are deleted. Existing stub files
+    that are not in the manifest, such as files written by hand, are never
+    modified. Defaults to ``False``.
+
+* ``automodsumm_in_memory_stubs``
+    Should be a bool and if ``True``, the stub files generated by
+    `automodsumm`_ are kept in memory and given to Sphinx when it reads them,
+    while the files written in the source directory only contain a
+    placeholder comment that does not change between builds. Documents whose
+    stub changed since the previous build are still read again, and the
+    copies of their sources in the HTML output have the generated content.
+    Existing files that are not placeholders are left alone, as without this
+    option. Defaults to ``False``.
+
+* ``automodsumm_scan_exclude``
+    A list of glob-style patterns (in the same format as Sphinx's
+    ``exclude_patterns``) of source files, relative to the source directory,
+    that should not be searched for `automodsumm`_ and ``automodapi``
+    directives, e.g. ``['**.ipynb', 'tutorials/**']``. As in
+    ``exclude_patterns``, ``*`` does not match ``/``, so ``'*.ipynb'`` only
+    matches files at the top of the source directory. Source files that don't
+    contain the name of either directive (or of `automod-diagram`_) are always
+    skipped without being parsed. Defaults to ``[]``.
+
+* ``automodsumm_scan_workers``
+    The number of threads used to read and parse source files when searching
+    them for `automodsumm`_ and ``automodapi`` directives. Stub generation for
+    a source file starts as soon as it has been parsed, while the following
+    files are parsed concurrently. Since documented modules are then imported
+    from several threads, only use a value greater than 1 if importing them
+    is thread-safe. Defaults to ``1``.
+
+* ``automodsumm_module_index``
+    Should be a bool and if ``True``, the public attributes of the modules
+    documented by `automodsumm`_, ``automodapi`` and `automod-diagram`_, and
+    whether they are classes or functions, are stored in an index in the
+    doctree directory, along with the type of each object that a stub file
+    is generated for and the types of its members. On subsequent builds,
+    modules and objects whose source files (and those of the modules their
+    attributes or base classes come from) did not change are not imported
+    again to determine which objects to document and to render their stub
+    files. With Sphinx < 9, object types depend on the documenters
+    registered by extensions, so only modules are stored. Defaults to
+    ``False``.
+
+* ``automodsumm_introspection_workers``
+    The number of worker processes used to import and introspect the modules
+    documented by `automodsumm`_, ``automodapi`` and `automod-diagram`_
+    before the documents are scanned, and then the objects that stub files
+    are generated for. The workers only send back the names and kinds of the
+    public attributes of each module, and the types of each object and of
+    its members, so importing these modules and classifying the members of
+    the objects can take place in parallel and is isolated from the Sphinx
+    process. The stub files are then rendered from these descriptions, and
+    objects are only imported in the Sphinx process by ``autodoc``. With
+    Sphinx < 9, object types depend on the documenters registered by
+    extensions, so objects are introspected in the Sphinx process. All the
+    documents are scanned before the first stub file is generated. If ``0``,
+    modules and objects are introspected in the Sphinx process. Defaults to
+    ``0``.
+
+* ``automodsumm_introspection_timeout``
+    The number of seconds after which a worker process started because of
+    ``automodsumm_introspection_workers`` (or of
+    ``automodsumm_parallel_generation``) is killed, in which case a warning
+    is emitted and the module is treated as if it could not be imported.
+    Can be ``None`` for no timeout. Defaults to ``60``.
+
+* ``automodsumm_static_discovery``
+    Should be a bool and if ``True``, the public attributes of the modules
+    documented by `automodsumm`_, ``automodapi`` and `automod-diagram`_, and
+    whether they are classes or functions, are determined by parsing the
+    source of the modules, following their ``__all__`` and the names they
+    import from other modules, instead of importing them (see
+    `sphinx_automodapi.static_discovery`). Modules are still imported if
+    some of their attributes can't be determined statically, and objects are
+    still imported to render the stub files and by ``autodoc``. Modules
+    discovered statically are not sent to the workers started because of
+    ``automodsumm_introspection_workers``. Defaults to ``False``.
+
+* ``automodsumm_diagram_cache``
+    If ``True``, the images rendered by graphviz for `automod-diagram`_ (and
+    ``automodapi``) inheritance diagrams are kept in a cache in the doctree
+    directory, and reused in later builds (even if the output directory was
+    removed) as long as the diagram is unchanged, instead of running graphviz
+    again. Can also be the path of the cache directory, relative to the
+    configuration directory, e.g. to keep the cache outside of the build
+    directory. Defaults to ``False``.
+
+* ``automodsumm_build_plan``
+    If ``True``, every stub file generated by `automodsumm`_ is listed in a
+    JSON build plan, ``automodsumm_plan.json`` in the doctree directory,
+    along with the template and options used to render it and a fingerprint
+    of its inputs (see `sphinx_automodapi.build_plan`). Can also be the path
+    of the plan, relative to the configuration directory. If
+    ``automodsumm_incremental_generation`` is also enabled, stubs whose
+    fingerprint did not change since the previous build are not rendered
+    again. Defaults to ``False``.
+
+* ``automodsumm_dry_run``
+    Should be a bool and if ``True``, the documents are scanned and the build
+    plan is written (to the doctree directory, unless
+    ``automodsumm_build_plan`` gives its path), but no stub file is rendered
+    or written. To write the plan without building the documentation, use
+    ``python -m sphinx_automodapi.build_plan``. Defaults to ``False``.
+
+* ``automodsumm_shard``
+    The shard of the modules to generate stub files and inheritance diagrams
+    for, given as ``'index/count'`` (e.g. ``sphinx-build -D
+    automodsumm_shard=0/4``), so that this work can be split across several
+    builds. Each module belongs to a single shard, determined by its name.
+    The stub files and diagram caches of the shards can then be merged with
+    ``python -m sphinx_automodapi.sharding`` (see
+    `sphinx_automodapi.sharding`). Defaults to ``None``, i.e. all modules.
+
 .. _sphinx.ext.autosummary: http://sphinx-doc.org/latest/ext/autosummary.html
 .. _autosummary: http://sphinx-doc.org/latest/ext/autosummary.html#directive-autosummary
 
@@ -100,22 +232,36 @@ package. It accepts no options.
 .. _sphinx.ext.inheritance_diagram: http://sphinx-doc.org/latest/ext/inheritance.html
 """
 
-import inspect
 import os
 import re
-import dataclasses
+import json
+import shutil
+import mmap
+import hashlib
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
 import sphinx
 from docutils.parsers.rst.directives import flag
 from packaging.version import Version
 from sphinx.util import logging
+from sphinx.util.matching import Matcher
+from sphinx.util.osutil import ensuredir
+from sphinx.ext import graphviz
 from sphinx.ext.autosummary import Autosummary
 from sphinx.ext.inheritance_diagram import InheritanceDiagram, InheritanceGraph, try_import
 
-from .utils import find_mod_objs, cleanup_whitespace, SPHINX_LT_9
+from .build_plan import BuildPlan, build_plan_path
+from .instrumentation import build_stats, import_profiler
+from .sharding import (DIAGRAM_CACHE, in_shard, other_shard_stubs, parse_shard,
+                       record_expected_stubs, record_shard_stubs, reset_shard_stubs,
+                       write_shard_manifest)
+from .introspection import ModuleIndex, prefetch_module_infos, prefetch_object_infos
+from .utils import mod_objs_cache, iter_cleanup_whitespace, SPHINX_LT_9
 
 __all__ = ['Automoddiagram', 'Automodsumm', 'automodsumm_to_autosummary_lines',
-           'generate_automodsumm_docs', 'process_automodsumm_generation']
+           'generate_automodsumm_docs', 'process_automodsumm_generation',
+           'StubManifest']
 logger = logging.getLogger(__name__)
 SPHINX_LT_8_2 = Version(sphinx.__version__) < Version("8.2")
 
@@ -154,7 +300,9 @@ class Automodsumm(Autosummary):
         nodelist = []
 
         try:
-            localnames, fqns, objs = find_mod_objs(modname, sort='sort' in self.options)
+            with import_profiler.trigger('automodsumm:: ' + modname, env.docname):
+                localnames, fqns, kinds = mod_objs_cache.find_mod_kinds(
+                    modname, sort='sort' in self.options)
         except ImportError:
             logger.warning("Couldn't import module " + modname)
             return []
@@ -184,19 +332,18 @@ class Automodsumm(Autosummary):
 
             if funconly:
                 cont = []
-                for nm, obj in zip(localnames, objs):
-                    if nm not in skipnames and inspect.isroutine(obj):
+                for nm, kind in zip(localnames, kinds):
+                    if nm not in skipnames and kind == 'routine':
                         cont.append(nm)
             elif clsonly:
                 cont = []
-                for nm, obj in zip(localnames, objs):
-                    if nm not in skipnames and inspect.isclass(obj):
+                for nm, kind in zip(localnames, kinds):
+                    if nm not in skipnames and kind == 'class':
                         cont.append(nm)
             elif varonly:
                 cont = []
-                for nm, obj in zip(localnames, objs):
-                    if nm not in skipnames and not (inspect.isclass(obj) or
-                                                    inspect.isroutine(obj)):
+                for nm, kind in zip(localnames, kinds):
+                    if nm not in skipnames and kind == 'other':
                         cont.append(nm)
             else:
                 cont = [nm for nm in localnames if nm not in skipnames]
@@ -233,11 +380,21 @@ class Automoddiagram(InheritanceDiagram):
     option_spec['skip'] = _str_list_converter
 
     def run(self):
+        with build_stats.timer('diagram creation'), \
+                import_profiler.trigger('automod-diagram:: ' + self.arguments[0], self.env.docname):
+            return self._run()
+
+    def _run(self):
+        if not in_shard(self.arguments[0], parse_shard(self.config.automodsumm_shard)):
+            # The diagram is created by the build of another shard
+            build_stats.count('diagrams skipped (other shards)')
+            return []
+
         try:
             ols = self.options.get('allowed-package-names', [])
             ols = True if len(ols) == 0 else ols  # if none are given, assume only local
 
-            nms, objs = find_mod_objs(self.arguments[0], onlylocals=ols)[1:]
+            nms, kinds = mod_objs_cache.find_mod_kinds(self.arguments[0], onlylocals=ols)[1:]
         except ImportError:
             logger.warning("Couldn't import module " + self.arguments[0])
             return []
@@ -246,18 +403,19 @@ class Automoddiagram(InheritanceDiagram):
         skip = self.options.get('skip', [])
 
         clsnms = []
-        for n, o in zip(nms, objs):
+        for n, kind in zip(nms, kinds):
 
             if n.split('.')[-1] in skip:
                 continue
 
-            if inspect.isclass(o):
+            if kind == 'class':
                 clsnms.append(n)
 
         oldargs = self.arguments
         try:
             if len(clsnms) > 0:
                 self.arguments = [' '.join(clsnms)]
+            build_stats.count('diagrams created')
             return InheritanceDiagram.run(self)
         finally:
             self.arguments = oldargs
@@ -272,47 +430,356 @@ class Automoddiagram(InheritanceDiagram):
 # such situations, the code will fail to find the URL that for the class.
 
 # The following code monkey-patches the method that receives the mapping and
-# converts the keys from class documented names to class full names.
+# converts the keys from class documented names to class full names. Since
+# Sphinx 8.2, the HTML writer calls the private _generate_dot method directly.
+
+# The class full name for each documented name is only resolved once per
+# build, and shared by all the diagrams. The table is filled as classes are
+# documented by autodoc, and otherwise by importing the documented name the
+# first time it is seen. It is cleared in process_automodsumm_generation.
+_class_fullnames = {}
+
+
+def _class_fullname(name):
+    """
+    Returns the full name of the class documented as ``name``, or `None` if
+    it can't be imported.
+    """
+    try:
+        return _class_fullnames[name]
+    except KeyError:
+        pass
+    obj = try_import(name)
+    fullname = None if obj is None else InheritanceGraph.class_name(None, obj, 0, None)
+    _class_fullnames[name] = fullname
+    return fullname
+
+
+def record_class_fullname(app, what, name, obj, options, lines):
+    if isinstance(obj, type):
+        _class_fullnames[name] = InheritanceGraph.class_name(None, obj, 0, None)
+
+
+def _fullname_urls(urls):
+    # Make a new mapping dictionary that uses class full names
+    fullname_urls = {}
+    for name, url in urls.items():
+        fullname = _class_fullname(name)
+        if fullname is not None:
+            fullname_urls[fullname] = url
+    return fullname_urls
 
-old_generate_dot = InheritanceGraph.generate_dot
 
 if SPHINX_LT_8_2:
+    old_generate_dot = InheritanceGraph.generate_dot
+
     def patched_generate_dot(self, name, urls={}, env=None,
                              graph_attrs={}, node_attrs={}, edge_attrs={}):
-        # Make a new mapping dictionary that uses class full names by importing each
-        # class documented name
-        fullname_urls = {self.class_name(try_import(name), 0, None): url
-                         for name, url in urls.items() if try_import(name) is not None}
-        return old_generate_dot(self, name, urls=fullname_urls, env=env,
+        return old_generate_dot(self, name, urls=_fullname_urls(urls), env=env,
                                 graph_attrs=graph_attrs, node_attrs=node_attrs, edge_attrs=edge_attrs)
+
+    InheritanceGraph.generate_dot = patched_generate_dot
 else:
+    old_generate_dot = InheritanceGraph._generate_dot
+
     def patched_generate_dot(self, name, urls={}, config=None,
                              graph_attrs={}, node_attrs={}, edge_attrs={}):
-        # Make a new mapping dictionary that uses class full names by importing each
-        # class documented name
-        fullname_urls = {self.class_name(try_import(name), 0, None): url
-                         for name, url in urls.items() if try_import(name) is not None}
-        return old_generate_dot(self, name, urls=fullname_urls, config=config,
+        return old_generate_dot(self, name, urls=_fullname_urls(urls), config=config,
                                 graph_attrs=graph_attrs, node_attrs=node_attrs, edge_attrs=edge_attrs)
 
+    InheritanceGraph._generate_dot = patched_generate_dot
+
+
+# sphinx.ext.graphviz names the images it renders after a hash of the dot
+# code and of the graphviz options, and only runs graphviz if the image does
+# not already exist in the output directory. With automodsumm_diagram_cache,
+# the rendered inheritance diagrams are also kept in a cache directory that
+# persists between builds (and output directories), and restored from there
+# instead of running graphviz again.
+
+old_render_dot = graphviz.render_dot
+
+
+def _diagram_cache_dir(builder):
+    cache = builder.config.automodsumm_diagram_cache
+    if not cache:
+        return None
+    if cache is True:
+        return os.path.join(builder.doctreedir, DIAGRAM_CACHE)
+    return os.path.join(builder.confdir, cache)
+
 
-InheritanceGraph.generate_dot = patched_generate_dot
+def _copy_atomic(src, dst):
+    tmp = f'{dst}.{os.getpid()}.tmp'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def cached_render_dot(self, code, options, format, prefix='graphviz', filename=None):
+    cachedir = _diagram_cache_dir(self.builder)
+    graphviz_dot = options.get('graphviz_dot', self.builder.config.graphviz_dot)
+    if cachedir is None or prefix != 'inheritance' or not graphviz_dot:
+        return old_render_dot(self, code, options, format, prefix, filename)
+
+    # Same file name as in sphinx.ext.graphviz.render_dot
+    hashkey = (code + str(options) + str(graphviz_dot) +
+               str(self.builder.config.graphviz_dot_args)).encode()
+    fname = f'{prefix}-{hashlib.sha1(hashkey).hexdigest()}.{format}'
+    outfn = os.path.join(self.builder.outdir, self.builder.imagedir, fname)
+    cachefn = os.path.join(cachedir, fname)
+    # PNG images come with an image map
+    extensions = ['', '.map'] if format == 'png' else ['']
+
+    if (not os.path.isfile(outfn) and
+            all(os.path.isfile(cachefn + ext) for ext in extensions)):
+        ensuredir(os.path.dirname(outfn))
+        for ext in extensions:
+            _copy_atomic(cachefn + ext, outfn + ext)
+        build_stats.count('diagrams restored from cache')
+
+    relfn, outfn = old_render_dot(self, code, options, format, prefix, filename)
+
+    if (outfn is not None and os.path.basename(outfn) == fname and
+            not all(os.path.isfile(cachefn + ext) for ext in extensions)):
+        ensuredir(cachedir)
+        for ext in extensions:
+            _copy_atomic(str(outfn) + ext, cachefn + ext)
+        build_stats.count('diagrams added to cache')
+
+    return relfn, outfn
+
+
+graphviz.render_dot = cached_render_dot
 
 
 # <---------------------automodsumm generation stuff-------------------------->
+class StubManifest:
+    """
+    Keeps track of the stub files written by `generate_automodsumm_docs` and
+    of a hash of their content, in a file in the doctree directory that
+    persists between builds.
+
+    This is used by the ``automodsumm_incremental_generation`` option to only
+    rewrite stubs whose content changed, and to delete the stubs of objects
+    that are no longer documented.
+    """
+
+    filename = 'automodsumm_stubs.json'
+
+    def __init__(self, srcdir, doctreedir):
+        self.srcdir = str(srcdir)
+        self.path = os.path.join(doctreedir, self.filename)
+        self.current = {}
+        try:
+            with open(self.path, encoding='utf8') as f:
+                self.previous = json.load(f)['stubs']
+        except (OSError, ValueError, KeyError):
+            self.previous = {}
+
+    def _key(self, fn):
+        return os.path.relpath(fn, self.srcdir).replace(os.sep, '/')
+
+    @staticmethod
+    def _hash(content):
+        return hashlib.sha256(content.encode('utf8')).hexdigest()
+
+    def _is_unmodified(self, fn, key):
+        # Whether the file still has the content written by a previous build
+        try:
+            with open(fn, encoding='utf8') as f:
+                return self._hash(f.read()) == self.previous[key]
+        except OSError:
+            return False
+
+    def is_tracked(self, fn):
+        """
+        Whether the stub file ``fn`` was written by a previous build.
+        """
+        return self._key(fn) in self.previous
+
+    def record(self, fn, content):
+        """
+        Record that the stub file ``fn`` should have the given content.
+
+        Returns `True` if the file needs to be written, i.e. if it doesn't
+        exist, its content changed since the previous build, or it was
+        modified since it was written.
+        """
+        key = self._key(fn)
+        digest = self._hash(content)
+        self.current[key] = digest
+        if self.previous.get(key) != digest:
+            return True
+        return not self._is_unmodified(fn, key)
+
+    def keep(self, fn):
+        """
+        Record that the stub file ``fn`` written by a previous build is kept
+        as it is, without rendering it again.
+
+        Returns `False` if this is not possible, i.e. if the file doesn't
+        exist, was not written by a previous build, or was modified since.
+        """
+        key = self._key(fn)
+        if key not in self.previous or not self._is_unmodified(fn, key):
+            return False
+        self.current[key] = self.previous[key]
+        return True
+
+    def carry_forward(self, filenames):
+        """
+        Record that the stub files ``filenames``, which are not generated by
+        this build (e.g. because they belong to another shard), are still
+        documented, so that they are kept in the manifest as they were.
+        """
+        for fn in filenames:
+            key = self._key(fn)
+            if key in self.previous:
+                self.current[key] = self.previous[key]
+
+    def remove_orphans(self):
+        """
+        Delete the stub files written by a previous build that were not
+        recorded during this build, unless they were modified since.
+
+        Returns the list of deleted files.
+        """
+        removed = []
+        for key in sorted(set(self.previous) - set(self.current)):
+            fn = os.path.join(self.srcdir, *key.split('/'))
+            if not os.path.exists(fn):
+                continue
+            if self._is_unmodified(fn, key):
+                os.remove(fn)
+                removed.append(fn)
+            else:
+                logger.info('[automodsumm] not removing modified stub ' + fn)
+        return removed
+
+    def save(self):
+        """
+        Write the stubs recorded during this build to the manifest file.
+        """
+        ensuredir(os.path.dirname(self.path))
+        with open(self.path, 'w', encoding='utf8') as f:
+            json.dump({'stubs': self.current}, f, indent=1, sort_keys=True)
+
+
+# The stubs rendered with ``automodsumm_in_memory_stubs``, by file name, and
+# the documents whose stub changed since the previous build. They are filled
+# in process_automodsumm_generation, before documents are read (possibly in
+# forked processes, which inherit them).
+_in_memory_stubs = {}
+_changed_stub_docs = set()
+
+
+def _stub_placeholder(name):
+    """
+    Returns the content of the file written for the stub of ``name`` with
+    ``automodsumm_in_memory_stubs``.
+    """
+    return ('.. The stub for {0} is generated in memory by automodsumm\n'
+            '   (see automodsumm_in_memory_stubs).\n').format(name)
+
+
+def _is_stub_placeholder(fn, placeholder):
+    try:
+        with open(fn, encoding='utf8') as f:
+            return f.read() == placeholder
+    except (OSError, ValueError):
+        return False
+
+
+def _update_stub_digests(env):
+    # The placeholders don't change when the stubs do, so the documents whose
+    # stub changed are tracked with a hash of the stub in the environment
+    digests = getattr(env, 'automodsumm_stub_digests', {})
+    _changed_stub_docs.clear()
+    for fn, source in _in_memory_stubs.items():
+        docname = env.path2doc(fn)
+        digest = hashlib.sha256(source.encode('utf8')).hexdigest()
+        if docname is not None and digests.get(docname) != digest:
+            digests[docname] = digest
+            _changed_stub_docs.add(docname)
+    env.automodsumm_stub_digests = digests
+
+
+def outdated_in_memory_stubs(app, env, added, changed, removed):
+    return [docname for docname in sorted(_changed_stub_docs)
+            if docname in env.all_docs and docname not in removed]
+
+
+def substitute_in_memory_stub(app, docname, source):
+    if _in_memory_stubs:
+        fn = os.path.normpath(str(app.env.doc2path(docname)))
+        if fn in _in_memory_stubs:
+            source[0] = _in_memory_stubs[fn]
+
+
+def copy_in_memory_stub_sources(app, exception):
+    # The HTML builder copies the source files to _sources, so these copies
+    # are only placeholders
+    if (exception is not None or not _in_memory_stubs or
+            app.builder.format != 'html' or not app.config.html_copy_source):
+        return
+    sourcelink_suffix = app.config.html_sourcelink_suffix
+    for fn, source in _in_memory_stubs.items():
+        docname = app.env.path2doc(fn)
+        if docname is None:
+            continue
+        suffix = os.path.splitext(fn)[1]
+        sourcename = docname + suffix
+        if suffix != sourcelink_suffix:
+            sourcename += sourcelink_suffix
+        copy = os.path.join(app.outdir, '_sources', *sourcename.split('/'))
+        try:
+            with open(fn, encoding='utf8') as f:
+                placeholder = f.read()
+        except OSError:
+            continue
+        if _is_stub_placeholder(copy, placeholder):
+            with open(copy, 'w', encoding='utf8') as f:
+                f.write(source)
+
+
 def process_automodsumm_generation(app):
     env = app.builder.env
 
+    # Modules may have changed since the previous build in this process
+    mod_objs_cache.invalidate()
+    _class_fullnames.clear()
+    _in_memory_stubs.clear()
+    _changed_stub_docs.clear()
+    if app.config.automodsumm_module_index:
+        mod_objs_cache.index = ModuleIndex(app.doctreedir)
+    else:
+        mod_objs_cache.index = None
+    mod_objs_cache.static = app.config.automodsumm_static_discovery
+
+    scan_exclude = Matcher(app.config.automodsumm_scan_exclude)
+
     filestosearch = []
     for docname in env.found_docs:
         filename = env.doc2path(docname)
         if os.path.isfile(filename):
-            filestosearch.append(docname + os.path.splitext(filename)[1])
-
-    liness = []
-    for sfn in filestosearch:
-        lines = automodsumm_to_autosummary_lines(sfn, app)
-        liness.append(lines)
+            sfn = docname + os.path.splitext(filename)[1]
+            if not scan_exclude(sfn):
+                filestosearch.append(sfn)
+
+    if app.config.automodsumm_introspection_workers > 0:
+        modnames = _find_documented_modules(
+            os.path.join(app.srcdir, sfn) for sfn in filestosearch)
+        prefetch_module_infos(mod_objs_cache, modnames,
+                              workers=app.config.automodsumm_introspection_workers,
+                              timeout=app.config.automodsumm_introspection_timeout)
+
+    def scan(sfn):
+        with build_stats.timer('document scanning'):
+            if not _may_contain_automod(os.path.join(app.srcdir, sfn)):
+                build_stats.count('documents skipped without parsing')
+                return []
+            lines = automodsumm_to_autosummary_lines(sfn, app)
+        build_stats.count('documents scanned')
         if app.config.automodsumm_writereprocessed:
             if lines:  # empty list means no automodsumm entry is in the file
                 outfn = os.path.join(app.srcdir, sfn) + '.automodsumm'
@@ -320,25 +787,212 @@ def process_automodsumm_generation(app):
                     for l in lines:  # noqa: E741
                         f.write(l)
                         f.write('\n')
+        return lines
 
-    for sfn, lines in zip(filestosearch, liness):
-        if len(lines) > 0:
-            generate_automodsumm_docs(
-                lines, sfn, app=app, builder=app.builder,
-                base_path=app.srcdir,
-                inherited_members=app.config.automodsumm_inherited_members,
-                included_members=app.config.automodsumm_included_members,
-                properties_are_attributes=app.config.automodsumm_properties_are_attributes)
+    shard = parse_shard(app.config.automodsumm_shard)
+    reset_shard_stubs(app)
 
+    dry_run = app.config.automodsumm_dry_run
+    if app.config.automodsumm_incremental_generation and not dry_run:
+        stub_manifest = StubManifest(app.srcdir, app.doctreedir)
+    else:
+        stub_manifest = None
 
-# _automodsummrex = re.compile(r'^(\s*)\.\. automodsumm::\s*([A-Za-z0-9_.]+)\s*'
-#                              r'\n\1(\s*)(\S|$)', re.MULTILINE)
-_lineendrex = r'(?:\n|$)'
-_hdrex = r'^\n?(\s*)\.\. automodsumm::\s*(\S+)\s*' + _lineendrex
-_oprex1 = r'(?:\1(\s+)\S.*' + _lineendrex + ')'
-_oprex2 = r'(?:\1\4\S.*' + _lineendrex + ')'
-_automodsummrex = re.compile(_hdrex + '(' + _oprex1 + '?' + _oprex2 + '*)',
-                             re.MULTILINE)
+    if app.config.automodsumm_in_memory_stubs and not dry_run:
+        in_memory_stubs = _in_memory_stubs
+    else:
+        in_memory_stubs = None
+
+    plan_path = build_plan_path(app)
+    if plan_path is not None:
+        plan = BuildPlan(app.srcdir)
+        # Stubs whose inputs did not change can be kept as they are, if they
+        # are tracked by the stub manifest
+        previous_plan = None if stub_manifest is None else BuildPlan.load(plan_path, app.srcdir)
+    else:
+        plan = previous_plan = None
+
+    # All the documents share the same templates
+    template_env = _create_template_env(
+        app.srcdir, builder=app.builder,
+        bytecode_cache_dir=os.path.join(app.doctreedir, 'automodsumm_templates'))
+
+    # Documents are scanned lazily, so that stub generation for a document
+    # can start as soon as it has been scanned. With several scan workers,
+    # the following documents are read and parsed in the meantime; the
+    # results are still consumed in order.
+    workers = app.config.automodsumm_scan_workers
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor:
+        if workers > 1:
+            liness = executor.map(scan, filestosearch)
+        else:
+            liness = map(scan, filestosearch)
+
+        object_workers = app.config.automodsumm_introspection_workers
+        if app.config.automodsumm_parallel_generation and app.parallel > 1:
+            object_workers = max(object_workers, app.parallel)
+        if object_workers > 0:
+            # The objects that stubs are generated for are then introspected
+            # in worker processes, for all the documents at once
+            liness = list(liness)
+            keys = []
+            for sfn, lines in zip(filestosearch, liness):
+                keys.extend(_stub_objects(lines, sfn, app.config.automodsumm_inherited_members,
+                                          shard=shard))
+            prefetch_object_infos(mod_objs_cache, keys, workers=object_workers,
+                                  timeout=app.config.automodsumm_introspection_timeout)
+
+        for sfn, lines in zip(filestosearch, liness):
+            if len(lines) == 0:
+                continue
+
+            unchanged_stubs = set()
+            if plan is not None:
+                with build_stats.timer('stub planning'):
+                    planned = plan_automodsumm_docs(
+                        lines, sfn, plan, app=app, base_path=app.srcdir,
+                        template_env=template_env,
+                        inherited_members=app.config.automodsumm_inherited_members,
+                        included_members=app.config.automodsumm_included_members,
+                        properties_are_attributes=app.config.automodsumm_properties_are_attributes)
+                build_stats.count('stubs planned', len(planned))
+                if previous_plan is not None:
+                    unchanged_stubs = {os.path.normpath(fn) for fn in planned
+                                       if previous_plan.fingerprint(fn) == plan.fingerprint(fn)}
+
+            if not dry_run:
+                with build_stats.timer('stub generation'):
+                    stubs = generate_automodsumm_docs(
+                        lines, sfn, app=app, builder=app.builder,
+                        base_path=app.srcdir,
+                        inherited_members=app.config.automodsumm_inherited_members,
+                        included_members=app.config.automodsumm_included_members,
+                        properties_are_attributes=app.config.automodsumm_properties_are_attributes,
+                        stub_manifest=stub_manifest,
+                        template_env=template_env,
+                        unchanged_stubs=unchanged_stubs,
+                        shard=shard,
+                        in_memory_stubs=in_memory_stubs)
+                record_shard_stubs(app, [fn for fn, written in stubs])
+
+    if in_memory_stubs is not None:
+        _update_stub_digests(env)
+
+    if plan is not None:
+        plan.save(plan_path)
+        logger.info('[automodsumm] build plan written to ' + plan_path)
+
+    if stub_manifest is not None:
+        # The stubs of the other shards are neither orphans nor generated by
+        # this build
+        stub_manifest.carry_forward(other_shard_stubs(app))
+        for fn in stub_manifest.remove_orphans():
+            logger.info('[automodsumm] removed stale stub ' + fn)
+        stub_manifest.save()
+
+    # Save the index now, in case documents are then read in parallel, in
+    # which case modules introspected by the directives are lost.
+    if mod_objs_cache.index is not None:
+        mod_objs_cache.index.save()
+
+
+def save_module_index(app, exception):
+    if mod_objs_cache.index is not None and exception is None:
+        mod_objs_cache.index.save()
+
+
+_automodmarkerrex = re.compile(rb'automod(?:api|summ|-diagram)')
+
+
+def _may_contain_automod(filename):
+    """
+    Quickly check whether the file ``filename`` may contain an automodapi,
+    automodsumm or automod-diagram directive, by searching its raw bytes for
+    the directive names. This avoids reading, decoding and parsing the
+    documents that don't.
+    """
+    with open(filename, 'rb') as f:
+        try:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _automodmarkerrex.search(mm) is not None
+        except ValueError:
+            # empty files can't be memory-mapped
+            return False
+        except OSError:
+            # e.g. special files - let the full scan deal with them
+            return True
+
+
+_documentedmodrex = re.compile(r'^\s*\.\. (?:automodapi|automodsumm|automod-diagram)::'
+                               r'\s*([A-Za-z0-9_.]+)\s*$', re.MULTILINE)
+
+
+def _find_documented_modules(filenames):
+    """
+    Returns the names of the modules documented by the automodapi,
+    automodsumm and automod-diagram directives in the given files, without
+    parsing the files.
+    """
+    modnames = set()
+    for filename in filenames:
+        if not _may_contain_automod(filename):
+            continue
+        with open(filename, encoding='utf8', errors='replace') as f:
+            modnames.update(_documentedmodrex.findall(f.read()))
+    return sorted(modnames)
+
+
+def _iter_automodsumm_blocks(text):
+    """
+    Finds the `automodsumm` directives in ``text``, in a single pass over its
+    lines.
+
+    Yields a ``(lineno, indent, modname, options, optindent)`` tuple for each
+    directive, where ``lineno`` is the line number of the directive,
+    ``indent`` its indentation, and ``options`` the lines that follow it
+    (after any blank lines) with a deeper indentation ``optindent``, up to
+    the first line with a different indentation, as a string including their
+    line endings. ``optindent`` is `None` if there are no such lines.
+    """
+    marker = '.. automodsumm::'
+    lines = text.split('\n')
+    nlines = len(lines)
+    i = 0
+    while i < nlines:
+        line = lines[i]
+        i += 1
+        content = line.lstrip()
+        if not content.startswith(marker):
+            continue
+        args = content[len(marker):].split()
+        if len(args) != 1:
+            continue
+        lineno = i
+        indent = line[:len(line) - len(content)]
+
+        while i < nlines and not lines[i].strip():
+            i += 1
+
+        options = []
+        optindent = None
+        if i < nlines and lines[i].startswith(indent):
+            rest = lines[i][len(indent):]
+            content = rest.lstrip()
+            if content and content != rest:
+                optindent = rest[:len(rest) - len(content)]
+                prefix = indent + optindent
+                options.append(lines[i])
+                i += 1
+                while (i < nlines and lines[i].startswith(prefix) and
+                       lines[i][len(prefix):len(prefix) + 1].strip()):
+                    options.append(lines[i])
+                    i += 1
+
+        optstr = '\n'.join(options)
+        if options and i < nlines:
+            optstr += '\n'
+
+        yield lineno, indent, args[0], optstr, optindent
 
 
 def automodsumm_to_autosummary_lines(fn, app):
@@ -389,21 +1043,12 @@ def automodsumm_to_autosummary_lines(fn, app):
         else:
             filestr = fr.read()
 
-    spl = _automodsummrex.split(filestr)
-    # 0th entry is the stuff before the first automodsumm line
-    indent1s = spl[1::5]
-    mods = spl[2::5]
-    opssecs = spl[3::5]
-    indent2s = spl[4::5]
-    remainders = spl[5::5]
-
     # only grab automodsumm sections and convert them to autosummary with the
     # entries for all the public objects
     newlines = []
 
     # loop over all automodsumms in this document
-    for i, (i1, i2, modnm, ops, rem) in enumerate(zip(indent1s, indent2s, mods,
-                                                      opssecs, remainders)):
+    for lineno, i1, modnm, ops, i2 in _iter_automodsumm_blocks(filestr):
         allindent = i1 + ('    ' if i2 is None else i2)
 
         # filter out functions-only, classes-only, variables-only, and sort
@@ -434,8 +1079,7 @@ def automodsumm_to_autosummary_lines(fn, app):
         if [funcsonly, clssonly, varsonly].count(True) > 1:
             msg = ('Defined more than one of functions-only, classes-only, '
                    'and variables-only.  Skipping this directive.')
-            lnnum = sum([spl[j].count('\n') for j in range(i * 5 + 1)])
-            logger.warning('[automodsumm] ' + msg, (fn, lnnum))
+            logger.warning('[automodsumm] ' + msg, location=(os.path.splitext(fn)[0], lineno))
             continue
 
         # Use the currentmodule directive so we can just put the local names
@@ -448,14 +1092,16 @@ def automodsumm_to_autosummary_lines(fn, app):
         newlines.extend(oplines)
 
         ols = True if len(allowedpkgnms) == 0 else allowedpkgnms
-        for nm, fqn, obj in zip(*find_mod_objs(modnm, onlylocals=ols, sort=sort)):
+        with import_profiler.trigger('automodsumm:: ' + modnm, os.path.splitext(fn)[0]):
+            kinds = mod_objs_cache.find_mod_kinds(modnm, onlylocals=ols, sort=sort)
+        for nm, fqn, kind in zip(*kinds):
             if nm in toskip:
                 continue
-            if funcsonly and not inspect.isroutine(obj):
+            if funcsonly and kind != 'routine':
                 continue
-            if clssonly and not inspect.isclass(obj):
+            if clssonly and kind != 'class':
                 continue
-            if varsonly and (inspect.isclass(obj) or inspect.isroutine(obj)):
+            if varsonly and kind != 'other':
                 continue
             newlines.append(allindent + nm)
 
@@ -465,30 +1111,30 @@ def automodsumm_to_autosummary_lines(fn, app):
     return newlines
 
 
-def generate_automodsumm_docs(lines, srcfn, app=None, suffix='.rst',
-                              base_path=None, builder=None,
-                              template_dir=None,
-                              inherited_members=False,
-                              included_members=('__init__', '__call__'),
-                              *, properties_are_attributes=True):
+def _split_public(names, include_public=()):
     """
-    This function is adapted from
-    `sphinx.ext.autosummary.generate.generate_autosummmary_docs` to
-    generate source for the automodsumm directives that should be
-    autosummarized. Unlike generate_autosummary_docs, this function is
-    called one file at a time.
+    Returns the public names in ``names`` (those that don't start with an
+    underscore, or are in ``include_public``), along with all the names.
+    """
+    public = [x for x in names
+              if x in include_public or not x.startswith('_')]
+    return public, list(names)
+
+
+def _create_template_env(base_path, builder=None, template_dir=None,
+                         bytecode_cache_dir=None):
     """
+    Creates the templating environment used by `generate_automodsumm_docs`.
 
+    If ``bytecode_cache_dir`` is given, compiled templates are cached in this
+    directory, so that they don't need to be compiled again in the next
+    builds. Jinja stores a checksum of the source of each template along with
+    its bytecode, so modified templates are compiled again.
+    """
     from sphinx.jinja2glue import BuiltinTemplateLoader
-    from sphinx.ext.autosummary import import_by_name
-    from sphinx.util.osutil import ensuredir
-    from sphinx.util.inspect import safe_getattr
-    from jinja2 import FileSystemLoader, TemplateNotFound
+    from jinja2 import FileSystemBytecodeCache, FileSystemLoader
     from jinja2.sandbox import SandboxedEnvironment
 
-    from .utils import find_autosummary_in_lines_for_automodsumm as find_autosummary_in_lines
-    from .utils import get_object_type
-
     # Create our own templating environment - here we use Astropy's
     # templates rather than the default autosummary templates, in order to
     # allow docstrings to be shown for methods.
@@ -502,7 +1148,211 @@ def generate_automodsumm_docs(lines, srcfn, app=None, suffix='.rst',
         if template_dir:
             template_dirs.insert(0, template_dir)
         template_loader = FileSystemLoader(template_dirs)
-    template_env = SandboxedEnvironment(loader=template_loader)
+
+    if bytecode_cache_dir is None:
+        bytecode_cache = None
+    else:
+        ensuredir(bytecode_cache_dir)
+        bytecode_cache = FileSystemBytecodeCache(bytecode_cache_dir)
+
+    return SandboxedEnvironment(loader=template_loader, bytecode_cache=bytecode_cache)
+
+
+def _get_stub_template(template_env, template_name, obj_type):
+    """
+    Returns the template used to generate the stub for an object of type
+    ``obj_type``, unless a template is given explicitly by ``template_name``.
+    """
+    from jinja2 import TemplateNotFound
+
+    if template_name is not None:
+        return template_env.get_template(template_name)
+    tmplstr = 'autosummary_core/%s.rst'
+    try:
+        return template_env.get_template(tmplstr % obj_type)
+    except TemplateNotFound:
+        return template_env.get_template(tmplstr % 'base')
+
+
+def _stub_filename(item, base_path, suffix):
+    """
+    Returns the path of the stub file for an item found by
+    `~sphinx_automodapi.utils.find_autosummary_in_lines_for_automodsumm`, or
+    `None` if it has no stub file.
+    """
+    name, path = item[:2]
+    if path is None:
+        return None
+    return os.path.join(os.path.abspath(os.path.join(base_path, path)), name + suffix)
+
+
+def _find_reference_file(base_path, path, mod_name):
+    """
+    Returns the path of the file for reference footnotes of module
+    ``mod_name``, relative to the directory ``path`` of the stub files, or
+    `None` if there is no such file.
+    """
+    # We now check whether a file for reference footnotes exists for
+    # the module being documented. We first check if the
+    # current module is a file or a directory, as this will give a
+    # different path for the reference file. For example, if
+    # documenting astropy.wcs then the reference file is at
+    # ../wcs/references.txt, while if we are documenting
+    # astropy.config.logging_helper (which is at
+    # astropy/config/logging_helper.py) then the reference file is set
+    # to ../config/references.txt
+    if '.' in mod_name:
+        mod_name_dir = mod_name.split('.', 1)[1].replace('.', os.sep)
+    else:
+        mod_name_dir = mod_name
+
+    if (not os.path.isdir(os.path.join(base_path, mod_name_dir))
+            and os.path.isdir(os.path.join(base_path, mod_name_dir.rsplit(os.sep, 1)[0]))):
+        mod_name_dir = mod_name_dir.rsplit(os.sep, 1)[0]
+
+    # We then have to check whether it exists, and if so, we pass it
+    # to the template.
+    if os.path.exists(os.path.join(base_path, mod_name_dir, 'references.txt')):
+        # An important subtlety here is that the path we pass in has
+        # to be relative to the file being generated, so we have to
+        # figure out the right number of '..'s
+        ndirsback = path.replace(str(base_path), '').count(os.sep)
+        ref_file_rel_segments = ['..'] * ndirsback
+        ref_file_rel_segments.append(mod_name_dir)
+        ref_file_rel_segments.append('references.txt')
+        return os.path.join(*ref_file_rel_segments).replace(os.sep, '/')
+    return None
+
+
+def _stub_objects(lines, srcfn, inherited_members=False, shard=None):
+    """
+    Returns the ``(name, include_base)`` keys, as given to
+    `~sphinx_automodapi.utils.ModObjsCache.object_info`, of the objects that
+    `generate_automodsumm_docs` generates stub files for from ``lines``.
+    """
+    from .utils import find_autosummary_in_lines_for_automodsumm as find_autosummary_in_lines
+
+    # Unknown options are reported when the stubs are generated
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        items = find_autosummary_in_lines(lines, filename=srcfn)
+
+    keys = []
+    for name, path, template_name, inherited_mem, noindex in items:
+        if path is not None and in_shard(name.rsplit('.', 1)[0], shard):
+            keys.append((name, inherited_members if inherited_mem is None else inherited_mem))
+    return keys
+
+
+def plan_automodsumm_docs(lines, srcfn, plan, app=None, suffix='.rst',
+                          base_path=None, template_env=None,
+                          inherited_members=False,
+                          included_members=('__init__', '__call__'),
+                          properties_are_attributes=True):
+    """
+    Adds the stub files that `generate_automodsumm_docs` would generate for
+    the automodsumm directives in ``lines`` to ``plan``, a
+    `~sphinx_automodapi.build_plan.BuildPlan`, without rendering or writing
+    them.
+
+    The objects to document are imported (unless they are described in the
+    module index), to find their type and the template used for their stub.
+    Returns the list of the stub files added to the plan.
+    """
+    from .utils import find_autosummary_in_lines_for_automodsumm as find_autosummary_in_lines
+
+    planned = []
+    for item in sorted(set(find_autosummary_in_lines(lines, filename=srcfn))):
+        name, path, template_name, inherited_mem, noindex = item
+        if path is None:
+            continue
+        path = os.path.abspath(os.path.join(base_path, path))
+        include_base = inherited_members if inherited_mem is None else inherited_mem
+
+        try:
+            with import_profiler.trigger('automodsumm stub ' + name, os.path.splitext(srcfn)[0]):
+                info = mod_objs_cache.object_info(name, include_base=include_base, app=app)
+        except ImportError as e:
+            # Unless this is a dry run, the failure is reported when
+            # generating the stubs
+            msg = '[automodsumm] failed to import {!r}: {}'.format(name, e)
+            if app is not None and app.config.automodsumm_dry_run:
+                logger.warning(msg)
+            else:
+                logger.debug(msg)
+            continue
+
+        name, obj_type = info['name'], info['objtype']
+        template = _get_stub_template(template_env, template_name, obj_type)
+        mod_name = '.'.join(name.split('.')[:-2 if obj_type in ('method', 'attribute') else -1])
+
+        options = {'noindex': noindex}
+        if obj_type == 'class':
+            options['inherited_members'] = include_base
+            options['included_members'] = list(included_members)
+            options['properties_are_attributes'] = properties_are_attributes
+
+        fn = os.path.join(path, name + suffix)
+        planned.append(fn)
+        plan.add(fn, {
+            'name': name,
+            'source': srcfn,
+            'objtype': obj_type,
+            'template': template.name,
+            'options': options,
+            'referencefile': _find_reference_file(base_path, path, mod_name),
+            'inputs': {'template': plan.template_hash(template_env, template.name),
+                       'sources': plan.file_hashes(info['files'])},
+        })
+
+    return planned
+
+
+def generate_automodsumm_docs(lines, srcfn, app=None, suffix='.rst',
+                              base_path=None, builder=None,
+                              template_dir=None,
+                              inherited_members=False,
+                              included_members=('__init__', '__call__'),
+                              *, properties_are_attributes=True,
+                              stub_manifest=None, template_env=None,
+                              unchanged_stubs=(), shard=None, in_memory_stubs=None):
+    """
+    This function is adapted from
+    `sphinx.ext.autosummary.generate.generate_autosummmary_docs` to
+    generate source for the automodsumm directives that should be
+    autosummarized. Unlike generate_autosummary_docs, this function is
+    called one file at a time.
+
+    If ``stub_manifest`` is given, stub files that it tracks are regenerated
+    if their content changed, instead of being skipped because they exist.
+
+    If ``template_env`` is given, it is used to load the templates instead of
+    creating a new templating environment, so that templates loaded for one
+    file can be reused for the next ones.
+
+    ``unchanged_stubs`` are the paths of stub files whose inputs did not
+    change since the previous build according to the build plan. If they are
+    tracked by ``stub_manifest`` and were not modified, they are kept without
+    being rendered again.
+
+    If ``shard`` is given, as returned by
+    `~sphinx_automodapi.sharding.parse_shard`, only the stub files for
+    objects in the modules of this shard are generated.
+
+    If ``in_memory_stubs`` is given, the rendered stubs are stored in this
+    dict, by file name, and the stub files only contain a placeholder. Stub
+    files that are placeholders are otherwise regenerated, like missing files.
+
+    Returns a list of ``(filename, written)`` tuples for the stub files of
+    all the objects (in the shard), where ``written`` is whether the file was
+    written by this call rather than left as it was.
+    """
+
+    from .utils import find_autosummary_in_lines_for_automodsumm as find_autosummary_in_lines
+
+    if template_env is None:
+        template_env = _create_template_env(base_path, builder=builder,
+                                            template_dir=template_dir)
 
     # read
     # items = find_autosummary_in_files(sources)
@@ -519,198 +1369,179 @@ def generate_automodsumm_docs(lines, srcfn, app=None, suffix='.rst',
     # remove possible duplicates
     items = list(set(items))
 
-    # keep track of new files
-    new_files = []
-
-    # write
-    for name, path, template_name, inherited_mem, noindex in sorted(items):
+    if shard is not None:
+        n_items = len(items)
+        expected = [item for item in items if item[1] is not None]
+        items = [item for item in items if in_shard(item[0].rsplit('.', 1)[0], shard)]
+        build_stats.count('stubs skipped (other shards)', n_items - len(items))
+        if app is not None:
+            record_expected_stubs(
+                app, [_stub_filename(item, base_path, suffix) for item in expected],
+                [_stub_filename(item, base_path, suffix) for item in items
+                 if item[1] is not None])
+
+    def generate_stub(item):
+        """
+        Write the stub file for one item if needed, and return its file name
+        and whether it was written, or `None` if the item has no stub file.
+        """
+
+        name, path, template_name, inherited_mem, noindex = item
 
         if path is None:
             # The corresponding autosummary:: directive did not have
             # a :toctree: option
-            continue
+            return None
 
         path = os.path.abspath(os.path.join(base_path, path))
         ensuredir(path)
 
+        if inherited_mem is not None:
+            # option set in this specifc directive
+            include_base = inherited_mem
+        else:
+            # use default value
+            include_base = inherited_members
+
         try:
-            import_by_name_values = import_by_name(name)
+            with import_profiler.trigger('automodsumm stub ' + name, os.path.splitext(srcfn)[0]):
+                info = mod_objs_cache.object_info(name, include_base=include_base, app=app)
         except ImportError as e:
             logger.warning('[automodsumm] failed to import {!r}: {}'.format(name, e))
-            continue
+            return None
 
-        # if block to accommodate Sphinx's v1.2.2 and v1.2.3 respectively
-        if len(import_by_name_values) == 3:
-            name, obj, parent = import_by_name_values
-        elif len(import_by_name_values) == 4:
-            name, obj, parent, module_name = import_by_name_values
+        name = info['name']
 
         fn = os.path.join(path, name + suffix)
 
-        # skip it if it exists
-        if os.path.isfile(fn):
-            continue
-
-        new_files.append(fn)
-
-        with open(fn, 'w', encoding='utf8') as f:
-
-            obj_type = get_object_type(app, obj, parent)
-
-            if template_name is not None:
-                template = template_env.get_template(template_name)
+        # skip it if it exists. If a stub manifest is used, the files that it
+        # tracks are instead regenerated when their content changes.
+        # Placeholders written with in_memory_stubs are always regenerated.
+        placeholder = _stub_placeholder(name)
+        is_placeholder = _is_stub_placeholder(fn, placeholder)
+        untracked = (os.path.isfile(fn) and not is_placeholder and
+                     (stub_manifest is None or not stub_manifest.is_tracked(fn)))
+        if untracked and stub_manifest is None:
+            build_stats.count('stubs skipped (already exist)')
+            return fn, False
+
+        # Stubs kept in memory are always rendered, since the file only has a
+        # placeholder
+        if (stub_manifest is not None and in_memory_stubs is None and
+                os.path.normpath(fn) in unchanged_stubs and stub_manifest.keep(fn)):
+            build_stats.count('stubs unchanged (from build plan)')
+            return fn, False
+
+        obj_type = info['objtype']
+
+        template = _get_stub_template(template_env, template_name, obj_type)
+
+        ns = {}
+
+        if obj_type in ('module', 'class'):
+            members = dict(info['members'])
+            members[None] = info['all_members']
+
+        if obj_type == 'module':
+            ns['members'] = _split_public(members[None])
+            ns['functions'], ns['all_functions'] = \
+                _split_public(members.get('function', []))
+            ns['classes'], ns['all_classes'] = \
+                _split_public(members.get('class', []))
+            ns['exceptions'], ns['all_exceptions'] = \
+                _split_public(members.get('exception', []))
+        elif obj_type == 'class':
+            ns['members'] = _split_public(members[None])
+            ns['methods'], ns['all_methods'] = \
+                _split_public(members.get('method', []), included_members)
+            ns['attributes'], ns['all_attributes'] = \
+                _split_public(members.get('attribute', []))
+            public_properties, all_properties = \
+                _split_public(members.get('property', []))
+            if properties_are_attributes:
+                ns['attributes'].extend(public_properties)
+                ns['all_attributes'].extend(all_properties)
             else:
-                tmplstr = 'autosummary_core/%s.rst'
-                try:
-                    template = template_env.get_template(tmplstr % obj_type)
-                except TemplateNotFound:
-                    template = template_env.get_template(tmplstr % 'base')
-
-            def get_members_mod(obj, typ, include_public=[]):
-                """
-                typ = None -> all
-                """
-                items = []
-                for name in dir(obj):
-                    try:
-                        obj_type = get_object_type(app, safe_getattr(obj, name), obj)
-                    except AttributeError:
-                        continue
-                    if typ is None or obj_type == typ:
-                        items.append(name)
-                public = [x for x in items
-                          if x in include_public or not x.startswith('_')]
-                return public, items
-
-            def get_members_class(obj, typ, include_public=[],
-                                  include_base=False):
-                """
-                typ = None -> all
-                include_base -> include attrs that are from a base class
-                """
-                items = []
-
-                # using dir gets all of the attributes, including the elements
-                # from the base class, otherwise use __dict__
-                if include_base:
-                    names = dir(obj)
-                else:
-                    names = getattr(obj, '__dict__').keys()
-
-                    # add dataclass_field names for dataclass classes
-                    if dataclasses.is_dataclass(obj):
-                        dataclass_fieldnames = getattr(obj, '__dataclass_fields__').keys()
-                        names = list(set(list(names) + list(dataclass_fieldnames)))
-
-                for name in names:
-                    try:
-                        obj_type = get_object_type(app, safe_getattr(obj, name), obj)
-                    except AttributeError:
-                        # for dataclasses try to get the attribute from the __dataclass_fields__
-                        if dataclasses.is_dataclass(obj):
-                            try:
-                                attr = obj.__dataclass_fields__[name]
-                                obj_type = get_object_type(app, attr, obj)
-                            except KeyError:
-                                continue
-                    if typ is None or obj_type == typ:
-                        items.append(name)
-                    # elif typ == 'attribute' and obj_type == 'property':
-                    #     # In Sphinx 2.0 and above, properties have a separate
-                    #     # object type, but we treat them the same here.
-                    #     items.append(name)
-                public = [x for x in items
-                          if x in include_public or not x.startswith('_')]
-                return public, items
-
-            ns = {}
-
-            if obj_type == 'module':
-                ns['members'] = get_members_mod(obj, None)
-                ns['functions'], ns['all_functions'] = \
-                    get_members_mod(obj, 'function')
-                ns['classes'], ns['all_classes'] = \
-                    get_members_mod(obj, 'class')
-                ns['exceptions'], ns['all_exceptions'] = \
-                    get_members_mod(obj, 'exception')
-            elif obj_type == 'class':
-                if inherited_mem is not None:
-                    # option set in this specifc directive
-                    include_base = inherited_mem
-                else:
-                    # use default value
-                    include_base = inherited_members
-
-                ns['members'] = get_members_class(obj, None,
-                                                  include_base=include_base)
-                ns['methods'], ns['all_methods'] = \
-                    get_members_class(obj, 'method', included_members,
-                                      include_base=include_base)
-                ns['attributes'], ns['all_attributes'] = \
-                    get_members_class(obj, 'attribute',
-                                      include_base=include_base)
-                public_properties, all_properties = \
-                    get_members_class(obj, 'property',
-                                      include_base=include_base)
-                if properties_are_attributes:
-                    ns['attributes'].extend(public_properties)
-                    ns['all_attributes'].extend(all_properties)
-                else:
-                    ns['properties'] = public_properties
-                    ns['all_properties'] = all_properties
-                ns['methods'].sort()
-                ns['attributes'].sort()
-
-            parts = name.split('.')
-            if obj_type in ('method', 'attribute'):
-                mod_name = '.'.join(parts[:-2])
-                cls_name = parts[-2]
-                obj_name = '.'.join(parts[-2:])
-                ns['class'] = cls_name
-            else:
-                mod_name, obj_name = '.'.join(parts[:-1]), parts[-1]
-
-            ns['noindex'] = noindex
-            ns['fullname'] = name
-            ns['module'] = mod_name
-            ns['objname'] = obj_name
-            ns['name'] = parts[-1]
-
-            ns['objtype'] = obj_type
-            ns['underline'] = len(obj_name) * '='
-
-            # We now check whether a file for reference footnotes exists for
-            # the module being documented. We first check if the
-            # current module is a file or a directory, as this will give a
-            # different path for the reference file. For example, if
-            # documenting astropy.wcs then the reference file is at
-            # ../wcs/references.txt, while if we are documenting
-            # astropy.config.logging_helper (which is at
-            # astropy/config/logging_helper.py) then the reference file is set
-            # to ../config/references.txt
-            if '.' in mod_name:
-                mod_name_dir = mod_name.split('.', 1)[1].replace('.', os.sep)
+                ns['properties'] = public_properties
+                ns['all_properties'] = all_properties
+            ns['methods'].sort()
+            ns['attributes'].sort()
+
+        parts = name.split('.')
+        if obj_type in ('method', 'attribute'):
+            mod_name = '.'.join(parts[:-2])
+            cls_name = parts[-2]
+            obj_name = '.'.join(parts[-2:])
+            ns['class'] = cls_name
+        else:
+            mod_name, obj_name = '.'.join(parts[:-1]), parts[-1]
+
+        ns['noindex'] = noindex
+        ns['fullname'] = name
+        ns['module'] = mod_name
+        ns['objname'] = obj_name
+        ns['name'] = parts[-1]
+
+        ns['objtype'] = obj_type
+        ns['underline'] = len(obj_name) * '='
+
+        referencefile = _find_reference_file(base_path, path, mod_name)
+        if referencefile is not None:
+            ns['referencefile'] = referencefile
+
+        # The template is rendered as a stream of chunks, which are cleaned
+        # up as they come
+        chunks = iter_cleanup_whitespace(template.generate(**ns))
+
+        if stub_manifest is not None or in_memory_stubs is not None:
+            with build_stats.timer('template rendering'):
+                rendered = ''.join(chunks)
+            if untracked:
+                # An existing file that is not tracked by the manifest (e.g.
+                # written by hand) is left alone, and only starts being
+                # tracked if it already has the expected content.
+                with open(fn, encoding='utf8') as f:
+                    if f.read() == rendered:
+                        stub_manifest.record(fn, rendered)
+                build_stats.count('stubs skipped (already exist)')
+                return fn, False
+            if in_memory_stubs is not None:
+                # Sphinx is given the rendered stub by substitute_in_memory_stub
+                in_memory_stubs[os.path.normpath(fn)] = rendered
+                build_stats.count('stubs kept in memory')
+                rendered = placeholder
+            if stub_manifest is not None:
+                unchanged = not stub_manifest.record(fn, rendered)
             else:
-                mod_name_dir = mod_name
-
-            if (not os.path.isdir(os.path.join(base_path, mod_name_dir))
-                    and os.path.isdir(os.path.join(base_path, mod_name_dir.rsplit(os.sep, 1)[0]))):
-                mod_name_dir = mod_name_dir.rsplit(os.sep, 1)[0]
+                unchanged = is_placeholder
+            if unchanged:
+                # The content is unchanged - leave the file, and its
+                # modification time, untouched
+                build_stats.count('stubs unchanged')
+                return fn, False
+            chunks = [rendered]
+
+        # Without a manifest, this includes the time spent rendering
+        with build_stats.timer('stub writing'):
+            with open(fn, 'w', encoding='utf8') as f:
+                f.writelines(chunks)
+        build_stats.count('stubs written')
+
+        return fn, True
+
+    # Items listed by several directives with different options have the same
+    # stub file, which is only generated for the first one (in sorted order).
+    # Options that are not set are None, which can't be compared with strings.
+    items_by_fn = {}
+    for item in sorted(items, key=lambda item: [(value is not None, str(value))
+                                                for value in item]):
+        items_by_fn.setdefault(_stub_filename(item, base_path, suffix) or item, item)
+    items = list(items_by_fn.values())
 
-            # We then have to check whether it exists, and if so, we pass it
-            # to the template.
-            if os.path.exists(os.path.join(base_path, mod_name_dir, 'references.txt')):
-                # An important subtlety here is that the path we pass in has
-                # to be relative to the file being generated, so we have to
-                # figure out the right number of '..'s
-                ndirsback = path.replace(str(base_path), '').count(os.sep)
-                ref_file_rel_segments = ['..'] * ndirsback
-                ref_file_rel_segments.append(mod_name_dir)
-                ref_file_rel_segments.append('references.txt')
-                ns['referencefile'] = os.path.join(*ref_file_rel_segments).replace(os.sep, '/')
+    # write
+    stubs = [generate_stub(item) for item in items]
 
-            rendered = template.render(**ns)
-            f.write(cleanup_whitespace(rendered))
+    return [stub for stub in stubs if stub is not None]
 
 
 def setup(app):
@@ -721,18 +1552,43 @@ def setup(app):
     from . import autodoc_enhancements
     app.setup_extension(autodoc_enhancements.__name__)
 
+    # timing and counters for each phase
+    from . import instrumentation
+    app.setup_extension(instrumentation.__name__)
+
     # need inheritance-diagram for automod-diagram
     app.setup_extension('sphinx.ext.inheritance_diagram')
 
     app.add_directive('automod-diagram', Automoddiagram)
     app.add_directive('automodsumm', Automodsumm)
     app.connect('builder-inited', process_automodsumm_generation)
+    app.connect('build-finished', save_module_index)
+    app.connect('build-finished', write_shard_manifest)
+    app.connect('autodoc-process-docstring', record_class_fullname)
+    # Stubs kept in memory replace their placeholder before other extensions
+    # see the source
+    app.connect('source-read', substitute_in_memory_stub, priority=100)
+    app.connect('env-get-outdated', outdated_in_memory_stubs)
+    app.connect('build-finished', copy_in_memory_stub_sources)
 
     app.add_config_value('automodsumm_writereprocessed', False, True)
     app.add_config_value('automodsumm_inherited_members', False, 'env')
     app.add_config_value(
         'automodsumm_included_members', ['__init__', '__call__'], 'env')
     app.add_config_value('automodsumm_properties_are_attributes', True, 'env')
+    app.add_config_value('automodsumm_parallel_generation', False, '')
+    app.add_config_value('automodsumm_incremental_generation', False, '')
+    app.add_config_value('automodsumm_in_memory_stubs', False, '')
+    app.add_config_value('automodsumm_scan_exclude', [], '')
+    app.add_config_value('automodsumm_scan_workers', 1, '')
+    app.add_config_value('automodsumm_module_index', False, '')
+    app.add_config_value('automodsumm_introspection_workers', 0, '')
+    app.add_config_value('automodsumm_introspection_timeout', 60, '')
+    app.add_config_value('automodsumm_static_discovery', False, '')
+    app.add_config_value('automodsumm_diagram_cache', False, '', (bool, str))
+    app.add_config_value('automodsumm_build_plan', False, '', (bool, str))
+    app.add_config_value('automodsumm_dry_run', False, '')
+    app.add_config_value('automodsumm_shard', None, '', (str, tuple, list))
 
     return {'parallel_read_safe': True,
             'parallel_write_safe': True}
@@ -0,0 +1,241 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Build plans listing the stub files generated by `automodsumm`.
+
+With the ``automodsumm_build_plan`` configuration option, the documents are
+scanned for ``automodapi`` and ``automodsumm`` directives as usual, and every
+stub file that would be generated for them is listed in a JSON manifest, the
+build plan, along with the template and options used to render it and a
+fingerprint of its inputs: the name and type of the object, the template
+(and the templates it extends or includes), the options, and the source
+files of the modules the object and its members are defined in. The
+fingerprint of a stub only changes when the stub may need to be rendered
+again, so it can e.g. be used as a cache key for pre-rendered stubs.
+
+The plan has the following format::
+
+    {"version": 1,
+     "sphinx": "<Sphinx version>",
+     "automodapi": "<sphinx-automodapi version>",
+     "stubs": {"<stub path relative to the source directory>": {
+         "name": "<full name of the object>",
+         "source": "<document containing the directive>",
+         "objtype": "<object type>",
+         "template": "<template name>",
+         "options": {...},
+         "referencefile": "<path of the references file or null>",
+         "inputs": {"template": "<hash>", "sources": ["<hash>", ...]},
+         "fingerprint": "<hash>"},
+      ...}}
+
+With the ``automodsumm_dry_run`` configuration option, the plan is written
+without rendering or writing any stub file. This module can also be run to
+only write the plan of a project, without building it, and to compare it
+with a previous plan::
+
+    python -m sphinx_automodapi.build_plan docs plan.json --diff old_plan.json
+
+When ``automodsumm_build_plan`` is used along with
+``automodsumm_incremental_generation``, the plan of the previous build is
+compared with the new one, and stubs whose fingerprint did not change are
+not rendered again if they are still present and unmodified.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+
+import sphinx
+
+from .version import version
+
+__all__ = ['BuildPlan']
+
+
+def _hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class BuildPlan:
+    """
+    The stub files to generate, keyed by their path relative to the source
+    directory ``srcdir``.
+    """
+
+    filename = 'automodsumm_plan.json'
+
+    # Bump when the format of the plan changes
+    version = 1
+
+    def __init__(self, srcdir):
+        self.srcdir = str(srcdir)
+        self.stubs = {}
+        self._file_hashes = {}
+        self._template_hashes = {}
+
+    def _key(self, fn):
+        return os.path.relpath(fn, self.srcdir).replace(os.sep, '/')
+
+    def _fingerprint(self, entry):
+        data = {'sphinx': sphinx.__version__, 'automodapi': version, 'entry': entry}
+        return _hash(json.dumps(data, sort_keys=True).encode('utf8'))
+
+    def add(self, fn, entry):
+        """
+        Adds the stub file ``fn`` described by ``entry`` to the plan.
+        """
+        entry = dict(entry, fingerprint=self._fingerprint(entry))
+        self.stubs[self._key(fn)] = entry
+
+    def fingerprint(self, fn):
+        """
+        Returns the fingerprint of the stub file ``fn``, or `None` if it is not
+        in the plan.
+        """
+        entry = self.stubs.get(self._key(fn))
+        return None if entry is None else entry['fingerprint']
+
+    def file_hashes(self, filenames):
+        """
+        Returns the sorted hashes of the content of ``filenames``.
+        """
+        hashes = []
+        for filename in filenames:
+            if filename not in self._file_hashes:
+                try:
+                    with open(filename, 'rb') as f:
+                        self._file_hashes[filename] = _hash(f.read())
+                except OSError:
+                    self._file_hashes[filename] = None
+            if self._file_hashes[filename] is not None:
+                hashes.append(self._file_hashes[filename])
+        return sorted(hashes)
+
+    def template_hash(self, template_env, name):
+        """
+        Returns a hash of the source of template ``name`` and of the templates
+        it extends, includes or imports.
+        """
+        from jinja2 import meta
+
+        if name not in self._template_hashes:
+            # Guard against templates referring to themselves
+            self._template_hashes[name] = None
+            source = template_env.loader.get_source(template_env, name)[0]
+            parts = [source]
+            for ref in sorted(meta.find_referenced_templates(template_env.parse(source)),
+                              key=str):
+                if ref is not None:
+                    parts.append(self.template_hash(template_env, ref) or '')
+            self._template_hashes[name] = _hash('\0'.join(parts).encode('utf8'))
+        return self._template_hashes[name]
+
+    def diff(self, previous):
+        """
+        Compares this plan with a ``previous`` plan (which can be `None`).
+
+        Returns a dictionary with the sorted lists of the stubs that were
+        ``'added'``, ``'removed'``, ``'changed'`` (i.e. need to be rendered
+        again) and ``'unchanged'`` since the previous plan.
+        """
+        old = {} if previous is None else previous.stubs
+        result = {'added': [], 'removed': sorted(set(old) - set(self.stubs)),
+                  'changed': [], 'unchanged': []}
+        for key, entry in sorted(self.stubs.items()):
+            if key not in old:
+                result['added'].append(key)
+            elif old[key]['fingerprint'] != entry['fingerprint']:
+                result['changed'].append(key)
+            else:
+                result['unchanged'].append(key)
+        return result
+
+    def save(self, path):
+        """
+        Writes the plan to the JSON file ``path``.
+        """
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        with open(path, 'w', encoding='utf8') as f:
+            json.dump({'version': self.version,
+                       'sphinx': sphinx.__version__,
+                       'automodapi': version,
+                       'stubs': self.stubs}, f, indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, path, srcdir):
+        """
+        Reads a plan written by `save`, or returns `None` if the file doesn't
+        exist or is not a valid plan.
+        """
+        try:
+            with open(path, encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(data, dict) or data.get('version') != cls.version:
+            return None
+        plan = cls(srcdir)
+        plan.stubs = data.get('stubs', {})
+        return plan
+
+
+def build_plan_path(app):
+    """
+    Returns the path where the build plan is written, as given by the
+    ``automodsumm_build_plan`` configuration option, or `None`. In a dry run,
+    the plan is written to the doctree directory by default.
+    """
+    path = app.config.automodsumm_build_plan
+    if not path and not app.config.automodsumm_dry_run:
+        return None
+    if not isinstance(path, str):
+        return os.path.join(app.doctreedir, BuildPlan.filename)
+    return os.path.join(app.confdir, path)
+
+
+def main(args=None):
+
+    from sphinx.application import Sphinx
+    from sphinx.util.docutils import docutils_namespace, patch_docutils
+
+    parser = argparse.ArgumentParser(
+        description='Write the plan of the stub files generated by automodsumm '
+                    'for a Sphinx project, without generating them.')
+    parser.add_argument('sourcedir', help='Source directory of the project')
+    parser.add_argument('output', help='JSON file to write the plan to')
+    parser.add_argument('-c', dest='confdir',
+                        help='Directory containing conf.py (defaults to sourcedir)')
+    parser.add_argument('--diff', metavar='PLAN',
+                        help='Print the differences with a previous plan')
+    args = parser.parse_args(args)
+
+    sourcedir = os.path.abspath(args.sourcedir)
+    output = os.path.abspath(args.output)
+    confdir = sourcedir if args.confdir is None else os.path.abspath(args.confdir)
+
+    # The plan is written when the application is initialized, so the
+    # project doesn't need to be built.
+    with tempfile.TemporaryDirectory() as tmpdir, patch_docutils(confdir), docutils_namespace():
+        doctreedir = os.path.join(tmpdir, 'doctrees')
+        Sphinx(sourcedir, confdir, os.path.join(tmpdir, 'out'), doctreedir, 'dummy',
+               confoverrides={'automodsumm_build_plan': True,
+                              'automodsumm_dry_run': True},
+               status=None)
+        plan = BuildPlan.load(os.path.join(doctreedir, BuildPlan.filename), sourcedir)
+
+    plan.save(output)
+
+    if args.diff is not None:
+        for change, keys in plan.diff(BuildPlan.load(args.diff, sourcedir)).items():
+            if change != 'unchanged':
+                for key in keys:
+                    print(f'{change}: {key}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,420 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Timing and counters for the different phases of sphinx-automodapi.
+
+When the ``automodapi_build_stats`` configuration option is ``True``, the
+wall time spent in each phase of `automodapi`_ and `automodsumm`_ (expanding
+``automodapi`` directives, scanning documents, introspecting modules,
+classifying class members, rendering and writing stub files, and creating
+inheritance diagrams) is recorded, along with counters such as the number of
+modules introspected or of stub files written. At the end of the build, a
+short summary is logged and the full report is written in JSON format to
+``automodapi_stats.json`` in the doctree directory.
+
+The time reported for a phase includes the time spent in the phases nested
+in it (e.g. rendering stub files is part of generating them), and phases run
+in several threads at once count the time spent in each thread. Statistics
+from documents read in parallel by worker processes (``sphinx-build -j``) are
+included in the report.
+
+When the ``automodapi_import_profile`` configuration option is ``True``, the
+time spent importing each module during the build is recorded by an import
+hook (see `ImportProfiler`), along with the directive that triggered the
+import: an ``automodapi`` or `automodsumm`_ directive whose module is
+introspected, an `automod-diagram`_ directive, or the generation of the stub
+file of an object. For each module, the cumulative import time (including
+the modules it imports) and the self time (excluding them) are recorded. At
+the end of the build, the modules and directives with the longest import
+times are logged, and the full ranked report is written in JSON format to
+``automodapi_import_profile.json`` in the doctree directory. Modules that
+were already imported before the build started (e.g. by ``conf.py``), and
+modules imported by the worker processes started because of
+``automodsumm_introspection_workers``, are not included.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from sphinx.util import logging
+from sphinx.util.osutil import ensuredir
+
+__all__ = ['BuildStats', 'build_stats', 'ImportProfiler', 'import_profiler']
+
+logger = logging.getLogger(__name__)
+
+
+class BuildStats:
+    """
+    Accumulates the wall time spent in each phase of the build and named
+    counters. Recording is a no-op unless the statistics are enabled.
+    """
+
+    filename = 'automodapi_stats.json'
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all the statistics recorded in this process.
+        """
+        with self._lock:
+            self._main_pid = self._pid = os.getpid()
+            self.times = {}
+            self.calls = {}
+            self.counters = {}
+
+    def _check_process(self):
+        # Statistics inherited by a forked worker process have already been
+        # recorded in the main process, so start over in the worker.
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self.times = {}
+            self.calls = {}
+            self.counters = {}
+
+    @property
+    def in_worker(self):
+        """
+        Whether this is a worker process forked after the statistics were reset.
+        """
+        return os.getpid() != self._main_pid
+
+    @contextmanager
+    def timer(self, phase):
+        """
+        Context manager recording the time spent in ``phase``.
+        """
+        if not self.enabled:
+            yield
+            return
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._check_process()
+                self.times[phase] = self.times.get(phase, 0.) + elapsed
+                self.calls[phase] = self.calls.get(phase, 0) + 1
+
+    def count(self, name, n=1):
+        """
+        Increments the counter ``name`` by ``n``.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._check_process()
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def as_dict(self):
+        with self._lock:
+            self._check_process()
+            return {'times': dict(self.times),
+                    'calls': dict(self.calls),
+                    'counters': dict(self.counters)}
+
+    def merge(self, other):
+        """
+        Adds the statistics ``other``, as returned by `as_dict`.
+        """
+        with self._lock:
+            self._check_process()
+            for attr in ('times', 'calls', 'counters'):
+                mine = getattr(self, attr)
+                for key, value in other[attr].items():
+                    mine[key] = mine.get(key, 0) + value
+
+    def summary(self):
+        """
+        Returns a short human-readable summary of the statistics.
+        """
+        stats = self.as_dict()
+        lines = []
+        for phase, elapsed in sorted(stats['times'].items(), key=lambda item: -item[1]):
+            lines.append(f'{phase}: {elapsed:.3f} s ({stats["calls"][phase]} calls)')
+        for name, value in sorted(stats['counters'].items()):
+            lines.append(f'{name}: {value}')
+        return lines
+
+
+build_stats = BuildStats()
+
+
+def reset_build_stats(app):
+    build_stats.enabled = app.config.automodapi_build_stats
+    build_stats.reset()
+
+
+def store_worker_stats(app, doctree):
+    # Documents read by worker processes only send their environment back to
+    # the main process, so keep the statistics of the worker there.
+    if build_stats.enabled and build_stats.in_worker:
+        app.env.automodapi_stats = build_stats.as_dict()
+
+
+def merge_worker_stats(app, env, docnames, env_other):
+    if build_stats.enabled and hasattr(env_other, 'automodapi_stats'):
+        build_stats.merge(env_other.automodapi_stats)
+
+
+def write_build_stats(app, exception):
+    if not build_stats.enabled or exception is not None:
+        return
+
+    logger.info('[automodapi] build statistics:')
+    for line in build_stats.summary():
+        logger.info('    ' + line)
+
+    ensuredir(app.doctreedir)
+    filename = os.path.join(app.doctreedir, build_stats.filename)
+    with open(filename, 'w', encoding='utf8') as f:
+        json.dump(build_stats.as_dict(), f, indent=1, sort_keys=True)
+    logger.info('[automodapi] build statistics written to ' + filename)
+
+
+class _TimedLoader:
+    """
+    Wraps the loader of a module to time its import.
+    """
+
+    def __init__(self, profiler, loader):
+        self._profiler = profiler
+        self.loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def create_module(self, spec):
+        # Extension modules are initialized when they are created
+        with self._profiler._record(spec.name):
+            return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        # Once loaded, the module should look the same as if it was imported
+        # without the profiler
+        module.__loader__ = self.loader
+        spec = getattr(module, '__spec__', None)
+        if spec is not None and spec.loader is self:
+            spec.loader = self.loader
+        with self._profiler._record(module.__name__):
+            self.loader.exec_module(module)
+
+
+class ImportProfiler:
+    """
+    Records the time spent importing each module, and the directive that
+    triggered the import.
+
+    The profiler is a meta path finder which, once installed, finds modules
+    with the other finders in `sys.meta_path` and wraps their loader to time
+    the creation and execution of the modules. Directives mark the imports
+    they trigger with `trigger`.
+    """
+
+    filename = 'automodapi_import_profile.json'
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        """
+        Clears all the import times recorded in this process.
+        """
+        with self._lock:
+            self._pid = os.getpid()
+            self.modules = {}
+
+    def _check_process(self):
+        # Imports inherited by a forked worker process have already been
+        # recorded in the main process, so start over in the worker.
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self.modules = {}
+
+    def install(self):
+        if self not in sys.meta_path:
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        # Modules found while another finder looks for a module are not timed
+        if getattr(self._local, 'finding', False):
+            return None
+        self._local.finding = True
+        try:
+            for finder in list(sys.meta_path):
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    break
+            else:
+                return None
+        finally:
+            self._local.finding = False
+        if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+            spec.loader = _TimedLoader(self, spec.loader)
+        return spec
+
+    @contextmanager
+    def trigger(self, directive, document=None):
+        """
+        Context manager attributing the modules imported in its body to
+        ``directive`` (a description such as ``'automodapi:: package.module'``)
+        in ``document``.
+        """
+        if not self.enabled:
+            yield
+            return
+        triggers = self._local.__dict__.setdefault('triggers', [])
+        triggers.append((directive, document))
+        try:
+            yield
+        finally:
+            triggers.pop()
+
+    @contextmanager
+    def _record(self, modname):
+        stack = self._local.__dict__.setdefault('stack', [])
+        triggers = self._local.__dict__.get('triggers')
+        directive, document = triggers[-1] if triggers else (None, None)
+        parent = stack[-1][0] if stack else None
+        frame = [modname, 0.]
+        stack.append(frame)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            stack.pop()
+            if stack:
+                stack[-1][1] += elapsed
+            with self._lock:
+                self._check_process()
+                entry = self.modules.setdefault(modname, {
+                    'cumulative': 0., 'self': 0., 'directive': directive,
+                    'document': document, 'imported_by': parent})
+                entry['cumulative'] += elapsed
+                entry['self'] += elapsed - frame[1]
+
+    def as_dict(self):
+        with self._lock:
+            self._check_process()
+            return {modname: dict(entry) for modname, entry in self.modules.items()}
+
+    def merge(self, other):
+        """
+        Adds the import times ``other``, as returned by `as_dict`.
+        """
+        with self._lock:
+            self._check_process()
+            for modname, entry in other.items():
+                if modname in self.modules:
+                    self.modules[modname]['cumulative'] += entry['cumulative']
+                    self.modules[modname]['self'] += entry['self']
+                else:
+                    self.modules[modname] = dict(entry)
+
+    def report(self):
+        """
+        Returns the modules ranked by cumulative import time, and the
+        directives ranked by the time spent importing the modules they
+        triggered the import of.
+        """
+        modules = sorted(({'module': modname, **entry}
+                          for modname, entry in self.as_dict().items()),
+                         key=lambda entry: (-entry['cumulative'], entry['module']))
+
+        directives = {}
+        for entry in modules:
+            if entry['directive'] is None:
+                continue
+            key = entry['directive'], entry['document']
+            total = directives.setdefault(key, {'directive': key[0], 'document': key[1],
+                                                'time': 0., 'modules': 0})
+            total['modules'] += 1
+            # The time of modules imported by other modules is already
+            # included in the cumulative time of these modules
+            if entry['imported_by'] is None:
+                total['time'] += entry['cumulative']
+
+        return {'modules': modules,
+                'directives': sorted(directives.values(),
+                                     key=lambda total: (-total['time'], total['directive']))}
+
+
+import_profiler = ImportProfiler()
+
+
+def start_import_profile(app):
+    import_profiler.enabled = app.config.automodapi_import_profile
+    import_profiler.reset()
+    if import_profiler.enabled:
+        import_profiler.install()
+    else:
+        import_profiler.uninstall()
+
+
+def store_worker_import_profile(app, doctree):
+    if import_profiler.enabled and build_stats.in_worker:
+        app.env.automodapi_import_profile = import_profiler.as_dict()
+
+
+def merge_worker_import_profile(app, env, docnames, env_other):
+    if import_profiler.enabled and hasattr(env_other, 'automodapi_import_profile'):
+        import_profiler.merge(env_other.automodapi_import_profile)
+
+
+def write_import_profile(app, exception, top=10):
+    import_profiler.uninstall()
+    if not import_profiler.enabled or exception is not None:
+        return
+
+    report = import_profiler.report()
+
+    logger.info('[automodapi] slowest module imports (cumulative / self):')
+    for entry in report['modules'][:top]:
+        logger.info(f'    {entry["module"]}: {entry["cumulative"]:.3f} s / {entry["self"]:.3f} s')
+    logger.info('[automodapi] directives triggering the slowest imports:')
+    for total in report['directives'][:top]:
+        logger.info(f'    {total["directive"]} ({total["document"]}): {total["time"]:.3f} s '
+                    f'({total["modules"]} modules)')
+
+    ensuredir(app.doctreedir)
+    filename = os.path.join(app.doctreedir, import_profiler.filename)
+    with open(filename, 'w', encoding='utf8') as f:
+        json.dump(report, f, indent=1)
+    logger.info('[automodapi] import profile written to ' + filename)
+
+
+def setup(app):
+
+    # Use a high priority to start recording before the other handlers
+    app.connect('builder-inited', reset_build_stats, priority=100)
+    app.connect('doctree-read', store_worker_stats)
+    app.connect('env-merge-info', merge_worker_stats)
+    app.connect('build-finished', write_build_stats)
+    app.connect('builder-inited', start_import_profile, priority=100)
+    app.connect('doctree-read', store_worker_import_profile)
+    app.connect('env-merge-info', merge_worker_import_profile)
+    app.connect('build-finished', write_import_profile)
+
+    app.add_config_value('automodapi_build_stats', False, '')
+    app.add_config_value('automodapi_import_profile', False, '')
+
+    return {'parallel_read_safe': True,
+            'parallel_write_safe': True}
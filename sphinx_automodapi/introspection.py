@@ -0,0 +1,348 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Persistent storage of the results of module introspection.
+
+The `automodapi` and `automodsumm` directives need to know the public
+attributes of each documented module, and which of them are classes or
+functions, and the stub files generated by `automodsumm` need the type of
+each documented object and the types of its members, which normally
+requires importing the modules and objects. With the
+``automodsumm_module_index`` configuration option, the plain-data module
+and object descriptions returned by
+`~sphinx_automodapi.utils.introspect_module` and
+`~sphinx_automodapi.utils.introspect_object` are stored in an index in the
+doctree directory, so that on subsequent builds modules and objects whose
+source files did not change don't need to be imported and introspected
+again.
+
+With the ``automodsumm_introspection_workers`` configuration option, modules
+and objects are instead introspected in short-lived worker processes, which
+only send back these plain-data descriptions. Modules and objects can then
+be introspected in parallel, a module that takes too long to import can be
+abandoned, and a module that crashes the interpreter on import does not take
+the build down with it.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from multiprocessing.connection import wait
+
+import sphinx
+from sphinx.util import logging
+from sphinx.util.osutil import ensuredir
+
+from .instrumentation import build_stats
+from .utils import SPHINX_LT_9, introspect_module, introspect_object
+
+__all__ = ['ModuleIndex', 'introspect_in_subprocesses', 'prefetch_module_infos',
+           'prefetch_object_infos']
+
+logger = logging.getLogger(__name__)
+
+
+def _file_hash(filename):
+    with open(filename, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class ModuleIndex:
+    """
+    An index of module and object descriptions that persists between builds.
+
+    Each entry is stored along with the modification time and hash of the
+    source files listed in the description (e.g. the module itself and the
+    modules where its attributes are defined), and is discarded as soon as
+    one of these files changed.
+    """
+
+    filename = 'automodapi_modules.json'
+
+    # Bump when the format of the module or object descriptions changes
+    version = 2
+
+    def __init__(self, doctreedir):
+        self.path = os.path.join(doctreedir, self.filename)
+        self._modified = False
+        self._entries = {}
+        self._objects = {}
+        try:
+            with open(self.path, encoding='utf8') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if (data.get('version') == self.version and
+                data.get('python') == sys.version and
+                data.get('sphinx') == sphinx.__version__):
+            self._entries = data.get('modules', {})
+            self._objects = data.get('objects', {})
+
+    def _is_valid(self, entry):
+        for filename, (mtime, digest) in entry['files'].items():
+            try:
+                new_mtime = os.stat(filename).st_mtime_ns
+            except OSError:
+                return False
+            if new_mtime != mtime:
+                if _file_hash(filename) != digest:
+                    return False
+                # Only the modification time changed
+                entry['files'][filename] = [new_mtime, digest]
+                self._modified = True
+        return True
+
+    def _get(self, entries, key):
+        entry = entries.get(key)
+        if entry is None:
+            return None
+        if not self._is_valid(entry):
+            del entries[key]
+            self._modified = True
+            return None
+        return entry['info']
+
+    def _set(self, entries, key, info):
+        try:
+            files = {filename: [os.stat(filename).st_mtime_ns, _file_hash(filename)]
+                     for filename in info['files']}
+        except OSError:
+            # e.g. modules loaded from zip files can't be checked for changes
+            return
+        entries[key] = {'info': info, 'files': files}
+        self._modified = True
+
+    def get(self, modname):
+        """
+        Returns the description of module ``modname`` if it is in the index
+        and none of its source files changed, and `None` otherwise.
+        """
+        return self._get(self._entries, modname)
+
+    def set(self, modname, info):
+        """
+        Adds the description of module ``modname`` to the index.
+        """
+        self._set(self._entries, modname, info)
+
+    @staticmethod
+    def _object_key(name, include_base):
+        return name + ' (inherited)' if include_base else name
+
+    def get_object(self, name, include_base=False):
+        """
+        Returns the description of object ``name`` given by
+        `~sphinx_automodapi.utils.introspect_object` (with ``include_base``)
+        if it is in the index and none of its source files changed, and
+        `None` otherwise.
+        """
+        return self._get(self._objects, self._object_key(name, include_base))
+
+    def set_object(self, name, include_base, info):
+        """
+        Adds the description of object ``name`` to the index.
+        """
+        self._set(self._objects, self._object_key(name, include_base), info)
+
+    def save(self):
+        """
+        Writes the index to the doctree directory, if it was modified.
+        """
+        if not self._modified:
+            return
+        ensuredir(os.path.dirname(self.path))
+        with open(self.path, 'w', encoding='utf8') as f:
+            json.dump({'version': self.version,
+                       'python': sys.version,
+                       'sphinx': sphinx.__version__,
+                       'modules': self._entries,
+                       'objects': self._objects}, f, sort_keys=True)
+        self._modified = False
+
+
+def _introspect_worker(function, arg, conn):
+    try:
+        result = (True, function(arg))
+    except BaseException as exc:
+        result = (False, f'{exc.__class__.__name__}: {exc}')
+    conn.send(result)
+    conn.close()
+
+
+def _introspect_objects(keys):
+    infos = []
+    for name, include_base in keys:
+        try:
+            infos.append([name, include_base,
+                          introspect_object(name, include_base=include_base)])
+        except ImportError:
+            # The failure is reported when the object is looked up again in
+            # the Sphinx process
+            pass
+    return infos
+
+
+def introspect_in_subprocesses(modnames, workers=1, timeout=None,
+                               function=introspect_module):
+    """
+    Introspects modules with `~sphinx_automodapi.utils.introspect_module`,
+    each in a new process, so that the modules are never imported in the
+    current process.
+
+    Parameters
+    ----------
+    modnames : list of str
+        The names of the modules to introspect.
+    workers : int
+        The maximum number of processes to run at the same time.
+    timeout : float or None
+        The number of seconds after which a process that has not finished
+        introspecting its module is killed.
+    function : callable
+        The function called with each item of ``modnames`` in the worker
+        processes, instead of `~sphinx_automodapi.utils.introspect_module`.
+        It must be importable by the worker processes, its argument must be
+        hashable and picklable, and its return value must be picklable.
+
+    Returns
+    -------
+    infos : dict
+        The module descriptions, for the modules that could be introspected.
+    errors : dict
+        An error message for each module that could not be introspected,
+        along with a flag indicating whether this was because of the timeout.
+    """
+    ctx = multiprocessing.get_context('spawn')
+
+    pending = list(modnames)
+    running = {}
+    infos = {}
+    errors = {}
+
+    while pending or running:
+        while pending and len(running) < max(workers, 1):
+            modname = pending.pop(0)
+            recv_conn, send_conn = ctx.Pipe(duplex=False)
+            process = ctx.Process(target=_introspect_worker,
+                                  args=(function, modname, send_conn), daemon=True)
+            process.start()
+            send_conn.close()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            running[recv_conn] = (modname, process, deadline)
+
+        if timeout is None:
+            wait_time = None
+        else:
+            wait_time = max(min(deadline for _, _, deadline in running.values()) -
+                            time.monotonic(), 0)
+        ready = wait(list(running), timeout=wait_time)
+
+        for conn, (modname, process, deadline) in list(running.items()):
+            if conn in ready:
+                try:
+                    success, value = conn.recv()
+                except EOFError:
+                    process.join()
+                    success, value = False, f'worker exited with code {process.exitcode}'
+                if success:
+                    infos[modname] = value
+                else:
+                    errors[modname] = (value, False)
+            elif deadline is not None and time.monotonic() >= deadline:
+                process.kill()
+                errors[modname] = (f'import timed out after {timeout} seconds', True)
+            else:
+                continue
+            process.join()
+            conn.close()
+            del running[conn]
+
+    return infos, errors
+
+
+def prefetch_module_infos(cache, modnames, workers=1, timeout=None):
+    """
+    Adds the descriptions of the given modules to ``cache`` (a
+    `~sphinx_automodapi.utils.ModObjsCache`), introspecting the modules that
+    are not already known in worker processes (see
+    `introspect_in_subprocesses`).
+
+    Modules that could not be imported in a worker are left for the current
+    process to import (and report the error) as usual, except for those that
+    timed out, which are marked as not importable.
+    """
+    todo = sorted(modname for modname in set(modnames)
+                  if not cache.has_module_info(modname))
+    if not todo:
+        return
+
+    logger.info(f'[automodsumm] introspecting {len(todo)} modules in worker processes')
+    with build_stats.timer('module introspection in workers'):
+        infos, errors = introspect_in_subprocesses(todo, workers=workers, timeout=timeout)
+    build_stats.count('modules introspected in workers', len(infos))
+
+    for modname, info in infos.items():
+        cache.add_module_info(modname, info)
+
+    for modname, (message, timed_out) in sorted(errors.items()):
+        if timed_out:
+            logger.warning(f"[automodsumm] couldn't introspect module {modname}: {message}")
+            cache.add_module_failure(modname, message)
+        else:
+            logger.debug(f"[automodsumm] couldn't introspect module {modname} "
+                         f"in a worker process: {message}")
+
+
+def prefetch_object_infos(cache, keys, workers=1, timeout=None):
+    """
+    Adds the descriptions of the given objects to ``cache`` (a
+    `~sphinx_automodapi.utils.ModObjsCache`), introspecting the objects that
+    are not already known in worker processes, one for the objects of each
+    module.
+
+    ``keys`` are ``(name, include_base)`` tuples, as given to
+    `~sphinx_automodapi.utils.ModObjsCache.object_info`. Objects that could
+    not be imported in a worker are left for the current process to import
+    (and report the error) as usual, except for those that timed out, which
+    are marked as not importable.
+
+    With Sphinx < 9, the object types depend on the autodoc documenters
+    registered by the extensions, which are not available in the worker
+    processes, so nothing is done.
+    """
+    if SPHINX_LT_9:
+        return
+
+    groups = {}
+    for name, include_base in sorted(set(keys)):
+        if not cache.has_object_info(name, include_base):
+            groups.setdefault(name.rpartition('.')[0], []).append((name, include_base))
+    if not groups:
+        return
+
+    logger.info(f'[automodsumm] introspecting the objects of {len(groups)} modules '
+                'in worker processes')
+    with build_stats.timer('object introspection in workers'):
+        results, errors = introspect_in_subprocesses(
+            [tuple(group) for modname, group in sorted(groups.items())],
+            workers=workers, timeout=timeout, function=_introspect_objects)
+
+    n_objects = 0
+    for infos in results.values():
+        for name, include_base, info in infos:
+            cache.add_object_info(name, include_base, info)
+        n_objects += len(infos)
+    build_stats.count('objects introspected in workers', n_objects)
+
+    for group, (message, timed_out) in sorted(errors.items()):
+        modname = group[0][0].rpartition('.')[0]
+        if timed_out:
+            logger.warning(f"[automodsumm] couldn't introspect the objects of module "
+                           f"{modname}: {message}")
+            for name, include_base in group:
+                cache.add_object_failure(name, include_base, message)
+        else:
+            logger.debug(f"[automodsumm] couldn't introspect the objects of module "
+                         f"{modname} in a worker process: {message}")
@@ -0,0 +1,260 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Sharding of the stub files and inheritance diagrams generated for the API
+documentation across several builds.
+
+With the ``automodsumm_shard`` configuration option, e.g.
+``sphinx-build -D automodsumm_shard=1/4``, only the stub files and the
+inheritance diagrams of the modules in the given shard are generated. Each
+module belongs to exactly one shard, which only depends on its name (its CRC32
+checksum modulo the number of shards), so that all the shards together cover
+all the modules, whatever the machine they are built on. At the end of the
+build, a manifest of the shard, ``automodsumm_shard.json``, is written to the
+doctree directory. It contains the content of the stub files of the shard
+(whether they were written by this build or already up to date), the stub
+files expected from all the shards, and the classes documented by the shard
+(if the ``smart_resolver`` extension is used), which are only used to check
+that the shards agree with each other.
+
+If ``automodsumm_incremental_generation`` is also used, the stub files of the
+other shards that are already in the source directory are kept, and remain
+tracked, so that several shards can be built one after the other in the same
+source directory.
+
+Once all the shards have been built, e.g. on different CI runners, their
+doctree directories can be merged with::
+
+    python -m sphinx_automodapi.sharding SOURCEDIR SHARD_DOCTREEDIR [...] \\
+        --diagram-cache DIR
+
+which checks that all the shards are present and consistent with each other
+and that together they generated all the expected stub files, writes the stub
+files of all the shards to the source directory, and merges
+the ``automodsumm_diagrams`` diagram caches of the shards (see the
+``automodsumm_diagram_cache`` configuration option) into ``DIR``. A final
+build without ``automodsumm_shard``, and with ``automodsumm_diagram_cache``
+set to ``DIR``, then finds all the stub files already present and doesn't
+need to run graphviz again for the diagrams.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import zlib
+
+from sphinx.errors import ConfigError
+from sphinx.util import logging
+from sphinx.util.osutil import ensuredir
+
+__all__ = ['parse_shard', 'in_shard', 'merge_shards']
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'automodsumm_shard.json'
+
+DIAGRAM_CACHE = 'automodsumm_diagrams'
+
+
+def parse_shard(value):
+    """
+    Returns the ``(index, count)`` tuple given by the ``automodsumm_shard``
+    configuration option, either as a ``'index/count'`` string or as a
+    sequence, or `None` if sharding is disabled.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        if isinstance(value, str):
+            index, count = value.split('/')
+        else:
+            index, count = value
+        index, count = int(index), int(count)
+    except (TypeError, ValueError):
+        raise ConfigError('automodsumm_shard should be given as index/count, '
+                          f'got {value!r}')
+    if not 0 <= index < count:
+        raise ConfigError(f'automodsumm_shard index should be between 0 and {count - 1}, '
+                          f'got {index}')
+    return index, count
+
+
+def in_shard(modname, shard):
+    """
+    Whether module ``modname`` belongs to ``shard``, as returned by
+    `parse_shard`. All modules belong to the shard `None`.
+    """
+    if shard is None:
+        return True
+    index, count = shard
+    return zlib.crc32(modname.encode('utf8')) % count == index
+
+
+# The stub files of the shard of this build, the stub files expected from
+# all the shards, and those expected from the shard of this build, relative to
+# the source directory
+_shard_stubs = set()
+_expected_stubs = set()
+_expected_shard_stubs = set()
+
+
+def _key(app, fn):
+    return os.path.relpath(fn, app.srcdir).replace(os.sep, '/')
+
+
+def record_shard_stubs(app, filenames):
+    """
+    Records the stub files generated for the shard of this build, whether
+    they were written or already up to date.
+    """
+    _shard_stubs.update(_key(app, fn) for fn in filenames)
+
+
+def record_expected_stubs(app, filenames, shard_filenames):
+    """
+    Records the stub files expected from all the shards, and those expected
+    from the shard of this build.
+    """
+    _expected_stubs.update(_key(app, fn) for fn in filenames)
+    _expected_shard_stubs.update(_key(app, fn) for fn in shard_filenames)
+
+
+def other_shard_stubs(app):
+    """
+    Returns the paths of the stub files expected from the shards other than
+    the shard of this build.
+    """
+    return [os.path.join(app.srcdir, *key.split('/'))
+            for key in sorted(_expected_stubs - _expected_shard_stubs)]
+
+
+def reset_shard_stubs(app):
+    _shard_stubs.clear()
+    _expected_stubs.clear()
+    _expected_shard_stubs.clear()
+
+
+def write_shard_manifest(app, exception):
+    shard = parse_shard(app.config.automodsumm_shard)
+    if shard is None or exception is not None:
+        return
+
+    # With automodsumm_in_memory_stubs, the files only contain placeholders
+    from .automodsumm import _in_memory_stubs
+
+    stubs = {}
+    for key in sorted(_shard_stubs):
+        fn = os.path.join(app.srcdir, *key.split('/'))
+        if os.path.normpath(fn) in _in_memory_stubs:
+            stubs[key] = _in_memory_stubs[os.path.normpath(fn)]
+            continue
+        with open(fn, encoding='utf8') as f:
+            stubs[key] = f.read()
+
+    ensuredir(app.doctreedir)
+    with open(os.path.join(app.doctreedir, MANIFEST), 'w', encoding='utf8') as f:
+        json.dump({'shard': shard[0],
+                   'count': shard[1],
+                   'stubs': stubs,
+                   'expected': sorted(_expected_stubs),
+                   # e.g. objects that could not be imported
+                   'missing': sorted(_expected_shard_stubs - _shard_stubs),
+                   'class_name_mapping': getattr(app.env, 'class_name_mapping', {})},
+                  f, indent=1, sort_keys=True)
+
+
+def merge_shards(srcdir, shard_dirs, diagram_cache=None):
+    """
+    Merges the results of sharded builds, given by their doctree directories
+    ``shard_dirs``.
+
+    The stub files of all the shards are written to ``srcdir``, and if
+    ``diagram_cache`` is given, the diagram caches of the shards are merged
+    into this directory.
+
+    Returns the sorted list of the stub files written, relative to
+    ``srcdir``.
+
+    Raises `ValueError` if shards are missing or duplicated, if they don't
+    agree with each other, or if stub files expected by the shards were not
+    generated by any of them.
+    """
+    manifests = []
+    for shard_dir in shard_dirs:
+        with open(os.path.join(shard_dir, MANIFEST), encoding='utf8') as f:
+            manifests.append(json.load(f))
+
+    counts = {manifest['count'] for manifest in manifests}
+    if len(counts) != 1:
+        raise ValueError(f'shards were built with different shard counts: {sorted(counts)}')
+    count = counts.pop()
+    indices = sorted(manifest['shard'] for manifest in manifests)
+    if indices != list(range(count)):
+        raise ValueError(f'expected shards 0 to {count - 1}, got {indices}')
+
+    stubs = {}
+    mapping = {}
+    expected = set()
+    missing = set()
+    for manifest in manifests:
+        for key, content in manifest['stubs'].items():
+            if stubs.setdefault(key, content) != content:
+                raise ValueError(f'shards generated different stub files for {key}')
+        for fullname, name in manifest['class_name_mapping'].items():
+            if mapping.setdefault(fullname, name) != name:
+                raise ValueError(f'shards documented {fullname} as both '
+                                 f'{mapping[fullname]} and {name}')
+        expected.update(manifest['expected'])
+        missing.update(manifest['missing'])
+
+    not_generated = sorted(expected - missing - set(stubs))
+    if not_generated:
+        raise ValueError(f'{len(not_generated)} stub files were not generated by any '
+                         f'shard: {", ".join(not_generated[:10])}')
+
+    for key, content in sorted(stubs.items()):
+        fn = os.path.join(srcdir, *key.split('/'))
+        ensuredir(os.path.dirname(fn))
+        with open(fn, 'w', encoding='utf8') as f:
+            f.write(content)
+
+    if diagram_cache is not None:
+        ensuredir(diagram_cache)
+        for shard_dir in shard_dirs:
+            cachedir = os.path.join(shard_dir, DIAGRAM_CACHE)
+            if not os.path.isdir(cachedir):
+                continue
+            # File names are derived from the content of the diagrams, so
+            # files with the same name are identical
+            for fname in sorted(os.listdir(cachedir)):
+                if not os.path.exists(os.path.join(diagram_cache, fname)):
+                    shutil.copyfile(os.path.join(cachedir, fname),
+                                    os.path.join(diagram_cache, fname))
+
+    return sorted(stubs)
+
+
+def main(args=None):
+
+    parser = argparse.ArgumentParser(
+        description='Merge the stub files and diagram caches of sharded builds.')
+    parser.add_argument('sourcedir', help='Source directory to write the stub files to')
+    parser.add_argument('shard_dirs', nargs='+', metavar='shard_doctreedir',
+                        help='Doctree directories of the sharded builds')
+    parser.add_argument('--diagram-cache', metavar='DIR',
+                        help='Directory to merge the diagram caches of the shards into')
+    args = parser.parse_args(args)
+
+    try:
+        stubs = merge_shards(args.sourcedir, args.shard_dirs,
+                             diagram_cache=args.diagram_cache)
+    except ValueError as exc:
+        print(f'error: {exc}', file=sys.stderr)
+        return 1
+    print(f'merged {len(args.shard_dirs)} shards ({len(stubs)} stub files)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -8,12 +8,15 @@ reference a class by its canonical location rather than its "user"
 location.
 
 In the `autodoc-process-docstring` event, a mapping from the actual
-name to the API name is maintained.  Later, in the `missing-reference`
+name to the API name is maintained, along with the document in which each
+class is documented so that its entries can be removed when the document is
+re-read or deleted.  Later, in the `missing-reference`
 event, unresolved references are looked up in this dictionary and
 corrected if possible.
 """
 
 from docutils.nodes import literal, reference
+from sphinx.environment.collectors import EnvironmentCollector
 
 from .utils import SPHINX_LT_9
 
@@ -25,16 +28,151 @@ def process_docstring(app, what, name, obj, options, lines):
         env = app.env
         if not hasattr(env, 'class_name_mapping'):
             env.class_name_mapping = {}
+        if not hasattr(env, 'class_name_mapping_docs'):
+            env.class_name_mapping_docs = {}
+        fullname = obj.__module__ + '.' + obj.__name__
+        env.class_name_mapping[fullname] = name
+        env.class_name_mapping_docs.setdefault(env.docname, {})[fullname] = name
+
+
+class ClassNameMappingCollector(EnvironmentCollector):
+    """
+    Keeps track of the document in which each entry of
+    ``env.class_name_mapping`` was recorded, in
+    ``env.class_name_mapping_docs``, so that the entries of a document are
+    removed when it is re-read or deleted, and so that only the entries of
+    the documents read by a worker process are merged in parallel builds.
+    """
+
+    def clear_doc(self, app, env, docname):
+        docs = getattr(env, 'class_name_mapping_docs', {})
+        entries = docs.pop(docname, None)
+        if not entries:
+            return
         mapping = env.class_name_mapping
-        mapping[obj.__module__ + '.' + obj.__name__] = name
+        for fullname, name in entries.items():
+            if mapping.get(fullname) != name:
+                continue
+            del mapping[fullname]
+            # Fall back on another document documenting the same class
+            for other_entries in docs.values():
+                if fullname in other_entries:
+                    mapping[fullname] = other_entries[fullname]
+                    break
 
+    def merge_other(self, app, env, docnames, other):
+        other_docs = getattr(other, 'class_name_mapping_docs', {})
+        if not hasattr(env, 'class_name_mapping'):
+            env.class_name_mapping = {}
+        if not hasattr(env, 'class_name_mapping_docs'):
+            env.class_name_mapping_docs = {}
+        for docname in docnames:
+            if docname in other_docs:
+                env.class_name_mapping_docs[docname] = other_docs[docname]
+                env.class_name_mapping.update(other_docs[docname])
 
-def merge_mapping(app, env, docnames, env_other):
-    if not hasattr(env_other, 'class_name_mapping'):
-        return
-    if not hasattr(env, 'class_name_mapping'):
-        env.class_name_mapping = {}
-    env.class_name_mapping.update(env_other.class_name_mapping)
+    def process_doc(self, app, doctree):
+        # The entries are recorded as the docstrings are processed
+        pass
+
+
+# Index of the targets that can be resolved, which is built the first time a
+# reference is missing (once all the documents have been read). Each target
+# maps to a tuple of either _LOCAL and the name under which the class is
+# documented (from env.class_name_mapping), or _INTERSPHINX and the URI of
+# the class in an intersphinx inventory named after the first component of
+# its name.
+_LOCAL = 'local'
+_INTERSPHINX = 'intersphinx'
+_PRIVATE = 'private'
+_NOT_FOUND = (None, None)
+
+
+def _build_resolver_index(env):
+    index = {}
+    inventory = getattr(env, 'intersphinx_named_inventory', {})
+    for invname, objtypes in inventory.items():
+        for name, item in objtypes.get('py:class', {}).items():
+            if name.split('.', 1)[0] == invname:
+                index[name] = (_INTERSPHINX, item[2] if SPHINX_LT_9 else item.uri)
+    # Classes documented in this project take precedence
+    for name, apiname in env.class_name_mapping.items():
+        index[name] = (_LOCAL, apiname)
+    return index
+
+
+class _ResolverCache:
+    """
+    The index of the targets that can be resolved for the environment
+    ``env``, along with the results of previous lookups, which are often
+    repeated (e.g. for common base classes).
+    """
+
+    def __init__(self, env):
+        self.env = env
+        self.index = _build_resolver_index(env)
+        # (reftype, reftarget) -> how the target is resolved (see _resolve_target)
+        self.targets = {}
+        # Nodes returned by the Python domain (or None if the target could not
+        # be resolved), keyed by the target and the context of the reference
+        self.nodes = {}
+
+
+# Cleared when the environment is updated
+_resolver_cache = None
+
+
+def clear_resolver_index(app, env):
+    global _resolver_cache
+    _resolver_cache = None
+
+
+def _resolve_target(index, reftype, reftarget):
+    """
+    Returns `None` if ``reftarget`` can't be resolved, ``(_PRIVATE,)`` if it
+    is private, ``(_INTERSPHINX, reftitle, uri)`` for a class in an
+    intersphinx inventory, or ``(_LOCAL, reftitle, newtarget)`` for a target
+    to resolve in the Python domain.
+    """
+    if reftype not in ('obj', 'class', 'exc', 'meth'):
+        return None
+
+    suffix = ''
+    kind, value = index.get(reftarget, _NOT_FOUND)
+    if kind is not _LOCAL:
+        if '.' in reftarget:
+            front, suffix = reftarget.rsplit('.', 1)
+        else:
+            front = None
+            suffix = reftarget
+
+        if suffix.startswith('_') and not suffix.startswith('__'):
+            # If this is a reference to a hidden class or method,
+            # we can't link to it, but we don't want to have a
+            # nitpick warning.
+            return (_PRIVATE,)
+
+        if reftype in ('obj', 'meth') and front is not None:
+            front_kind, front_value = index.get(front, _NOT_FOUND)
+            if front_kind is _LOCAL:
+                reftarget = front
+                suffix = '.' + suffix
+                kind, value = front_kind, front_value
+
+        if reftype in ('class', ) and '.' in reftarget and kind is not _LOCAL:
+
+            if '.' in front:
+                reftarget, _ = front.rsplit('.', 1)
+                suffix = '.' + suffix
+            reftarget = reftarget + suffix
+            kind, value = index.get(reftarget, _NOT_FOUND)
+            if kind is _INTERSPHINX:
+                return (_INTERSPHINX, reftarget, value)
+
+    if kind is _LOCAL:
+        return (_LOCAL, reftarget, value + suffix)
+
+    return None
 
 
 def missing_reference_handler(app, env, node, contnode):
@@ -70,77 +208,80 @@ def missing_reference_handler(app, env, node, contnode):
     #  'refdoc'      - document in which the role appeared
     #  'refdomain'   - domain of the role, in our case emtpy
 
+    global _resolver_cache
+
     if not hasattr(env, 'class_name_mapping'):
         env.class_name_mapping = {}
-    mapping = env.class_name_mapping
+    if _resolver_cache is None or _resolver_cache.env is not env:
+        _resolver_cache = _ResolverCache(env)
+    cache = _resolver_cache
 
     reftype = node['reftype']
     reftarget = node['reftarget']
     refexplicit = node.get('refexplicit')  # default: None
     refdoc = node.get('refdoc', env.docname)
-    if reftype in ('obj', 'class', 'exc', 'meth'):
-        suffix = ''
-        if reftarget not in mapping:
-            if '.' in reftarget:
-                front, suffix = reftarget.rsplit('.', 1)
-            else:
-                front = None
-                suffix = reftarget
-
-            if suffix.startswith('_') and not suffix.startswith('__'):
-                # If this is a reference to a hidden class or method,
-                # we can't link to it, but we don't want to have a
-                # nitpick warning.
-                return node[0].deepcopy()
-
-            if reftype in ('obj', 'meth') and front is not None:
-                if front in mapping:
-                    reftarget = front
-                    suffix = '.' + suffix
-
-            if (reftype in ('class', ) and '.' in reftarget and
-                    reftarget not in mapping):
-
-                if '.' in front:
-                    reftarget, _ = front.rsplit('.', 1)
-                    suffix = '.' + suffix
-                reftarget = reftarget + suffix
-                prefix = reftarget.rsplit('.')[0]
-                inventory = getattr(env, 'intersphinx_named_inventory', {})
-                if (reftarget not in mapping and
-                        prefix in inventory):
-
-                    if ('py:class' in inventory[prefix] and
-                            reftarget in inventory[prefix]['py:class']):
-                        if SPHINX_LT_9:
-                            newtarget = inventory[prefix]['py:class'][reftarget][2]
-                        else:
-                            newtarget = inventory[prefix]['py:class'][reftarget].uri
-                        if not refexplicit and '~' not in node.rawsource:
-                            contnode = literal(text=reftarget)
-                        newnode = reference('', '', internal=True)
-                        newnode['reftitle'] = reftarget
-                        newnode['refuri'] = newtarget
-                        newnode.append(contnode)
-
-                        return newnode
-
-        if reftarget in mapping:
-            newtarget = mapping[reftarget] + suffix
-            if not refexplicit and '~' not in node.rawsource:
-                contnode = literal(text=newtarget)
-            newnode = env.domains['py'].resolve_xref(env, refdoc, app.builder, 'class',
-                                                     newtarget, node, contnode)
-            if newnode is not None:
-                newnode['reftitle'] = reftarget
-            return newnode
+
+    key = (reftype, reftarget)
+    try:
+        target = cache.targets[key]
+    except KeyError:
+        target = cache.targets[key] = _resolve_target(cache.index, reftype, reftarget)
+
+    if target is None:
+        return None
+
+    if target[0] is _PRIVATE:
+        return node[0].deepcopy()
+
+    # The link text is the target, unless it was given in the reference
+    implicit = not refexplicit and '~' not in node.rawsource
+
+    if target[0] is _INTERSPHINX:
+        _, reftarget, uri = target
+        if implicit:
+            contnode = literal(text=reftarget)
+        newnode = reference('', '', internal=True)
+        newnode['reftitle'] = reftarget
+        newnode['refuri'] = uri
+        newnode.append(contnode)
+        return newnode
+
+    _, reftarget, newtarget = target
+
+    # The result of the Python domain depends on the context of the
+    # reference, and the URI of the node on the document it is in.
+    context = (newtarget, node.get('py:module'), node.get('py:class'),
+               node.hasattr('refspecific'))
+    if cache.nodes.get(context, True) is None:
+        return None
+    if implicit and (context, refdoc) in cache.nodes:
+        newnode = cache.nodes[context, refdoc].deepcopy()
+        newnode['reftitle'] = reftarget
+        return newnode
+
+    if implicit:
+        contnode = literal(text=newtarget)
+    newnode = env.domains['py'].resolve_xref(env, refdoc, app.builder, 'class',
+                                             newtarget, node, contnode)
+    if newnode is None:
+        cache.nodes[context] = None
+        return None
+
+    if implicit:
+        cache.nodes[context, refdoc] = newnode.deepcopy()
+    newnode['reftitle'] = reftarget
+    return newnode
 
 
 def setup(app):
 
     app.connect('autodoc-process-docstring', process_docstring)
     app.connect('missing-reference', missing_reference_handler)
-    app.connect('env-merge-info', merge_mapping)
+    app.connect('env-updated', clear_resolver_index)
+    app.add_env_collector(ClassNameMappingCollector)
 
+    # The version of the data stored in the environment, so that environments
+    # pickled without the documents of the entries are discarded
     return {'parallel_read_safe': True,
-            'parallel_write_safe': True}
+            'parallel_write_safe': True,
+            'env_version': 1}
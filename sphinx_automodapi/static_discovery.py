@@ -0,0 +1,595 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+"""
+Discovery of the public attributes of modules from their source code, without
+importing them.
+
+With the ``automodsumm_static_discovery`` configuration option, the
+descriptions of the documented modules used by the directives (see
+`~sphinx_automodapi.utils.introspect_module`) are first obtained with
+`static_module_info`, which parses the source of each module and follows its
+``__all__``, its imports (including ``from x import *`` and chains of
+re-exports through other modules) and simple assignments, instead of
+executing it.
+
+A module is imported as usual if the kind of one of its public attributes
+can't be determined statically, e.g. because it is the result of a function
+call, because it is decorated by an unknown decorator, or because it is
+defined differently depending on a condition. Attributes re-exported from a
+module that can't be analyzed (such as an extension module) are looked up by
+importing that module only. Modules that are already imported are never
+analyzed.
+
+Static discovery is an approximation: module-level code that changes the
+namespace of a module in ways that are not visible from its source (e.g. a
+function called at import time that modifies ``globals()``) is not taken into
+account. Modules that use ``globals()``, ``setattr``, ``exec`` and the like at
+the module level are always imported.
+"""
+
+import ast
+import builtins
+import importlib
+import os
+import sys
+from importlib.machinery import PathFinder, SourceFileLoader
+from inspect import ismodule
+
+from .instrumentation import build_stats
+from .utils import obj_kind
+
+__all__ = ['StaticAnalyzer', 'static_module_info']
+
+# The bindings of names in the namespace of a module are tuples:
+#
+# ('module', modname)       a module
+# ('class', fqname)         a class defined in a module
+# ('routine', fqname)       a function defined in a module
+# ('other',)                any other value, which has no name (e.g. a list)
+# ('object', obj)           an attribute of a module that was imported
+# ('import', modname, name) the attribute name of module modname, which is
+#                           only looked up if needed
+# ('all', names)            the value of __all__
+_UNKNOWN = ('unknown',)
+_MISSING = ('missing',)
+_OTHER = ('other',)
+
+# Marks the modules that are being analyzed, to detect circular imports
+_IN_PROGRESS = object()
+
+# Decorators that return a class or a routine with the same name and module
+_SAFE_DECORATORS = {'dataclass', 'total_ordering', 'lru_cache', 'cache', 'final',
+                    'runtime_checkable', 'unique'}
+
+# Names whose use at the module level can change the namespace of a module in
+# ways that are not visible statically
+_DYNAMIC_NAMES = {'globals', 'locals', 'vars', 'exec', 'eval', 'setattr', 'delattr',
+                  '__import__'}
+
+# Attributes whose assignment changes the full name of an object
+_NAME_ATTRIBUTES = {'__module__', '__name__', '__qualname__', '__class__'}
+
+
+class _Dynamic(Exception):
+    """
+    Raised when the namespace of a module can't be determined statically.
+    """
+
+
+def _same(a, b):
+    if a[0] == 'object' or b[0] == 'object':
+        return a[0] == b[0] and a[1] is b[1]
+    return a == b
+
+
+def _decorator_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        return node.attr
+    return None
+
+
+def _is_literal(node):
+    return not any(isinstance(child, (ast.Name, ast.Attribute, ast.Call, ast.Subscript,
+                                      ast.Await, ast.NamedExpr))
+                   for child in ast.walk(node))
+
+
+def _never_true(test):
+    # if TYPE_CHECKING: and if __name__ == '__main__': blocks are not run on
+    # import
+    if _decorator_name(test) == 'TYPE_CHECKING':
+        return True
+    return (isinstance(test, ast.Compare) and isinstance(test.left, ast.Name) and
+            test.left.id == '__name__' and len(test.comparators) == 1 and
+            isinstance(test.comparators[0], ast.Constant) and
+            test.comparators[0].value == '__main__')
+
+
+def _walk_module_level(node):
+    """
+    Yields the nodes of ``node`` that are executed when it is run at the
+    module level, i.e. excluding the bodies of functions.
+    """
+    todo = [node]
+    while todo:
+        node = todo.pop()
+        yield node
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            todo.extend(node.decorator_list)
+            todo.extend(node.args.defaults)
+            todo.extend(default for default in node.args.kw_defaults if default is not None)
+        elif isinstance(node, ast.Lambda):
+            todo.extend(node.args.defaults)
+        else:
+            todo.extend(ast.iter_child_nodes(node))
+
+
+def _target_names(node):
+    return [child.id for child in ast.walk(node) if isinstance(child, ast.Name)]
+
+
+def _bound_names(stmts):
+    """
+    Returns the names bound by the statements ``stmts`` at the module level.
+    """
+    names = set()
+    for stmt in stmts:
+        for node in _walk_module_level(stmt):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                names.add(node.name)
+            elif isinstance(node, ast.Name) and isinstance(node.ctx, (ast.Store, ast.Del)):
+                names.add(node.id)
+            elif isinstance(node, (ast.Import, ast.ImportFrom)):
+                for alias in node.names:
+                    names.add(alias.asname or alias.name.split('.')[0])
+    return names
+
+
+class _Module:
+
+    def __init__(self, name, filename, ispkg):
+        self.name = name
+        self.filename = filename
+        self.ispkg = ispkg
+        self.namespace = {}
+        # The source files the namespace depends on
+        self.files = {filename}
+
+
+class StaticAnalyzer:
+    """
+    Analyzes the source of modules to find the objects in their namespace.
+
+    The analyzed modules are cached, so the same analyzer should be used for
+    all the modules of a build.
+    """
+
+    def __init__(self):
+        self._specs = {}
+        self._modules = {}
+
+    def find_spec(self, modname):
+        """
+        Finds the spec of module ``modname`` without importing it or its
+        parent packages, or returns `None` if it can't be found.
+        """
+        if modname in sys.modules:
+            return getattr(sys.modules[modname], '__spec__', None)
+        if modname not in self._specs:
+            parent, _, _ = modname.rpartition('.')
+            if parent:
+                parent_spec = self.find_spec(parent)
+                path = None if parent_spec is None else parent_spec.submodule_search_locations
+                spec = None if path is None else PathFinder.find_spec(modname, path)
+            else:
+                spec = PathFinder.find_spec(modname)
+            self._specs[modname] = spec
+        return self._specs[modname]
+
+    def module(self, modname):
+        """
+        Returns the analyzed module ``modname``, or `None` if it can't be
+        analyzed statically.
+        """
+        if modname in self._modules:
+            return self._modules[modname]
+
+        spec = self.find_spec(modname)
+        if (modname in sys.modules or spec is None or
+                not isinstance(spec.loader, SourceFileLoader) or not spec.origin):
+            self._modules[modname] = None
+            return None
+
+        try:
+            with open(spec.origin, 'rb') as f:
+                tree = ast.parse(f.read(), filename=spec.origin)
+        except (OSError, SyntaxError, ValueError):
+            self._modules[modname] = None
+            return None
+
+        module = _Module(modname, spec.origin, spec.submodule_search_locations is not None)
+        self._modules[modname] = _IN_PROGRESS
+        try:
+            self._exec_body(module, tree.body, module.namespace)
+            # Functions may rebind global names when called
+            for node in ast.walk(tree):
+                if isinstance(node, ast.Global):
+                    for name in node.names:
+                        module.namespace[name] = _UNKNOWN
+        except _Dynamic:
+            module = None
+        self._modules[modname] = module
+        return module
+
+    # Execution of the statements of a module
+
+    def _exec_body(self, module, stmts, ns):
+        for stmt in stmts:
+            self._exec(module, stmt, ns)
+
+    def _exec(self, module, stmt, ns):
+
+        for node in _walk_module_level(stmt):
+            if isinstance(node, ast.Name) and node.id in _DYNAMIC_NAMES:
+                raise _Dynamic(node.id)
+            if (isinstance(node, ast.Attribute) and node.attr == 'modules' and
+                    isinstance(node.value, ast.Name) and node.value.id == 'sys'):
+                raise _Dynamic('sys.modules')
+
+        if isinstance(stmt, ast.Import):
+            for alias in stmt.names:
+                self._note_submodule(module, alias.name, ns)
+                if alias.asname:
+                    ns[alias.asname] = ('module', alias.name)
+                else:
+                    top = alias.name.split('.')[0]
+                    ns[top] = ('module', top)
+
+        elif isinstance(stmt, ast.ImportFrom):
+            base = self._resolve_relative(module, stmt.module, stmt.level)
+            self._note_submodule(module, base, ns)
+            for alias in stmt.names:
+                if alias.name == '*':
+                    for name in self._star_names(module, base):
+                        ns[name] = ('import', base, name)
+                else:
+                    ns[alias.asname or alias.name] = ('import', base, alias.name)
+
+        elif isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef)):
+            if all(_decorator_name(dec) in _SAFE_DECORATORS for dec in stmt.decorator_list):
+                ns[stmt.name] = ('routine', module.name + '.' + stmt.name)
+            else:
+                ns[stmt.name] = _UNKNOWN
+
+        elif isinstance(stmt, ast.ClassDef):
+            renamed = any(name in _NAME_ATTRIBUTES for name in _bound_names(stmt.body))
+            if renamed or not all(_decorator_name(dec) in _SAFE_DECORATORS
+                                  for dec in stmt.decorator_list):
+                ns[stmt.name] = _UNKNOWN
+            else:
+                ns[stmt.name] = ('class', module.name + '.' + stmt.name)
+
+        elif isinstance(stmt, ast.Assign):
+            value = self._eval(module, stmt.value, ns)
+            for target in stmt.targets:
+                self._assign(module, target, value, stmt.value, ns)
+
+        elif isinstance(stmt, ast.AnnAssign):
+            if stmt.value is not None:
+                self._assign(module, stmt.target, self._eval(module, stmt.value, ns),
+                             stmt.value, ns)
+
+        elif isinstance(stmt, ast.AugAssign):
+            if isinstance(stmt.target, ast.Name):
+                name = stmt.target.id
+                if name == '__all__' and isinstance(stmt.op, ast.Add):
+                    ns[name] = self._concat_all(ns.get(name, _UNKNOWN),
+                                                self._eval_all(module, stmt.value, ns))
+                elif ns.get(name) == _OTHER and _is_literal(stmt.value):
+                    ns[name] = _OTHER
+                else:
+                    ns[name] = _UNKNOWN
+            else:
+                self._assign(module, stmt.target, _UNKNOWN, None, ns)
+
+        elif isinstance(stmt, ast.Expr):
+            call = stmt.value
+            if (isinstance(call, ast.Call) and isinstance(call.func, ast.Attribute) and
+                    isinstance(call.func.value, ast.Name) and call.func.value.id == '__all__'):
+                current = ns.get('__all__', _UNKNOWN)
+                if call.func.attr == 'extend' and len(call.args) == 1:
+                    ns['__all__'] = self._concat_all(
+                        current, self._eval_all(module, call.args[0], ns))
+                elif call.func.attr == 'append' and len(call.args) == 1:
+                    ns['__all__'] = self._concat_all(
+                        current, self._eval_all(module, ast.List(elts=call.args), ns))
+                else:
+                    ns['__all__'] = _UNKNOWN
+
+        elif isinstance(stmt, ast.Delete):
+            for target in stmt.targets:
+                if isinstance(target, ast.Name):
+                    ns.pop(target.id, None)
+                else:
+                    self._assign(module, target, _UNKNOWN, None, ns)
+
+        elif isinstance(stmt, ast.If):
+            if _never_true(stmt.test):
+                self._exec_body(module, stmt.orelse, ns)
+            else:
+                self._merge(module, [stmt.body, stmt.orelse], ns)
+
+        elif isinstance(stmt, ast.Try) or type(stmt).__name__ == 'TryStar':
+            self._merge(module, [stmt.body + stmt.orelse] +
+                        [handler.body for handler in stmt.handlers], ns)
+            self._exec_body(module, stmt.finalbody, ns)
+
+        elif isinstance(stmt, (ast.With, ast.AsyncWith)):
+            for item in stmt.items:
+                if item.optional_vars is not None:
+                    self._assign(module, item.optional_vars, _UNKNOWN, None, ns)
+            self._exec_body(module, stmt.body, ns)
+
+        elif isinstance(stmt, (ast.For, ast.AsyncFor, ast.While)) or type(stmt).__name__ == 'Match':
+            for name in _bound_names([stmt]):
+                ns[name] = _UNKNOWN
+
+        elif not isinstance(stmt, (ast.Pass, ast.Global, ast.Nonlocal, ast.Assert, ast.Raise)):
+            raise _Dynamic(type(stmt).__name__)
+
+    def _merge(self, module, branches, ns):
+        """
+        Runs each of the alternative ``branches`` of statements, and keeps
+        the names that are bound to the same object in all of them.
+        """
+        results = []
+        for branch in branches:
+            branch_ns = dict(ns)
+            self._exec_body(module, branch, branch_ns)
+            results.append(branch_ns)
+        for name in set().union(*results):
+            values = [result.get(name, _MISSING) for result in results]
+            if all(_same(value, values[0]) for value in values[1:]):
+                if values[0] is _MISSING:
+                    ns.pop(name, None)
+                else:
+                    ns[name] = values[0]
+            else:
+                ns[name] = _UNKNOWN
+
+    def _assign(self, module, target, value, value_node, ns):
+        if isinstance(target, ast.Name):
+            if target.id == '__all__':
+                ns['__all__'] = (_UNKNOWN if value_node is None else
+                                 self._eval_all(module, value_node, ns))
+            else:
+                ns[target.id] = value
+        elif (isinstance(target, (ast.Tuple, ast.List)) and
+              isinstance(value_node, (ast.Tuple, ast.List)) and
+              len(target.elts) == len(value_node.elts) and
+              not any(isinstance(elt, ast.Starred) for elt in target.elts + value_node.elts)):
+            for elt, elt_node in zip(target.elts, value_node.elts):
+                self._assign(module, elt, self._eval(module, elt_node, ns), elt_node, ns)
+        elif isinstance(target, (ast.Attribute, ast.Subscript)):
+            # Assigning attributes or items only matters if it renames an
+            # object or changes __all__
+            base = target.value
+            if isinstance(base, ast.Name) and (
+                    base.id == '__all__' or
+                    (isinstance(target, ast.Attribute) and target.attr in _NAME_ATTRIBUTES)):
+                ns[base.id] = _UNKNOWN
+        else:
+            for name in _target_names(target):
+                ns[name] = _UNKNOWN
+
+    def _note_submodule(self, module, modname, ns):
+        # Importing a submodule of a package binds it in the namespace of
+        # the package
+        if module.ispkg and modname and modname.startswith(module.name + '.'):
+            child = modname[len(module.name) + 1:].split('.')[0]
+            ns[child] = ('module', module.name + '.' + child)
+
+    def _resolve_relative(self, module, name, level):
+        if level == 0:
+            return name
+        parts = module.name.split('.')
+        if not module.ispkg:
+            parts = parts[:-1]
+        if level - 1 >= len(parts) + (0 if parts else 1):
+            raise _Dynamic('relative import beyond top-level package')
+        if level > 1:
+            parts = parts[:-(level - 1)]
+        base = '.'.join(parts)
+        if name:
+            base = base + '.' + name if base else name
+        return base
+
+    # Evaluation of expressions
+
+    def _eval(self, module, node, ns):
+        if isinstance(node, (ast.Constant, ast.JoinedStr, ast.List, ast.Tuple, ast.Set,
+                             ast.Dict, ast.ListComp, ast.SetComp, ast.DictComp)):
+            return _OTHER
+        if isinstance(node, (ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare)):
+            return _OTHER if _is_literal(node) else _UNKNOWN
+        if isinstance(node, ast.Lambda):
+            return ('routine', module.name + '.<lambda>')
+        if isinstance(node, ast.Name):
+            if node.id in ns:
+                return ns[node.id]
+            if hasattr(builtins, node.id):
+                return ('object', getattr(builtins, node.id))
+            return _UNKNOWN
+        if isinstance(node, ast.Attribute):
+            base = self.resolve(self._eval(module, node.value, ns), module.files)
+            if base[0] == 'module':
+                return ('import', base[1], node.attr)
+        return _UNKNOWN
+
+    def _eval_all(self, module, node, ns):
+        if isinstance(node, (ast.List, ast.Tuple)):
+            if all(isinstance(elt, ast.Constant) and isinstance(elt.value, str)
+                   for elt in node.elts):
+                return ('all', tuple(elt.value for elt in node.elts))
+        elif isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add):
+            return self._concat_all(self._eval_all(module, node.left, ns),
+                                    self._eval_all(module, node.right, ns))
+        elif isinstance(node, ast.Name) and node.id == '__all__':
+            return ns.get('__all__', _UNKNOWN)
+        elif isinstance(node, ast.Attribute) and node.attr == '__all__':
+            base = self.resolve(self._eval(module, node.value, ns), module.files)
+            if base[0] == 'module':
+                return self._module_all(module, base[1])
+        elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and
+              node.func.id in ('list', 'tuple', 'sorted') and len(node.args) == 1 and
+              not node.keywords):
+            names = self._eval_all(module, node.args[0], ns)
+            if node.func.id == 'sorted' and names[0] == 'all':
+                names = ('all', tuple(sorted(names[1])))
+            return names
+        return _UNKNOWN
+
+    @staticmethod
+    def _concat_all(a, b):
+        if a[0] == 'all' and b[0] == 'all':
+            return ('all', a[1] + b[1])
+        return _UNKNOWN
+
+    def _module_all(self, module, modname):
+        other = self.module(modname)
+        if other is _IN_PROGRESS:
+            return _UNKNOWN
+        if other is not None:
+            module.files.update(other.files)
+            return other.namespace.get('__all__', _UNKNOWN)
+        mod = self._import(modname)
+        if mod is None or not hasattr(mod, '__all__'):
+            return _UNKNOWN
+        return ('all', tuple(mod.__all__))
+
+    def _star_names(self, module, modname):
+        """
+        Returns the names imported by ``from modname import *``.
+        """
+        other = self.module(modname)
+        if other is _IN_PROGRESS:
+            raise _Dynamic(f'circular import of {modname}')
+        if other is not None:
+            module.files.update(other.files)
+            names = other.namespace.get('__all__')
+            if names is None:
+                return [name for name in other.namespace if not name.startswith('_')]
+            if names[0] != 'all':
+                raise _Dynamic(f'__all__ of {modname}')
+            return names[1]
+        mod = self._import(modname)
+        if mod is None:
+            raise _Dynamic(f"can't import {modname}")
+        if hasattr(mod, '__all__'):
+            return list(mod.__all__)
+        return [name for name in dir(mod) if not name.startswith('_')]
+
+    # Resolution of imported names
+
+    def _import(self, modname):
+        if modname not in sys.modules:
+            build_stats.count('modules imported for static discovery')
+        try:
+            return importlib.import_module(modname)
+        except Exception:
+            return None
+
+    def _lookup(self, modname, name, files):
+        other = self.module(modname)
+        if other is _IN_PROGRESS:
+            return _UNKNOWN
+        if other is not None:
+            files.update(other.files)
+            binding = other.namespace.get(name, _MISSING)
+            if binding is _MISSING:
+                if other.ispkg and self.find_spec(modname + '.' + name) is not None:
+                    return ('module', modname + '.' + name)
+                return _UNKNOWN
+            return binding
+
+        mod = self._import(modname)
+        if mod is None:
+            return _UNKNOWN
+        if hasattr(mod, name):
+            obj = getattr(mod, name)
+            return ('module', obj.__name__) if ismodule(obj) else ('object', obj)
+        if self.find_spec(modname + '.' + name) is not None:
+            return ('module', modname + '.' + name)
+        return _UNKNOWN
+
+    def resolve(self, binding, files):
+        """
+        Follows imported names until the object they refer to is found, and
+        adds the source files that were analyzed to do so to ``files``.
+        """
+        for _ in range(100):
+            if binding[0] != 'import':
+                return binding
+            binding = self._lookup(binding[1], binding[2], files)
+        return _UNKNOWN
+
+
+def static_module_info(modname, analyzer=None):
+    """
+    Returns the same description of module ``modname`` as
+    `~sphinx_automodapi.utils.introspect_module`, but obtained by analyzing
+    its source instead of importing it, or `None` if the description can't
+    be determined statically.
+
+    ``analyzer`` is the `StaticAnalyzer` used to analyze the module and the
+    modules it imports from.
+    """
+    if analyzer is None:
+        analyzer = StaticAnalyzer()
+
+    module = analyzer.module(modname)
+    if module is None or module is _IN_PROGRESS:
+        return None
+    ns = module.namespace
+    if '__dir__' in ns:
+        return None
+
+    files = set(module.files)
+    if '__all__' in ns:
+        if ns['__all__'][0] != 'all':
+            return None
+        names = list(ns['__all__'][1])
+    else:
+        names = sorted(name for name in ns if not name.startswith('_'))
+
+    items = []
+    for name in names:
+        binding = ns.get(name, ('import', modname, name))
+        binding = analyzer.resolve(binding, files)
+        kind = binding[0]
+        if kind == 'module':
+            continue
+        elif kind in ('class', 'routine'):
+            items.append([name, binding[1], kind])
+        elif kind == 'other':
+            items.append([name, modname + '.' + name, kind])
+        elif kind == 'object':
+            obj = binding[1]
+            if ismodule(obj):
+                continue
+            if hasattr(obj, '__module__') and hasattr(obj, '__name__'):
+                fqname = obj.__module__ + '.' + obj.__name__
+            else:
+                fqname = modname + '.' + name
+            filename = getattr(sys.modules.get(getattr(obj, '__module__', None)), '__file__', None)
+            if isinstance(filename, str):
+                files.add(filename)
+            items.append([name, fqname, obj_kind(obj)])
+        else:
+            return None
+
+    return {'items': items,
+            'has_all': '__all__' in ns,
+            'ispkg': module.ispkg and os.path.basename(module.filename).startswith('__init__.py'),
+            'files': sorted(files)}
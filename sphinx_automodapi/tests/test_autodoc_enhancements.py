@@ -1,7 +1,10 @@
+import gc
+import weakref
 from textwrap import dedent
 
 import pytest
 
+from .. import autodoc_enhancements
 from ..autodoc_enhancements import type_object_attrgetter
 
 
@@ -58,3 +61,42 @@ def test_type_attrgetter_for_dataclass():
         getattr(MyDataclass, 'foo')
     assert type_object_attrgetter(MyDataclass, 'foo') == dataclasses.MISSING
     assert getattr(MyDataclass, 'bar') == 'bar value'
+
+
+def test_type_attrgetter_cache():
+    """
+    The properties of each class are found with a single walk of its MRO, and
+    cached without keeping the class alive.
+    """
+
+    class Base:
+        @property
+        def foo(self):
+            """Base.foo"""
+
+        @property
+        def bar(self):
+            """Base.bar"""
+
+    class Sub(Base):
+        bar = 'not a property'
+
+    assert type_object_attrgetter(Sub, 'foo').__doc__ == 'Base.foo'
+    assert type_object_attrgetter(Sub, 'bar') == 'not a property'
+    assert type_object_attrgetter(Sub, '__init__') is object.__init__
+    assert list(autodoc_enhancements._class_properties[Sub]) == ['foo']
+
+    ref = weakref.ref(Sub)
+    del Base, Sub
+    gc.collect()
+    assert ref() is None
+
+    class UnhashableMeta(type):
+        __hash__ = None
+
+    class Unhashable(metaclass=UnhashableMeta):
+        @property
+        def foo(self):
+            """Unhashable.foo"""
+
+    assert type_object_attrgetter(Unhashable, 'foo').__doc__ == 'Unhashable.foo'
@@ -105,6 +105,39 @@ def test_am_replacer_writereprocessed(tmpdir, writereprocessed):
     assert tmpdir.join('index.rst.automodapi').isfile() is writereprocessed
 
 
+def test_am_replacer_memoized(tmpdir, monkeypatch):
+    """
+    Tests that the automodapi expansion done during builder-inited is reused
+    during source-read
+    """
+
+    from .. import automodapi
+
+    calls = []
+    expand = automodapi._expand_automodapi
+
+    def counting_expand(sourcestr, app, dotoctree, docname):
+        calls.append(docname)
+        return expand(sourcestr, app, dotoctree, docname)
+
+    monkeypatch.setattr(automodapi, '_expand_automodapi', counting_expand)
+
+    with open(tmpdir.join('index.rst').strpath, 'w', encoding='utf-8') as f:
+        f.write(am_replacer_str.format(options=''))
+
+    run_sphinx_in_tmpdir(tmpdir)
+
+    assert calls.count('index') == 1
+
+    with open(tmpdir.join('index.rst.automodapi').strpath) as f:
+        result = f.read()
+
+    assert result == am_replacer_basic_expected
+
+    # the cache should not be kept once the documents have been read
+    assert automodapi._replace_cache == {}
+
+
 am_replacer_noinh_expected = """
 This comes before
 
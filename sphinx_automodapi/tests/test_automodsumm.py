@@ -1,5 +1,8 @@
 # Licensed under a 3-clause BSD style license - see LICENSE.rst
 
+import os
+import json
+import shutil
 from copy import copy
 
 import pytest
@@ -248,3 +251,517 @@ def test_sort(tmpdir):
         result = f.read()
 
     assert result == sorted_expected
+
+
+# =============================================================================
+
+incremental_str = """
+Before
+
+.. automodsumm:: sphinx_automodapi.tests.example_module.mixed
+    :toctree: api
+{options}
+
+And After
+"""
+
+
+def test_incremental_generation(tmpdir):
+
+    apidir = tmpdir.join('api')
+    add_rst = apidir.join('sphinx_automodapi.tests.example_module.mixed.add.rst')
+    spam_rst = apidir.join('sphinx_automodapi.tests.example_module.mixed.MixedSpam.rst')
+    conf = {'automodsumm_incremental_generation': True}
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(incremental_str.format(options=''))
+
+    # Hand-written stubs should never be touched
+    apidir.ensure(dir=True)
+    other_rst = apidir.join('other.rst')
+    other_rst.write(':orphan:\n\nOther\n=====\n')
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert add_rst.check() and spam_rst.check()
+    mtimes = add_rst.mtime(), spam_rst.mtime()
+    contents = add_rst.read(), spam_rst.read()
+
+    # Unchanged stubs should not be rewritten on the next build
+    os.utime(add_rst.strpath, (0, 0))
+    os.utime(spam_rst.strpath, (0, 0))
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert (add_rst.mtime(), spam_rst.mtime()) == (0, 0)
+    assert (add_rst.read(), spam_rst.read()) == contents
+    assert mtimes != (0, 0)
+
+    # Stubs for objects that are no longer documented should be removed
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(incremental_str.format(options='    :classes-only:'))
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert not add_rst.check()
+    assert spam_rst.check() and spam_rst.mtime() == 0
+    assert other_rst.read() == ':orphan:\n\nOther\n=====\n'
+
+    # Stubs that were deleted should be regenerated
+    spam_rst.remove()
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert spam_rst.read() == contents[1]
+
+
+DUPLICATE_ITEMS = """
+.. currentmodule:: sphinx_automodapi.tests.example_module.functions
+
+.. autosummary::
+    :toctree: api
+{first}
+
+    add
+
+.. autosummary::
+    :toctree: api
+{second}
+
+    add
+"""
+
+
+@pytest.mark.parametrize('reverse', [False, True])
+def test_duplicate_items(tmpdir, reverse):
+
+    from ..automodsumm import generate_automodsumm_docs
+
+    # The same object listed with different options only gets one stub,
+    # whatever the order of the directives, so that stubs can't be written
+    # concurrently for both.
+    options = ['', '    :template: autosummary_core/module.rst']
+    if reverse:
+        options.reverse()
+    lines = DUPLICATE_ITEMS.format(first=options[0], second=options[1]).splitlines()
+
+    fn = tmpdir.join('api', 'sphinx_automodapi.tests.example_module.functions.add.rst')
+    assert generate_automodsumm_docs(lines, 'index.rst', base_path=tmpdir.strpath) == [
+        (fn.strpath, True)]
+    assert '.. autofunction:: add' in fn.read()
+
+
+AUTOMODSUMM_BLOCKS = """
+Title
+=====
+
+.. automodsumm:: pkg.first
+    :toctree: api
+    :skip: Spam
+
+Text.
+
+
+  .. automodsumm:: pkg.second
+
+      :functions-only:
+        not an option
+
+.. automodsumm:: pkg.first extra
+
+.. automodsumm:: pkg.third
+"""
+
+
+def test_iter_automodsumm_blocks():
+
+    from ..automodsumm import _iter_automodsumm_blocks
+
+    # Blank lines before the directive used to prevent its options from being
+    # found.
+    assert list(_iter_automodsumm_blocks(AUTOMODSUMM_BLOCKS)) == [
+        (5, '', 'pkg.first', '    :toctree: api\n    :skip: Spam\n', '    '),
+        (12, '  ', 'pkg.second', '      :functions-only:\n', '    '),
+        (19, '', 'pkg.third', '', None)]
+
+    # Line numbers stay right in documents with many directives
+    text = '.. automodsumm:: pkg.mod\n    :toctree: api\n\n' * 1000
+    blocks = list(_iter_automodsumm_blocks(text))
+    assert len(blocks) == 1000
+    assert blocks[-1][0] == 2998
+
+
+def test_stub_manifest(tmpdir):
+
+    from ..automodsumm import StubManifest
+
+    stub = tmpdir.join('api', 'stub.rst')
+    stub.ensure()
+    doctreedir = tmpdir.join('doctrees').strpath
+
+    manifest = StubManifest(tmpdir.strpath, doctreedir)
+    assert manifest.record(stub.strpath, 'Stub\n')
+    stub.write('Stub\n')
+    manifest.save()
+
+    # Stubs are only kept, or left as they are, if they were not modified
+    assert StubManifest(tmpdir.strpath, doctreedir).keep(stub.strpath)
+    assert not StubManifest(tmpdir.strpath, doctreedir).record(stub.strpath, 'Stub\n')
+    stub.write('Edited\n')
+    assert not StubManifest(tmpdir.strpath, doctreedir).keep(stub.strpath)
+    assert StubManifest(tmpdir.strpath, doctreedir).record(stub.strpath, 'Stub\n')
+
+
+class _ListsMissingMeta(type):
+    def __dir__(cls):
+        return ['method', 'missing']
+
+
+class ListsMissing(metaclass=_ListsMissingMeta):
+    def method(self):
+        pass
+
+
+def test_classify_members_class_missing_attribute():
+
+    from ..utils import _classify_members_class
+
+    # Members that are listed by dir() but can't be accessed are listed with
+    # the type of the previous member
+    members = _classify_members_class(None, ListsMissing, include_base=True)
+    assert members[None] == ['method', 'missing']
+    assert members['method'] == ['method', 'missing']
+
+
+def test_may_contain_automod(tmpdir):
+
+    from ..automodsumm import _may_contain_automod
+
+    for content, expected in [('', False),
+                              ('Title\n=====\n\n.. automodule:: os\n', False),
+                              ('.. automodsumm:: os\n', True),
+                              ('.. automodapi:: os\n', True),
+                              ('.. automod-diagram:: os\n', True)]:
+        tmpdir.join('doc.rst').write(content)
+        assert _may_contain_automod(tmpdir.join('doc.rst').strpath) is expected
+
+
+def test_find_documented_modules(tmpdir):
+
+    from ..automodsumm import _find_documented_modules
+
+    # Modules that are only documented by inheritance diagrams are found too
+    tmpdir.join('api.rst').write('.. automodapi:: os.path\n')
+    tmpdir.join('diagram.rst').write('.. automod-diagram:: collections\n')
+    assert _find_documented_modules([tmpdir.join('api.rst').strpath,
+                                     tmpdir.join('diagram.rst').strpath]) == [
+        'collections', 'os.path']
+
+
+def test_scan_exclude(tmpdir):
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(ams_to_asmry_str.format(options=''))
+
+    write_api_files_to_tmpdir(tmpdir)
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodsumm_scan_exclude': ['index.*']})
+
+    assert not tmpdir.join('index.rst.automodsumm').check()
+
+
+@pytest.mark.parametrize(('pattern', 'excluded'), [('*.rst', False),
+                                                   ('**.rst', True),
+                                                   ('**/*.rst', True),
+                                                   ('sub/*', True)])
+def test_scan_exclude_nested(tmpdir, pattern, excluded):
+
+    # Like in exclude_patterns, * does not match across directories
+    tmpdir.join('index.rst').write('Index\n=====\n\n.. toctree::\n\n    sub/nested\n')
+    tmpdir.mkdir('sub').join('nested.rst').write(
+        'Nested\n======\n' + ams_to_asmry_str.format(options=''))
+
+    write_api_files_to_tmpdir(tmpdir)
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodsumm_scan_exclude': [pattern]})
+
+    assert tmpdir.join('sub', 'nested.rst.automodsumm').check() is not excluded
+
+
+def test_module_index(tmpdir):
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(ams_to_asmry_str.format(options=''))
+
+    write_api_files_to_tmpdir(tmpdir)
+
+    for build in range(2):
+        run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodsumm_module_index': True})
+
+        assert tmpdir.join('_build', 'html', '.doctrees', 'automodapi_modules.json').check()
+
+        with open(tmpdir.join('index.rst.automodsumm').strpath) as f:
+            result = f.read()
+
+        assert result == ams_to_asmry_expected
+
+
+def test_module_index_objects(tmpdir):
+
+    # The objects documented by the stubs are described by the index too, so
+    # that rebuilding the stubs does not require importing and classifying
+    # them again
+    tmpdir.join('index.rst').write(incremental_str.format(options=''))
+    conf = {'automodsumm_module_index': True, 'automodsumm_incremental_generation': True,
+            'automodapi_build_stats': True}
+
+    stubs = []
+    for build in range(2):
+        run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+        with open(tmpdir.join('_build', 'html', '.doctrees', 'automodapi_stats.json').strpath) as f:
+            counters = json.load(f)['counters']
+        stubs.append({fname: tmpdir.join('api', fname).read()
+                      for fname in sorted(os.listdir(tmpdir.join('api').strpath))
+                      if fname.endswith('.rst')})
+
+    assert counters['objects found in index'] == 2
+    assert 'objects introspected' not in counters
+    assert stubs[1] == stubs[0]
+
+
+def test_introspection_workers(tmpdir):
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(ams_to_asmry_str.format(options=''))
+
+    write_api_files_to_tmpdir(tmpdir)
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodsumm_introspection_workers': 2})
+
+    with open(tmpdir.join('index.rst.automodsumm').strpath) as f:
+        result = f.read()
+
+    assert result == ams_to_asmry_expected
+
+
+def test_introspection_workers_objects(tmpdir):
+
+    # The objects that stubs are generated for are introspected by the
+    # workers, and their stubs are the same as without workers
+    tmpdir.join('index.rst').write(incremental_str.format(options=''))
+
+    stubs = []
+    for workers in (0, 2):
+        apidir = tmpdir.join('api')
+        if apidir.check():
+            apidir.remove()
+        run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodsumm_introspection_workers': workers,
+                                                      'automodapi_build_stats': True})
+        with open(tmpdir.join('_build', 'html', '.doctrees', 'automodapi_stats.json').strpath) as f:
+            counters = json.load(f)['counters']
+        stubs.append({fname: apidir.join(fname).read()
+                      for fname in sorted(os.listdir(apidir.strpath))
+                      if fname.endswith('.rst')})
+
+    assert counters['objects introspected in workers'] == 2
+    assert 'objects introspected' not in counters
+    assert len(stubs[0]) == 2
+    assert stubs[1] == stubs[0]
+
+
+parallel_str = """
+.. automodsumm:: sphinx_automodapi.tests.example_module.mixed
+    :toctree: api
+
+.. automodsumm:: sphinx_automodapi.tests.example_module.classes
+    :toctree: api
+    :inherited-members:
+
+.. automodsumm:: sphinx_automodapi.tests.example_module.functions
+    :toctree: api
+
+.. automodsumm:: sphinx_automodapi.tests.example_module.slots
+    :toctree: api
+"""
+
+
+def test_parallel_generation(tmpdir):
+
+    from sphinx.cmd.build import build_main
+
+    from .helpers import DEFAULT_CONF, write_conf
+
+    # Stubs generated from objects introspected by worker processes are
+    # byte-identical to those generated serially
+    trees = []
+    for parallel in (False, True):
+        srcdir = tmpdir.mkdir('parallel' if parallel else 'serial')
+        srcdir.join('index.rst').write(parallel_str)
+        write_conf(srcdir.join('conf.py').strpath,
+                   dict(DEFAULT_CONF, automodsumm_parallel_generation=parallel,
+                        automodapi_build_stats=True))
+        argv = ['-q', '-b', 'html', srcdir.strpath, srcdir.join('_build').strpath]
+        if parallel:
+            argv = ['-j', '2'] + argv
+        assert build_main(argv=argv) == 0
+
+        with open(srcdir.join('_build', '.doctrees', 'automodapi_stats.json').strpath) as f:
+            counters = json.load(f)['counters']
+        if parallel:
+            assert counters['objects introspected in workers'] == len(trees[0])
+            assert 'objects introspected' not in counters
+        else:
+            assert 'objects introspected in workers' not in counters
+
+        apidir = srcdir.join('api')
+        trees.append({fname: apidir.join(fname).read_binary()
+                      for fname in sorted(os.listdir(apidir.strpath))
+                      if fname.endswith('.rst')})
+
+    assert len(trees[0]) == 10
+    assert trees[1] == trees[0]
+
+
+CLASS_TEMPLATE = """
+{{{{ objname }}}}
+{{{{ underline }}}}
+
+.. currentmodule:: {{{{ module }}}}
+
+.. autoclass:: {{{{ objname }}}}
+
+Version {version}
+"""
+
+
+def test_template_bytecode_cache(tmpdir):
+
+    spam_rst = tmpdir.join('api', 'sphinx_automodapi.tests.example_module.mixed.MixedSpam.rst')
+    conf = {'automodsumm_incremental_generation': True, 'templates_path': ['_templates']}
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(incremental_str.format(options='    :classes-only:'))
+
+    template = tmpdir.mkdir('_templates').mkdir('autosummary_core').join('class.rst')
+    template.write(CLASS_TEMPLATE.format(version=1))
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert spam_rst.read().endswith('Version 1\n')
+    assert tmpdir.join('_build', 'html', '.doctrees', 'automodsumm_templates').listdir()
+
+    # Changes to the templates should be picked up despite the cache
+    template.write(CLASS_TEMPLATE.format(version=2))
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert spam_rst.read().endswith('Version 2\n')
+
+
+def test_in_memory_stubs(tmpdir):
+
+    spam_rst = tmpdir.join('api', 'sphinx_automodapi.tests.example_module.mixed.MixedSpam.rst')
+    spam_html = tmpdir.join('_build', 'html', 'api',
+                            'sphinx_automodapi.tests.example_module.mixed.MixedSpam.html')
+    spam_source = tmpdir.join('_build', 'html', '_sources', 'api',
+                              'sphinx_automodapi.tests.example_module.mixed.MixedSpam.rst.txt')
+    conf = {'automodsumm_in_memory_stubs': True, 'templates_path': ['_templates']}
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(incremental_str.format(options='    :classes-only:'))
+
+    template = tmpdir.mkdir('_templates').mkdir('autosummary_core').join('class.rst')
+    template.write(CLASS_TEMPLATE.format(version=1))
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    # The stub file is a placeholder, but Sphinx reads the generated stub
+    placeholder = spam_rst.read()
+    assert placeholder.startswith('.. The stub for sphinx_automodapi.tests.example_module')
+    assert 'Version 1' in spam_html.read()
+    assert spam_source.read().endswith('Version 1\n')
+
+    # The placeholder is not rewritten when the stub changes, but the
+    # document is still read again
+    os.utime(spam_rst.strpath, (0, 0))
+    template.write(CLASS_TEMPLATE.format(version=2))
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert spam_rst.mtime() == 0 and spam_rst.read() == placeholder
+    assert 'Version 2' in spam_html.read()
+    assert spam_source.read().endswith('Version 2\n')
+
+    # Without the option, placeholders are replaced by the stubs
+    conf['automodsumm_in_memory_stubs'] = False
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert spam_rst.read().endswith('Version 2\n')
+
+
+def test_diagram_urls_resolved_once(monkeypatch):
+
+    from sphinx.ext.inheritance_diagram import InheritanceGraph
+
+    from .. import automodsumm
+
+    imported = []
+    original_try_import = automodsumm.try_import
+
+    def try_import(name):
+        imported.append(name)
+        return original_try_import(name)
+
+    monkeypatch.setattr(automodsumm, 'try_import', try_import)
+    monkeypatch.setattr(automodsumm, '_class_fullnames', {})
+
+    graph = InheritanceGraph(['sphinx_automodapi.tests.example_module.classes.Spam'], '')
+
+    # Spam is documented where it is imported rather than where it is defined
+    urls = {'sphinx_automodapi.tests.example_module.Spam': 'spam.html',
+            'sphinx_automodapi.tests.example_module.Missing': 'missing.html'}
+
+    for _ in range(2):
+        if automodsumm.SPHINX_LT_8_2:
+            dot = graph.generate_dot('diagram', urls)
+        else:
+            dot = graph._generate_dot('diagram', urls)
+        assert 'URL="spam.html"' in dot
+        assert 'missing.html' not in dot
+
+    assert sorted(imported) == sorted(urls)
+
+
+diagram_str = """
+Before
+
+.. automod-diagram:: sphinx_automodapi.tests.example_module.classes
+
+And After
+"""
+
+
+@pytest.mark.skipif(shutil.which('dot') is None, reason='requires graphviz')
+def test_diagram_cache(tmpdir, monkeypatch):
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(diagram_str)
+
+    conf = {'automodsumm_diagram_cache': 'diagrams', 'nitpicky': False}
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    cached = sorted(path.basename for path in tmpdir.join('diagrams').listdir())
+    images = tmpdir.join('_build', 'html', '_images')
+    assert len(cached) > 0
+    assert cached == sorted(path.basename for path in images.listdir())
+
+    # The images should be restored from the cache in a clean build, without
+    # running graphviz (which can't be found anymore).
+    tmpdir.join('_build').remove()
+    monkeypatch.setenv('PATH', '')
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert cached == sorted(path.basename for path in images.listdir())
@@ -0,0 +1,82 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import json
+
+from ..build_plan import BuildPlan, main
+from .helpers import run_sphinx_in_tmpdir, write_conf, DEFAULT_CONF
+from .test_automodsumm import incremental_str
+
+ADD = 'api/sphinx_automodapi.tests.example_module.mixed.add.rst'
+SPAM = 'api/sphinx_automodapi.tests.example_module.mixed.MixedSpam.rst'
+
+
+def test_build_plan_diff():
+
+    old = BuildPlan('src')
+    old.add('src/a.rst', {'name': 'a'})
+    old.add('src/b.rst', {'name': 'b'})
+    old.add('src/c.rst', {'name': 'c'})
+
+    new = BuildPlan('src')
+    new.add('src/a.rst', {'name': 'a'})
+    new.add('src/b.rst', {'name': 'b', 'options': {'noindex': True}})
+    new.add('src/d.rst', {'name': 'd'})
+
+    assert new.fingerprint('src/a.rst') == old.fingerprint('src/a.rst')
+    assert new.diff(old) == {'added': ['d.rst'], 'removed': ['c.rst'],
+                             'changed': ['b.rst'], 'unchanged': ['a.rst']}
+    assert new.diff(None)['added'] == ['a.rst', 'b.rst', 'd.rst']
+
+
+def test_build_plan_dry_run(tmpdir):
+
+    tmpdir.join('index.rst').write(incremental_str.format(options=''))
+    write_conf(tmpdir.join('conf.py').strpath, DEFAULT_CONF)
+
+    # Writing the plan doesn't generate the stubs
+    plan_json = tmpdir.join('plan.json')
+    main([tmpdir.strpath, plan_json.strpath])
+
+    assert not tmpdir.join('api').check()
+    with open(plan_json.strpath) as f:
+        plan = json.load(f)['stubs']
+    assert sorted(plan) == [SPAM, ADD]
+    assert plan[ADD]['objtype'] == 'function'
+    assert plan[ADD]['template'] == 'autosummary_core/base.rst'
+    assert plan[SPAM]['template'] == 'autosummary_core/class.rst'
+    assert plan[SPAM]['options'] == {'noindex': None, 'inherited_members': False,
+                                     'included_members': ['__init__', '__call__'],
+                                     'properties_are_attributes': True}
+
+    # The plan written by the build is the same
+    conf = {'automodsumm_build_plan': 'build_plan.json',
+            'automodsumm_incremental_generation': True,
+            'automodapi_build_stats': True}
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    assert tmpdir.join(ADD).check() and tmpdir.join(SPAM).check()
+    assert BuildPlan.load(tmpdir.join('build_plan.json').strpath, tmpdir.strpath).stubs == plan
+
+    # Stubs whose inputs did not change are not rendered again, unless they
+    # were modified, in which case they are restored
+    original = tmpdir.join(ADD).read()
+    modified = 'add\n===\n\n.. autofunction:: sphinx_automodapi.tests.example_module.mixed.add\n'
+    tmpdir.join(ADD).write(modified)
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    with open(tmpdir.join('_build', 'html', '.doctrees', 'automodapi_stats.json').strpath) as f:
+        counters = json.load(f)['counters']
+    assert counters['stubs planned'] == 2
+    assert counters['stubs unchanged (from build plan)'] == 1
+    assert counters['stubs written'] == 1
+    assert 'stubs unchanged' not in counters
+    assert tmpdir.join(ADD).read() == original
+
+    # Changing the options of classes changes their fingerprint
+    conf = dict(DEFAULT_CONF, automodsumm_inherited_members=True)
+    write_conf(tmpdir.join('conf.py').strpath, conf)
+    main([tmpdir.strpath, plan_json.strpath])
+
+    new_plan = BuildPlan.load(plan_json.strpath, tmpdir.strpath)
+    diff = new_plan.diff(BuildPlan.load(tmpdir.join('build_plan.json').strpath, tmpdir.strpath))
+    assert diff == {'added': [], 'removed': [], 'changed': [SPAM], 'unchanged': [ADD]}
@@ -75,7 +75,9 @@ def test_run_full_case(tmpdir, case_dir, parallel, prop_attr):
     conf.update({'automodapi_toctreedirnm': 'api',
                  'automodapi_writereprocessed': True,
                  'automodsumm_writereprocessed': True,
-                 'automodsumm_properties_are_attributes': prop_attr})
+                 'automodsumm_properties_are_attributes': prop_attr,
+                 'automodsumm_parallel_generation': parallel,
+                 'automodsumm_scan_workers': 4 if parallel else 1})
 
     if os.path.basename(case_dir) in ('mixed_toplevel',
                                       'mixed_toplevel_all_objects',
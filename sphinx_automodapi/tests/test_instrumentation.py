@@ -0,0 +1,118 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import json
+import sys
+from importlib.machinery import SourceFileLoader
+
+import pytest
+
+from ..instrumentation import BuildStats, ImportProfiler
+from .helpers import run_sphinx_in_tmpdir
+from .test_automodsumm import incremental_str
+
+
+def test_build_stats():
+
+    stats = BuildStats()
+
+    # Nothing is recorded unless enabled
+    with stats.timer('phase'):
+        stats.count('things')
+    assert stats.as_dict() == {'times': {}, 'calls': {}, 'counters': {}}
+
+    stats.enabled = True
+    for _ in range(2):
+        with stats.timer('phase'):
+            stats.count('things', 3)
+
+    stats.merge({'times': {'phase': 1., 'other': 2.},
+                 'calls': {'phase': 1, 'other': 1},
+                 'counters': {'things': 1}})
+
+    result = stats.as_dict()
+    assert result['calls'] == {'phase': 3, 'other': 1}
+    assert result['counters'] == {'things': 7}
+    assert result['times']['phase'] >= 1.
+    assert stats.summary()[0].startswith('other: 2.000 s (1 calls)')
+
+    stats.reset()
+    assert stats.as_dict() == {'times': {}, 'calls': {}, 'counters': {}}
+
+
+def test_build_stats_report(tmpdir):
+
+    with open(tmpdir.join('index.rst').strpath, 'w') as f:
+        f.write(incremental_str.format(options=''))
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodapi_build_stats': True})
+
+    with open(tmpdir.join('_build', 'html', '.doctrees', 'automodapi_stats.json').strpath) as f:
+        report = json.load(f)
+
+    assert report['counters']['stubs written'] == 2
+    assert report['counters']['documents scanned'] == 1
+    assert report['counters']['modules introspected'] >= 1
+    for phase in ('document scanning', 'stub generation', 'stub writing'):
+        assert report['calls'][phase] >= 1
+
+
+@pytest.fixture
+def temp_modules(tmpdir):
+    """
+    Creates modules apyhtest_profile_a, which imports apyhtest_profile_b.
+    """
+    tmpdir.join('apyhtest_profile_a.py').write(
+        'import time\nimport apyhtest_profile_b\ntime.sleep(0.01)\n\n'
+        'def spam():\n    pass\n')
+    tmpdir.join('apyhtest_profile_b.py').write('import time\ntime.sleep(0.02)\n')
+    sys.path.insert(0, tmpdir.strpath)
+    yield
+    sys.path.remove(tmpdir.strpath)
+    for modname in ('apyhtest_profile_a', 'apyhtest_profile_b'):
+        sys.modules.pop(modname, None)
+
+
+def test_import_profiler(temp_modules):
+
+    profiler = ImportProfiler()
+    profiler.enabled = True
+    profiler.install()
+    try:
+        with profiler.trigger('automodapi:: apyhtest_profile_a', 'index'):
+            import apyhtest_profile_a
+    finally:
+        profiler.uninstall()
+    assert profiler not in sys.meta_path
+
+    # The module looks the same as if it was imported without the profiler
+    assert isinstance(apyhtest_profile_a.__loader__, SourceFileLoader)
+    assert isinstance(apyhtest_profile_a.__spec__.loader, SourceFileLoader)
+
+    report = profiler.report()
+    modules = {entry['module']: entry for entry in report['modules']}
+    assert [entry['module'] for entry in report['modules']] == [
+        'apyhtest_profile_a', 'apyhtest_profile_b']
+    a, b = modules['apyhtest_profile_a'], modules['apyhtest_profile_b']
+    assert b['imported_by'] == 'apyhtest_profile_a' and a['imported_by'] is None
+    assert b['self'] >= 0.02 and 0.01 <= a['self'] < a['cumulative']
+    assert a['self'] + b['cumulative'] == pytest.approx(a['cumulative'])
+    assert b['directive'] == 'automodapi:: apyhtest_profile_a' and b['document'] == 'index'
+
+    # The time of the directive only counts each import once
+    assert report['directives'] == [{'directive': 'automodapi:: apyhtest_profile_a',
+                                     'document': 'index', 'time': a['cumulative'],
+                                     'modules': 2}]
+
+
+def test_import_profile_report(tmpdir, temp_modules):
+
+    tmpdir.join('index.rst').write('.. automodapi:: apyhtest_profile_a\n')
+    run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodapi_import_profile': True})
+
+    profile = tmpdir.join('_build', 'html', '.doctrees', 'automodapi_import_profile.json')
+    with open(profile.strpath) as f:
+        report = json.load(f)
+
+    assert report['modules'][0]['module'] == 'apyhtest_profile_a'
+    assert report['directives'][0]['directive'] == 'automodapi:: apyhtest_profile_a'
+    assert report['directives'][0]['document'] == 'index'
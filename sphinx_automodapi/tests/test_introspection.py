@@ -0,0 +1,157 @@
+import os
+import sys
+
+import pytest
+
+from ..introspection import (ModuleIndex, introspect_in_subprocesses, prefetch_module_infos,
+                             prefetch_object_infos)
+from ..utils import ModObjsCache, introspect_module, introspect_object
+
+
+@pytest.fixture
+def temp_module(tmpdir):
+    """
+    Creates a module named apyhtest_index that can be modified by the tests.
+    """
+    modfile = tmpdir.join('apyhtest_index.py')
+    modfile.write('def spam():\n    pass\n')
+
+    sys.path.insert(0, tmpdir.strpath)
+    yield modfile
+    sys.path.remove(tmpdir.strpath)
+    sys.modules.pop('apyhtest_index', None)
+
+
+def test_module_index(tmpdir, temp_module):
+
+    doctreedir = tmpdir.join('doctrees').strpath
+
+    cache = ModObjsCache()
+    cache.index = ModuleIndex(doctreedir)
+    assert cache.find_mod_kinds('apyhtest_index') == (['spam'], ['apyhtest_index.spam'],
+                                                      ['routine'])
+    cache.index.save()
+
+    # In a new build, the module should not need to be imported
+    del sys.modules['apyhtest_index']
+    cache = ModObjsCache()
+    cache.index = ModuleIndex(doctreedir)
+    assert cache.find_mod_kinds('apyhtest_index') == (['spam'], ['apyhtest_index.spam'],
+                                                      ['routine'])
+    assert 'apyhtest_index' not in sys.modules
+
+    # Only touching the file should not invalidate the entry
+    os.utime(temp_module.strpath, (0, 0))
+    cache = ModObjsCache()
+    cache.index = ModuleIndex(doctreedir)
+    assert cache.find_mod_kinds('apyhtest_index')[0] == ['spam']
+    assert 'apyhtest_index' not in sys.modules
+
+    # Changing the module should
+    temp_module.write('class Egg:\n    pass\n')
+    cache = ModObjsCache()
+    cache.index = ModuleIndex(doctreedir)
+    assert cache.find_mod_kinds('apyhtest_index') == (['Egg'], ['apyhtest_index.Egg'],
+                                                      ['class'])
+    assert 'apyhtest_index' in sys.modules
+
+
+def test_module_index_objects(tmpdir, temp_module):
+
+    doctreedir = tmpdir.join('doctrees').strpath
+    temp_module.write('class Spam:\n    def egg(self):\n        pass\n')
+
+    cache = ModObjsCache()
+    cache.index = ModuleIndex(doctreedir)
+    info = cache.object_info('apyhtest_index.Spam')
+    assert info == introspect_object('apyhtest_index.Spam')
+    assert info['objtype'] == 'class'
+    assert info['members']['method'] == ['egg']
+    assert 'egg' in info['all_members']
+    cache.index.save()
+
+    # In a new build, the class and its members are described without
+    # importing it, as long as the option to include inherited members is
+    # the same
+    del sys.modules['apyhtest_index']
+    cache = ModObjsCache()
+    cache.index = ModuleIndex(doctreedir)
+    assert cache.object_info('apyhtest_index.Spam') == info
+    assert 'apyhtest_index' not in sys.modules
+    assert 'egg' in cache.object_info('apyhtest_index.Spam', include_base=True)['all_members']
+    assert 'apyhtest_index' in sys.modules
+    cache.index.save()
+
+    # Changing the module invalidates the entries
+    temp_module.write('class Spam:\n    def ham(self):\n        pass\n')
+    del sys.modules['apyhtest_index']
+    cache = ModObjsCache()
+    cache.index = ModuleIndex(doctreedir)
+    assert cache.object_info('apyhtest_index.Spam')['members']['method'] == ['ham']
+
+
+def test_introspect_in_subprocesses(temp_module):
+
+    modname = 'sphinx_automodapi.tests.example_module.mixed'
+    infos, errors = introspect_in_subprocesses([modname, 'apyhtest_index'], workers=2)
+
+    assert errors == {}
+    assert infos[modname] == introspect_module(modname)
+    assert infos['apyhtest_index']['items'] == [['spam', 'apyhtest_index.spam', 'routine']]
+    assert 'apyhtest_index' not in sys.modules
+
+
+def test_introspect_in_subprocesses_errors(temp_module):
+
+    temp_module.write('raise ValueError("no spam")\n')
+    infos, errors = introspect_in_subprocesses(['apyhtest_index'])
+    assert infos == {}
+    assert errors == {'apyhtest_index': ('ValueError: no spam', False)}
+
+    # Modules failing in a worker are left for the current process to import
+    cache = ModObjsCache()
+    prefetch_module_infos(cache, ['apyhtest_index'])
+    with pytest.raises(ValueError, match='no spam'):
+        cache.find_mod_kinds('apyhtest_index')
+
+
+def test_introspect_in_subprocesses_timeout(temp_module):
+
+    temp_module.write('import time\ntime.sleep(60)\n')
+    infos, errors = introspect_in_subprocesses(['apyhtest_index'], timeout=0.5)
+    assert infos == {}
+    assert errors['apyhtest_index'][1] is True
+
+    cache = ModObjsCache()
+    prefetch_module_infos(cache, ['apyhtest_index'], timeout=0.5)
+    with pytest.raises(ImportError, match='timed out'):
+        cache.find_mod_kinds('apyhtest_index')
+    assert 'apyhtest_index' not in sys.modules
+
+
+def test_prefetch_object_infos(temp_module):
+
+    temp_module.write('class Spam:\n    def egg(self):\n        pass\n\n\n'
+                      'def ham():\n    pass\n')
+
+    cache = ModObjsCache()
+    prefetch_object_infos(cache, [('apyhtest_index.Spam', False), ('apyhtest_index.ham', False),
+                                  ('apyhtest_index.missing', False)], workers=2)
+    assert 'apyhtest_index' not in sys.modules
+    assert cache.object_info('apyhtest_index.Spam')['members']['method'] == ['egg']
+    assert cache.object_info('apyhtest_index.ham')['objtype'] == 'function'
+    assert 'apyhtest_index' not in sys.modules
+
+    # Objects that can't be imported in a worker are left for the current
+    # process to import
+    with pytest.raises(ImportError):
+        cache.object_info('apyhtest_index.missing')
+
+    # and objects that time out are marked as not importable
+    temp_module.write('import time\ntime.sleep(60)\n')
+    del sys.modules['apyhtest_index']
+    cache = ModObjsCache()
+    prefetch_object_infos(cache, [('apyhtest_index.Spam', False)], timeout=0.5)
+    with pytest.raises(ImportError, match='timed out'):
+        cache.object_info('apyhtest_index.Spam')
+    assert 'apyhtest_index' not in sys.modules
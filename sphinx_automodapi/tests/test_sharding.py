@@ -0,0 +1,159 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import json
+import os
+
+import pytest
+from sphinx.cmd.build import build_main
+from sphinx.errors import ConfigError
+
+from ..sharding import in_shard, merge_shards, parse_shard, main
+from .helpers import write_conf, DEFAULT_CONF
+
+# With two shards, the first module is in shard 0 and the second in shard 1
+sharded_str = """
+.. automodsumm:: sphinx_automodapi.tests.example_module.slots
+    :toctree: api
+
+.. automodsumm:: sphinx_automodapi.tests.example_module.functions
+    :toctree: api
+
+.. automod-diagram:: sphinx_automodapi.tests.example_module.slots
+
+.. automod-diagram:: sphinx_automodapi.tests.example_module.functions
+"""
+
+
+def build(srcdir, conf):
+    # Builds of a shard are missing the stubs of the other shards, so they
+    # are not run with -W
+    write_conf(os.path.join(srcdir, 'conf.py'), dict(DEFAULT_CONF, **conf))
+    assert build_main(argv=['-q', '-b', 'html', srcdir, os.path.join(srcdir, '_build')]) == 0
+    return os.path.join(srcdir, '_build', '.doctrees')
+
+
+def stubs(srcdir):
+    apidir = os.path.join(srcdir, 'api')
+    result = {}
+    for fname in sorted(os.listdir(apidir)):
+        with open(os.path.join(apidir, fname), encoding='utf8') as f:
+            result[fname] = f.read()
+    return result
+
+
+def test_parse_shard():
+
+    assert parse_shard(None) is None
+    assert parse_shard('1/3') == (1, 3)
+    assert parse_shard([2, 3]) == (2, 3)
+    for value in ('1', '3/3', 'a/b', (-1, 2)):
+        with pytest.raises(ConfigError):
+            parse_shard(value)
+
+    modnames = [f'package.module{i}' for i in range(100)]
+    counts = [sum(in_shard(modname, (index, 3)) for modname in modnames)
+              for index in range(3)]
+    assert sum(counts) == 100 and min(counts) > 0
+    assert all(in_shard(modname, None) for modname in modnames)
+
+
+def test_sharded_build(tmpdir):
+
+    conf = {'automodapi_build_stats': True,
+            'extensions': DEFAULT_CONF['extensions'] + ['sphinx_automodapi.smart_resolver']}
+
+    full = tmpdir.mkdir('full').strpath
+    tmpdir.join('full', 'index.rst').write(sharded_str)
+    build(full, conf)
+
+    shard_dirs = []
+    for index in range(2):
+        srcdir = tmpdir.mkdir(f'shard{index}').strpath
+        tmpdir.join(f'shard{index}', 'index.rst').write(sharded_str)
+        shard_dirs.append(build(srcdir, dict(conf, automodsumm_shard=f'{index}/2')))
+
+        with open(os.path.join(shard_dirs[-1], 'automodapi_stats.json')) as f:
+            counters = json.load(f)['counters']
+        assert counters['diagrams skipped (other shards)'] == 1
+        assert counters['stubs skipped (other shards)'] > 0
+
+        # Each shard only generates the stubs of its modules
+        module = 'slots' if index == 0 else 'functions'
+        assert all(f'.{module}.' in fname for fname in stubs(srcdir))
+
+        # Rebuilding the shard in the same tree, where its stubs already
+        # exist, gives the same manifest
+        with open(os.path.join(shard_dirs[-1], 'automodsumm_shard.json')) as f:
+            manifest = json.load(f)
+        assert len(manifest['stubs']) == len(stubs(srcdir)) > 0
+        build(srcdir, dict(conf, automodsumm_shard=f'{index}/2'))
+        with open(os.path.join(shard_dirs[-1], 'automodsumm_shard.json')) as f:
+            assert json.load(f) == manifest
+
+    # Merging the shards gives the same stubs as a single build
+    merged = tmpdir.mkdir('merged').strpath
+    assert main([merged] + shard_dirs) == 0
+    assert stubs(merged) == stubs(full)
+
+    # All the shards are needed
+    with pytest.raises(ValueError, match='expected shards 0 to 1'):
+        merge_shards(merged, shard_dirs[:1])
+
+    # and together they must generate all the stubs
+    manifest_path = os.path.join(shard_dirs[1], 'automodsumm_shard.json')
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    manifest['stubs'] = {}
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f)
+    with pytest.raises(ValueError, match='3 stub files were not generated by any shard: '
+                                         'api/sphinx_automodapi.tests.example_module.functions'):
+        merge_shards(merged, shard_dirs)
+
+
+def test_sharded_incremental_build(tmpdir):
+
+    # Shards built one after the other in the same tree keep the stubs of
+    # the other shards, which are then up to date for a full build
+    conf = {'automodapi_build_stats': True, 'automodsumm_incremental_generation': True}
+    srcdir = tmpdir.strpath
+    tmpdir.join('index.rst').write(sharded_str)
+    for index in range(2):
+        doctreedir = build(srcdir, dict(conf, automodsumm_shard=f'{index}/2'))
+    assert any('.slots.' in fname for fname in stubs(srcdir))
+    assert any('.functions.' in fname for fname in stubs(srcdir))
+
+    doctreedir = build(srcdir, conf)
+    with open(os.path.join(doctreedir, 'automodapi_stats.json')) as f:
+        counters = json.load(f)['counters']
+    assert counters['stubs unchanged'] == len([fname for fname in stubs(srcdir)
+                                               if fname.endswith('.rst')])
+    assert 'stubs written' not in counters
+
+
+def test_merge_shards(tmpdir):
+
+    shard_dirs = []
+    expected = ['api/a.rst', 'api/b.rst', 'api/c.rst']
+    for index, stub, fullname in [(0, 'a', 'pkg.core.A'), (1, 'b', 'pkg.core.B')]:
+        shard_dir = tmpdir.mkdir(f'shard{index}')
+        shard_dir.join('automodsumm_shard.json').write(json.dumps(
+            {'shard': index, 'count': 2, 'stubs': {f'api/{stub}.rst': stub},
+             'expected': expected, 'missing': ['api/c.rst'] if index else [],
+             'class_name_mapping': {fullname: fullname.replace('.core', '')}}))
+        shard_dir.mkdir('automodsumm_diagrams').join(f'inheritance-{stub}.png').write(stub)
+        shard_dirs.append(shard_dir.strpath)
+
+    cache = tmpdir.join('cache').strpath
+    assert merge_shards(tmpdir.strpath, shard_dirs, diagram_cache=cache) == ['api/a.rst',
+                                                                             'api/b.rst']
+    assert tmpdir.join('api', 'a.rst').read() == 'a'
+    assert tmpdir.join('api', 'b.rst').read() == 'b'
+    assert sorted(os.listdir(cache)) == ['inheritance-a.png', 'inheritance-b.png']
+
+    # Shards must agree with each other
+    tmpdir.join('shard1', 'automodsumm_shard.json').write(json.dumps(
+        {'shard': 1, 'count': 2, 'stubs': {}, 'expected': [], 'missing': [],
+         'class_name_mapping': {'pkg.core.A': 'pkg.other.A'}}))
+    with pytest.raises(ValueError, match='pkg.core.A'):
+        merge_shards(tmpdir.strpath, shard_dirs)
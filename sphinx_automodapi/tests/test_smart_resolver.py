@@ -0,0 +1,181 @@
+# Licensed under a 3-clause BSD style license - see LICENSE.rst
+
+import pickle
+from types import SimpleNamespace
+
+from docutils.nodes import literal
+from sphinx.addnodes import pending_xref
+
+from .. import smart_resolver
+from ..utils import SPHINX_LT_9
+from .helpers import run_sphinx_in_tmpdir
+
+
+def make_inventory_item(uri):
+    if SPHINX_LT_9:
+        return ('project', '1.0', uri, '-')
+    from sphinx.util.inventory import _InventoryItem
+    return _InventoryItem(project_name='project', project_version='1.0', uri=uri, display_name='-')
+
+
+class FakeDomain:
+
+    def __init__(self):
+        self.targets = []
+
+    def resolve_xref(self, env, refdoc, builder, typ, target, node, contnode):
+        self.targets.append(target)
+        return literal(text=target)
+
+
+def make_env():
+    inventory = {'numpy': {'py:class': {'numpy.ndarray': make_inventory_item('ndarray.html'),
+                                        'other.Class': make_inventory_item('other.html')}}}
+    mapping = {'pkg.core.Spam': 'pkg.Spam',
+               'numpy.ndarray': 'pkg.ndarray'}
+    return SimpleNamespace(class_name_mapping=mapping, intersphinx_named_inventory=inventory,
+                           docname='index', domains={'py': FakeDomain()})
+
+
+def resolve(env, reftype, reftarget):
+    node = pending_xref('', literal(text=reftarget), reftype=reftype, reftarget=reftarget,
+                        refdoc='index')
+    node.rawsource = reftarget
+    return smart_resolver.missing_reference_handler(SimpleNamespace(builder=None), env,
+                                                    node, literal(text=reftarget))
+
+
+def test_resolver_index():
+
+    env = make_env()
+    index = smart_resolver._build_resolver_index(env)
+
+    # Only intersphinx entries starting with the inventory name are included,
+    # and classes documented locally take precedence
+    assert index == {'pkg.core.Spam': ('local', 'pkg.Spam'),
+                     'numpy.ndarray': ('local', 'pkg.ndarray')}
+
+    del env.class_name_mapping['numpy.ndarray']
+    index = smart_resolver._build_resolver_index(env)
+    assert index['numpy.ndarray'] == ('intersphinx', 'ndarray.html')
+
+
+def test_missing_reference_handler():
+
+    env = make_env()
+    del env.class_name_mapping['numpy.ndarray']
+    smart_resolver.clear_resolver_index(None, env)
+
+    # Classes and their members are resolved to where they are documented
+    assert resolve(env, 'class', 'pkg.core.Spam').astext() == 'pkg.Spam'
+    assert resolve(env, 'meth', 'pkg.core.Spam.eat').astext() == 'pkg.Spam.eat'
+    assert env.domains['py'].targets == ['pkg.Spam', 'pkg.Spam.eat']
+
+    # Classes from intersphinx inventories
+    newnode = resolve(env, 'class', 'numpy.core.ndarray')
+    assert newnode['refuri'] == 'ndarray.html'
+    assert newnode['reftitle'] == 'numpy.ndarray'
+
+    # Private names are silenced
+    assert resolve(env, 'class', 'pkg._Private').astext() == 'pkg._Private'
+
+    assert resolve(env, 'class', 'pkg.Unknown') is None
+
+    # The index is built from the environment used for the first missing
+    # reference, and is rebuilt for a different environment
+    env = make_env()
+    assert resolve(env, 'class', 'numpy.ndarray').astext() == 'pkg.ndarray'
+
+
+def test_missing_reference_memo():
+
+    env = make_env()
+    env.class_name_mapping['pkg.core.Egg'] = 'pkg.Egg'
+    smart_resolver.clear_resolver_index(None, env)
+    domain = env.domains['py']
+
+    for _ in range(3):
+        assert resolve(env, 'class', 'pkg.core.Spam').astext() == 'pkg.Spam'
+        assert resolve(env, 'obj', 'pkg.core.Spam.eat').astext() == 'pkg.Spam.eat'
+
+    # The Python domain is only asked once for each target
+    assert domain.targets == ['pkg.Spam', 'pkg.Spam.eat']
+
+    # Results are copies, which can be modified independently
+    first = resolve(env, 'class', 'pkg.core.Spam')
+    first['reftitle'] = 'modified'
+    assert resolve(env, 'class', 'pkg.core.Spam')['reftitle'] == 'pkg.core.Spam'
+
+    # Targets that can't be resolved by the domain are remembered too
+    domain.resolve_xref = lambda *args: domain.targets.append(args[4])
+    for _ in range(3):
+        assert resolve(env, 'class', 'pkg.core.Egg') is None
+    assert domain.targets == ['pkg.Spam', 'pkg.Spam.eat', 'pkg.Egg']
+
+
+def test_class_name_mapping_collector():
+
+    collector = smart_resolver.ClassNameMappingCollector()
+    app = SimpleNamespace(env=SimpleNamespace(docname='a'))
+    env = app.env
+
+    smart_resolver.process_docstring(app, 'class', 'pkg.Spam', Spam, None, [])
+    env.docname = 'b'
+    smart_resolver.process_docstring(app, 'class', 'pkg.sub.Spam', Spam, None, [])
+    smart_resolver.process_docstring(app, 'function', 'pkg.func', len, None, [])
+
+    fullname = Spam.__module__ + '.Spam'
+    assert env.class_name_mapping == {fullname: 'pkg.sub.Spam'}
+    assert env.class_name_mapping_docs == {'a': {fullname: 'pkg.Spam'},
+                                           'b': {fullname: 'pkg.sub.Spam'}}
+
+    # The entries of a purged document are removed, or replaced by those of
+    # another document documenting the same class
+    collector.clear_doc(app, env, 'b')
+    assert env.class_name_mapping == {fullname: 'pkg.Spam'}
+    collector.clear_doc(app, env, 'a')
+    assert env.class_name_mapping == {}
+    assert env.class_name_mapping_docs == {}
+
+    # Only the entries of the documents read by another environment are merged
+    other = SimpleNamespace(class_name_mapping={'x.A': 'x.A', 'y.B': 'y.B'},
+                            class_name_mapping_docs={'x': {'x.A': 'x.A'},
+                                                     'y': {'y.B': 'y.B'}})
+    collector.merge_other(app, env, {'x'}, other)
+    assert env.class_name_mapping == {'x.A': 'x.A'}
+    assert env.class_name_mapping_docs == {'x': {'x.A': 'x.A'}}
+
+
+class Spam:
+    pass
+
+
+def test_class_name_mapping_incremental(tmpdir):
+
+    tmpdir.join('index.rst').write('Index\n=====\n\n.. toctree::\n\n   spam\n')
+    spam_rst = tmpdir.join('spam.rst')
+    spam_rst.write('Spam\n====\n\n'
+                   '.. autoclass:: sphinx_automodapi.tests.example_module.classes.Spam\n')
+
+    def load_env():
+        with open(tmpdir.join('_build', 'html', '.doctrees', 'environment.pickle').strpath,
+                  'rb') as f:
+            return pickle.load(f)
+
+    conf = {'nitpicky': False,
+            'extensions': ['sphinx_automodapi.automodapi', 'sphinx_automodapi.smart_resolver']}
+
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    fullname = 'sphinx_automodapi.tests.example_module.classes.Spam'
+    env = load_env()
+    assert env.class_name_mapping == {fullname: fullname}
+    assert env.class_name_mapping_docs == {'spam': {fullname: fullname}}
+
+    # The entries are removed once the class is no longer documented
+    spam_rst.write('Spam\n====\n\nNothing to see here.\n')
+    run_sphinx_in_tmpdir(tmpdir, additional_conf=conf)
+
+    env = load_env()
+    assert env.class_name_mapping == {}
+    assert env.class_name_mapping_docs == {}
@@ -0,0 +1,177 @@
+import json
+import os
+import sys
+import textwrap
+
+import pytest
+
+from ..static_discovery import StaticAnalyzer, static_module_info
+from ..utils import ModObjsCache, introspect_module
+from .helpers import run_sphinx_in_tmpdir
+
+PACKAGE = {
+    '__init__.py': """
+        from .core import *
+        from .core import Spam as Ham
+        from . import helpers
+        from .helpers import helper, TIMEOUT
+        from collections import OrderedDict
+        import os.path
+
+        __all__ = core.__all__ + ['Ham', 'helper', 'TIMEOUT', 'OrderedDict', 'helpers']
+    """,
+    'core.py': """
+        import functools
+        from dataclasses import dataclass
+        from typing import TYPE_CHECKING
+
+        if TYPE_CHECKING:
+            from .helpers import helper as spam_helper
+
+        __all__ = ['Spam', 'Egg', 'cached']
+        __all__ += ['square', 'CONSTANT']
+
+        try:
+            from math import prod
+        except ImportError:
+            prod = None
+
+
+        @dataclass
+        class Spam:
+            pass
+
+
+        class Egg(Spam):
+            pass
+
+
+        @functools.lru_cache
+        def cached():
+            pass
+
+
+        square = lambda x: x ** 2  # noqa: E731
+        CONSTANT = (1, 2) + (3,)
+    """,
+    'helpers.py': """
+        import sys
+
+        if sys.version_info < (3, 0):
+            def helper():
+                pass
+        else:
+            def helper():
+                pass
+
+        TIMEOUT = 60
+        _private = 1
+
+        for _i in range(3):
+            pass
+    """,
+    'dynamic.py': """
+        def make():
+            return lambda: None
+
+        made = make()
+    """,
+    'registry.py': """
+        def register(func):
+            return func
+
+        @register
+        def spam():
+            pass
+    """,
+    'namespace.py': """
+        globals()['spam'] = 1
+    """,
+    'rename.py': """
+        class Spam:
+            __module__ = 'elsewhere'
+    """,
+}
+
+
+@pytest.fixture
+def temp_package(tmpdir):
+    """
+    Creates a package named apyhtest_static, which is removed from
+    sys.modules after the test.
+    """
+    pkgdir = tmpdir.mkdir('apyhtest_static')
+    for fname, source in PACKAGE.items():
+        pkgdir.join(fname).write(textwrap.dedent(source))
+
+    sys.path.insert(0, tmpdir.strpath)
+    yield pkgdir
+    sys.path.remove(tmpdir.strpath)
+    for modname in list(sys.modules):
+        if modname.split('.')[0] == 'apyhtest_static':
+            del sys.modules[modname]
+
+
+@pytest.mark.parametrize('modname', ['apyhtest_static', 'apyhtest_static.core',
+                                     'apyhtest_static.helpers'])
+def test_static_module_info(temp_package, modname):
+
+    # The modules are analyzed without being imported, and their
+    # description is the same as the one obtained by importing them
+    info = static_module_info(modname)
+    assert info is not None
+    assert not any(name.startswith('apyhtest_static') for name in sys.modules)
+
+    assert info == introspect_module(modname)
+
+
+def test_static_module_info_package(temp_package):
+
+    info = static_module_info('apyhtest_static')
+    assert info['ispkg'] and info['has_all']
+    assert info['items'] == [
+        ['Spam', 'apyhtest_static.core.Spam', 'class'],
+        ['Egg', 'apyhtest_static.core.Egg', 'class'],
+        ['cached', 'apyhtest_static.core.cached', 'routine'],
+        ['square', 'apyhtest_static.core.<lambda>', 'routine'],
+        ['CONSTANT', 'apyhtest_static.CONSTANT', 'other'],
+        ['Ham', 'apyhtest_static.core.Spam', 'class'],
+        ['helper', 'apyhtest_static.helpers.helper', 'routine'],
+        ['TIMEOUT', 'apyhtest_static.TIMEOUT', 'other'],
+        ['OrderedDict', 'collections.OrderedDict', 'class']]
+    assert [os.path.basename(fname) for fname in info['files']
+            if temp_package.strpath in fname] == ['__init__.py', 'core.py', 'helpers.py']
+
+
+@pytest.mark.parametrize('name', ['dynamic', 'registry', 'namespace', 'rename'])
+def test_static_module_info_fallback(temp_package, name):
+
+    # The kind of some attributes can't be determined statically
+    assert static_module_info('apyhtest_static.' + name, StaticAnalyzer()) is None
+
+
+def test_static_discovery_cache(temp_package):
+
+    cache = ModObjsCache()
+    cache.static = True
+    assert cache.find_mod_kinds('apyhtest_static.helpers') == (
+        ['TIMEOUT', 'helper'], ['apyhtest_static.helpers.TIMEOUT', 'apyhtest_static.helpers.helper'],
+        ['other', 'routine'])
+    assert 'apyhtest_static.helpers' not in sys.modules
+
+    # Modules that can't be analyzed are imported
+    assert cache.find_mod_kinds('apyhtest_static.dynamic')[0] == ['made', 'make']
+    assert 'apyhtest_static.dynamic' in sys.modules
+
+
+def test_static_discovery_build(tmpdir, temp_package):
+
+    tmpdir.join('index.rst').write('.. automodapi:: apyhtest_static.helpers\n')
+    run_sphinx_in_tmpdir(tmpdir, additional_conf={'automodsumm_static_discovery': True,
+                                                  'automodapi_build_stats': True})
+
+    with open(tmpdir.join('_build', 'html', '.doctrees', 'automodapi_stats.json').strpath) as f:
+        counters = json.load(f)['counters']
+    assert counters['modules discovered statically'] == 1
+    assert 'modules introspected' not in counters
+    assert tmpdir.join('api', 'apyhtest_static.helpers.helper.rst').check()
@@ -2,7 +2,11 @@
 
 from collections import namedtuple
 
-from ..utils import find_mod_objs
+import pytest
+
+from ..utils import (find_mod_objs, ModObjsCache, introspect_module,
+                     filter_module_info, obj_kind, cleanup_whitespace,
+                     iter_cleanup_whitespace)
 
 
 def test_find_mod_objs():
@@ -43,3 +47,74 @@ def test_find_mod_objs_with_list_of_modules():
 
     assert namedtuple in objs
     assert find_mod_objs in objs
+
+
+def test_mod_objs_cache():
+    cache = ModObjsCache()
+
+    lnms, fqns, objs = find_mod_objs('sphinx_automodapi.tests.test_utils', onlylocals=True)
+    expected = lnms, fqns, [obj_kind(obj) for obj in objs]
+    assert cache.find_mod_kinds('sphinx_automodapi.tests.test_utils', onlylocals=True) == expected
+    assert (cache.hits, cache.misses) == (0, 1)
+
+    assert cache.find_mod_kinds('sphinx_automodapi.tests.test_utils', onlylocals=True) == expected
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # The module is only introspected once whatever the arguments
+    cache.find_mod_kinds('sphinx_automodapi.tests.test_utils', onlylocals=['collections'])
+    assert cache.is_package('sphinx_automodapi.tests.test_utils') is False
+    assert (cache.hits, cache.misses) == (3, 1)
+
+    # Modifying the returned lists does not affect the cache
+    lnms, fqns, kinds = cache.find_mod_kinds('sphinx_automodapi.tests.test_utils',
+                                             onlylocals=True)
+    lnms.clear()
+    assert cache.find_mod_kinds('sphinx_automodapi.tests.test_utils', onlylocals=True) == expected
+
+    cache.invalidate('sphinx_automodapi.tests.test_utils')
+    cache.find_mod_kinds('sphinx_automodapi.tests.test_utils', onlylocals=True)
+    assert (cache.hits, cache.misses) == (5, 2)
+
+    cache.invalidate()
+    assert (cache.hits, cache.misses) == (0, 0)
+
+
+@pytest.mark.parametrize('modname', ['sphinx_automodapi.tests.test_utils',
+                                     'sphinx_automodapi.tests.example_module.mixed',
+                                     'sphinx_automodapi.tests.example_module.noall'])
+@pytest.mark.parametrize('onlylocals', [False, True, ['collections']])
+@pytest.mark.parametrize('sort', [False, True])
+def test_filter_module_info(modname, onlylocals, sort):
+    info = introspect_module(modname)
+
+    lnms, fqns, objs = find_mod_objs(modname, onlylocals=onlylocals, sort=sort)
+    assert filter_module_info(info, modname, onlylocals=onlylocals, sort=sort) == \
+        (lnms, fqns, [obj_kind(obj) for obj in objs])
+
+
+def test_introspect_module():
+    info = introspect_module('sphinx_automodapi.tests.example_module')
+    assert info['ispkg'] is True
+    assert info['has_all'] is False
+
+    info = introspect_module('sphinx_automodapi.tests.example_module.mixed')
+    assert info['ispkg'] is False
+    assert info['has_all'] is True
+    assert info['items'] == [['add', 'sphinx_automodapi.tests.example_module.mixed.add', 'routine'],
+                             ['MixedSpam', 'sphinx_automodapi.tests.example_module.mixed.MixedSpam',
+                              'class']]
+
+
+@pytest.mark.parametrize('text,expected', [
+    ('', '\n'),
+    ('  \n\n', '\n'),
+    ('\n\n  Title  \n=====\n', 'Title\n=====\n'),
+    ('a \n\n \n \n\nb', 'a\n\nb\n'),
+    ('a\n   b  \t \n\n\n\tc   ', 'a\n   b  \t\n\n\tc\n'),
+])
+def test_cleanup_whitespace(text, expected):
+    assert cleanup_whitespace(text) == expected
+    # The result should not depend on how the text is split into chunks
+    for size in range(1, len(text) + 1):
+        chunks = [text[i:i + size] for i in range(0, len(text), size)]
+        assert ''.join(iter_cleanup_whitespace(chunks)) == expected
@@ -1,16 +1,24 @@
 import sys
 import re
 import os
-from inspect import ismodule
+import dataclasses
+from inspect import isclass, ismodule, isroutine
 from warnings import warn
 
 import sphinx
 from packaging.version import Version
 from sphinx.ext.autosummary.generate import find_autosummary_in_docstring
 
+from .instrumentation import build_stats
+
 __all__ = ['cleanup_whitespace',
+           'iter_cleanup_whitespace',
            'find_mod_objs',
-           'find_autosummary_in_lines_for_automodsumm']
+           'find_autosummary_in_lines_for_automodsumm',
+           'introspect_module',
+           'introspect_object',
+           'filter_module_info',
+           'ModObjsCache']
 
 SPHINX_LT_9 = Version(sphinx.__version__) < Version("9.0")
 
@@ -22,24 +30,52 @@ DOUBLE_NEWLINE = '\n\n'
 TRIPLE_NEWLINE = '\n\n\n'
 
 
+# Runs of spaces at the end of a line, and of more than two newlines
+_spacesnewlinerex = re.compile(' +\n')
+_manynewlinesrex = re.compile('\n{3,}')
+
+
+def _normalize_newlines(text):
+    # Same as repeatedly replacing SPACE_NEWLINE and then TRIPLE_NEWLINE
+    # until there are none left
+    return _manynewlinesrex.sub(DOUBLE_NEWLINE, _spacesnewlinerex.sub(SINGLE_NEWLINE, text))
+
+
 def cleanup_whitespace(text):
     """
     Make sure there are never more than two consecutive newlines, and that
     there are no trailing whitespaces.
     """
+    return ''.join(iter_cleanup_whitespace([text]))
 
-    # Get rid of overall leading/trailing whitespace
-    text = text.strip() + '\n'
 
-    # Get rid of trailing whitespace on each line
-    while SPACE_NEWLINE in text:
-        text = text.replace(SPACE_NEWLINE, SINGLE_NEWLINE)
-
-    # Avoid too many consecutive newlines
-    while TRIPLE_NEWLINE in text:
-        text = text.replace(TRIPLE_NEWLINE, DOUBLE_NEWLINE)
-
-    return text
+def iter_cleanup_whitespace(chunks):
+    """
+    Same as `cleanup_whitespace`, but for a text given as an iterable of
+    chunks, such as the output of ``template.generate()``. The cleaned up
+    text is yielded in pieces as soon as they are complete, so the whole text
+    is never held in memory.
+    """
+    # Trailing whitespace is held back until the next non-whitespace
+    # character, since it may need to be removed or normalized. Since the
+    # normalization only involves whitespace, the text up to a non-whitespace
+    # character can always be normalized independently of what follows.
+    pending = ''
+    started = False
+    for chunk in chunks:
+        if not started:
+            # Get rid of overall leading whitespace
+            chunk = chunk.lstrip()
+            if not chunk:
+                continue
+            started = True
+        text = pending + chunk
+        end = len(text.rstrip())
+        pending = text[end:]
+        if end > 0:
+            yield _normalize_newlines(text[:end])
+    # Get rid of overall trailing whitespace
+    yield SINGLE_NEWLINE
 
 
 def find_mod_objs(modname, onlylocals=False, sort=False):
@@ -115,6 +151,373 @@ def find_mod_objs(modname, onlylocals=False, sort=False):
     return localnames, fqnames, objs
 
 
+def obj_kind(obj):
+    """
+    Returns the kind of a module attribute, as used by the directives to
+    select which attributes to document: ``'class'``, ``'routine'`` or
+    ``'other'``.
+    """
+    if isclass(obj):
+        return 'class'
+    elif isroutine(obj):
+        return 'routine'
+    else:
+        return 'other'
+
+
+def introspect_module(modname):
+    """
+    Imports a module and returns a description of its public attributes that
+    only contains plain data, so that it can be stored or sent between
+    processes.
+
+    The returned dict has the following keys:
+
+    * ``'items'``: a list of ``[localname, fqname, kind]`` lists for all the
+      public attributes of the module, as returned by `find_mod_objs` with
+      ``onlylocals=False`` and ``sort=False``, where ``kind`` is given by
+      `obj_kind`.
+    * ``'has_all'``: whether the module defines ``__all__``.
+    * ``'ispkg'``: whether the module is a package.
+    * ``'files'``: the sorted list of the source files of the module and of
+      the modules where its attributes are defined.
+
+    Use `filter_module_info` to get the same selection of attributes as
+    `find_mod_objs`.
+    """
+    localnames, fqnames, objs = find_mod_objs(modname)
+    mod = sys.modules[modname]
+
+    # TODO: There is probably a cleaner way to do this, though this is pretty
+    # reliable for all Python versions for most cases that we care about.
+    ispkg = (hasattr(mod, '__file__') and isinstance(mod.__file__, str) and
+             os.path.split(mod.__file__)[1].startswith('__init__.py'))
+
+    files = set()
+    for defmod in [mod] + [sys.modules.get(getattr(obj, '__module__', None)) for obj in objs]:
+        filename = getattr(defmod, '__file__', None)
+        if isinstance(filename, str):
+            files.add(filename)
+
+    return {'items': [[lnm, fqn, obj_kind(obj)]
+                      for lnm, fqn, obj in zip(localnames, fqnames, objs)],
+            'has_all': hasattr(mod, '__all__'),
+            'ispkg': ispkg,
+            'files': sorted(files)}
+
+
+def filter_module_info(info, modname, onlylocals=False, sort=False):
+    """
+    Selects attributes from a module description returned by
+    `introspect_module`, following the same rules as `find_mod_objs`.
+
+    Returns
+    -------
+    localnames : list of str
+        The names of the attributes as they are named in the module.
+    fqnames : list of str
+        The fully qualified names of the attributes.
+    kinds : list of str
+        The kinds of the attributes (see `obj_kind`).
+    """
+    items = info['items']
+
+    if info['has_all']:
+        if sort:
+            items = sorted(items, key=lambda item: item[0])
+    elif onlylocals:
+        if isinstance(onlylocals, (tuple, list)):
+            modname = tuple(onlylocals)
+        items = [item for item in items if item[1].startswith(modname)]
+
+    return ([item[0] for item in items],
+            [item[1] for item in items],
+            [item[2] for item in items])
+
+
+def _object_source_files(obj, parent, obj_type):
+    """
+    Returns the source files that the stub generated for ``obj`` depends on:
+    those of the modules where the members of a module, or the classes in the
+    MRO of a class (or of the class of a method or attribute), are defined.
+    """
+    if obj_type == 'module':
+        return set(introspect_module(obj.__name__)['files'])
+    if isinstance(obj, type):
+        objs = obj.__mro__
+    elif isinstance(parent, type):
+        objs = (obj,) + parent.__mro__
+    else:
+        objs = (obj,)
+    files = set()
+    for defobj in objs:
+        filename = getattr(sys.modules.get(getattr(defobj, '__module__', None)), '__file__', None)
+        if isinstance(filename, str):
+            files.add(filename)
+    return files
+
+
+def introspect_object(name, include_base=False, app=None):
+    """
+    Imports an object documented by automodsumm and returns a description of
+    it that only contains plain data, like `introspect_module`.
+
+    The returned dict has the following keys:
+
+    * ``'name'``: the full name of the object, as returned by
+      `sphinx.ext.autosummary.import_by_name`.
+    * ``'objtype'``: the object type, as returned by `get_object_type`.
+    * ``'members'``: for modules and classes, a dict mapping each object type
+      to the names of the members of that type, as returned by
+      `_classify_members_mod` or `_classify_members_class` (with
+      ``include_base``), and `None` otherwise.
+    * ``'all_members'``: the names of all these members, or `None`.
+    * ``'files'``: the sorted list of the source files that the stub of the
+      object depends on.
+
+    Raises `ImportError` if the object can't be imported.
+    """
+    from sphinx.ext.autosummary import import_by_name
+    try:
+        from sphinx.ext.autosummary import ImportExceptionGroup
+    except ImportError:  # Sphinx < 9
+        ImportExceptionGroup = ImportError
+
+    try:
+        name, obj, parent = import_by_name(name)[:3]
+    except ImportExceptionGroup as exc:
+        # Sphinx >= 9 raises an exception group, which is not an ImportError
+        raise ImportError(str(exc)) from exc
+    obj_type = get_object_type(app, obj, parent)
+
+    if obj_type == 'module':
+        members = _classify_members_mod(app, obj)
+    elif obj_type == 'class':
+        members = _classify_members_class(app, obj, include_base=include_base)
+    else:
+        members = None
+
+    return {'name': name,
+            'objtype': obj_type,
+            'members': None if members is None else {typ: names for typ, names in members.items()
+                                                     if typ is not None},
+            'all_members': None if members is None else members[None],
+            'files': sorted(_object_source_files(obj, parent, obj_type))}
+
+
+class ModObjsCache:
+    """
+    A cache of module descriptions shared by all the directives of a build.
+
+    The cache holds the module descriptions returned by `introspect_module`,
+    keyed by module name, which are used by `find_mod_kinds` and
+    `is_package`. The number of cache hits and misses is recorded in the
+    ``hits`` and ``misses`` attributes. Failed imports are not cached, so the
+    `ImportError` is raised again on the next lookup.
+
+    It also holds the descriptions of the objects documented by automodsumm
+    returned by `introspect_object`, which are used by `object_info`.
+
+    If ``index`` is set to a persistent index (see
+    `sphinx_automodapi.introspection.ModuleIndex`), descriptions are looked
+    up there before importing the module or object, and added to it
+    otherwise. With Sphinx < 9, the types of objects depend on the autodoc
+    documenters registered by the extensions of the build, so object
+    descriptions are not stored in the index. If ``static`` is set, module
+    descriptions are then looked up with
+    `sphinx_automodapi.static_discovery.static_module_info` before importing
+    the module.
+    """
+
+    def __init__(self):
+        self._infos = {}
+        self._failures = {}
+        self._objects = {}
+        self._object_failures = {}
+        self._analyzer = None
+        self.index = None
+        self.static = False
+        self.hits = 0
+        self.misses = 0
+
+    def module_info(self, modname):
+        """
+        Returns the description of module ``modname`` given by
+        `introspect_module`, only importing the module if needed.
+        """
+        if modname in self._failures:
+            raise ImportError(self._failures[modname])
+        try:
+            info = self._infos[modname]
+        except KeyError:
+            self.misses += 1
+            info = None if self.index is None else self.index.get(modname)
+            if info is not None:
+                build_stats.count('modules found in index')
+            elif self.static:
+                info = self._static_module_info(modname)
+            if info is None:
+                with build_stats.timer('module import and introspection'):
+                    info = introspect_module(modname)
+                build_stats.count('modules introspected')
+                if self.index is not None:
+                    self.index.set(modname, info)
+            self._infos[modname] = info
+        else:
+            self.hits += 1
+        return info
+
+    def _static_module_info(self, modname):
+        from .static_discovery import StaticAnalyzer, static_module_info
+
+        if self._analyzer is None:
+            self._analyzer = StaticAnalyzer()
+        with build_stats.timer('static module discovery'):
+            info = static_module_info(modname, self._analyzer)
+        if info is not None:
+            build_stats.count('modules discovered statically')
+            if self.index is not None:
+                self.index.set(modname, info)
+        return info
+
+    def has_module_info(self, modname):
+        """
+        Whether the description of module ``modname`` is available without
+        importing the module.
+        """
+        if modname in self._infos:
+            return True
+        info = None if self.index is None else self.index.get(modname)
+        if info is None and self.static:
+            info = self._static_module_info(modname)
+        if info is None:
+            return False
+        self._infos[modname] = info
+        return True
+
+    def add_module_info(self, modname, info):
+        """
+        Adds the description of module ``modname``, e.g. if it was obtained
+        in another process.
+        """
+        self._infos[modname] = info
+        if self.index is not None:
+            self.index.set(modname, info)
+
+    def add_module_failure(self, modname, message):
+        """
+        Marks module ``modname`` as not importable, so that looking up its
+        description raises an `ImportError` with the given message instead
+        of trying to import it again.
+        """
+        self._failures[modname] = message
+
+    def object_info(self, name, include_base=False, app=None):
+        """
+        Returns the description of object ``name`` given by
+        `introspect_object`, only importing the object if needed.
+        """
+        key = (name, include_base)
+        if key in self._object_failures:
+            raise ImportError(self._object_failures[key])
+        try:
+            return self._objects[key]
+        except KeyError:
+            pass
+        index = self._object_index()
+        info = None if index is None else index.get_object(name, include_base)
+        if info is not None:
+            build_stats.count('objects found in index')
+        else:
+            with build_stats.timer('object import and classification'):
+                info = introspect_object(name, include_base=include_base, app=app)
+            build_stats.count('objects introspected')
+            if index is not None:
+                index.set_object(name, include_base, info)
+        self._objects[key] = info
+        return info
+
+    def _object_index(self):
+        # With Sphinx < 9, object types depend on the registered documenters
+        return None if SPHINX_LT_9 else self.index
+
+    def has_object_info(self, name, include_base=False):
+        """
+        Whether the description of object ``name`` is available without
+        importing the object.
+        """
+        key = (name, include_base)
+        if key in self._objects:
+            return True
+        index = self._object_index()
+        info = None if index is None else index.get_object(name, include_base)
+        if info is None:
+            return False
+        build_stats.count('objects found in index')
+        self._objects[key] = info
+        return True
+
+    def add_object_info(self, name, include_base, info):
+        """
+        Adds the description of object ``name``, e.g. if it was obtained in
+        another process.
+        """
+        self._objects[(name, include_base)] = info
+        index = self._object_index()
+        if index is not None:
+            index.set_object(name, include_base, info)
+
+    def add_object_failure(self, name, include_base, message):
+        """
+        Marks object ``name`` as not importable, so that looking up its
+        description raises an `ImportError` with the given message instead
+        of trying to import it again.
+        """
+        self._object_failures[(name, include_base)] = message
+
+    def find_mod_kinds(self, modname, onlylocals=False, sort=False):
+        """
+        Same as `find_mod_objs`, but returns the kinds of the attributes (see
+        `obj_kind`) instead of the attributes themselves, which does not
+        require importing the module if its description is in the index.
+        """
+        return filter_module_info(self.module_info(modname), modname,
+                                  onlylocals=onlylocals, sort=sort)
+
+    def is_package(self, modname):
+        """
+        Whether module ``modname`` is a package.
+        """
+        return self.module_info(modname)['ispkg']
+
+    def invalidate(self, modname=None):
+        """
+        Remove the cached results for ``modname``, or all the cached results
+        (and reset the counters) if ``modname`` is `None`.
+        """
+        if modname is None:
+            self._infos.clear()
+            self._failures.clear()
+            self._objects.clear()
+            self._object_failures.clear()
+            self._analyzer = None
+            self.hits = self.misses = 0
+        else:
+            self._infos.pop(modname, None)
+            self._failures.pop(modname, None)
+            for objects in (self._objects, self._object_failures):
+                for key in list(objects):
+                    if key[0] == modname or key[0].startswith(modname + '.'):
+                        del objects[key]
+            self._analyzer = None
+
+
+# The cache used by the automodapi, automodsumm and automod-diagram directives.
+# It is invalidated at the start of each build (see
+# automodsumm.process_automodsumm_generation).
+mod_objs_cache = ModObjsCache()
+
+
 def find_autosummary_in_lines_for_automodsumm(lines, module=None, filename=None):
     """Find out what items appear in autosummary:: directives in the
     given lines.
@@ -255,3 +658,67 @@ def get_object_type(app, obj, parent):
 
     obj_type = _get_documenter(obj, parent)
     return obj_type
+
+
+def _classify_members_mod(app, obj):
+    """
+    Classify all the members of module ``obj`` by object type, in a single
+    pass over ``dir(obj)``.
+
+    Returns a dict mapping each object type (e.g. ``'function'`` or
+    ``'class'``) to the list of names of that type, and `None` to the list
+    of all the names.
+    """
+    from sphinx.util.inspect import safe_getattr
+
+    members = {None: []}
+    for name in dir(obj):
+        try:
+            obj_type = get_object_type(app, safe_getattr(obj, name), obj)
+        except AttributeError:
+            continue
+        members[None].append(name)
+        members.setdefault(obj_type, []).append(name)
+    return members
+
+
+def _classify_members_class(app, obj, include_base=False):
+    """
+    Classify all the members of class ``obj`` by object type, in a single
+    pass over its attributes. If ``include_base`` is `True`, attributes
+    inherited from base classes are included.
+
+    Returns a dict in the same form as `_classify_members_mod`.
+    """
+    from sphinx.util.inspect import safe_getattr
+
+    # using dir gets all of the attributes, including the elements
+    # from the base class, otherwise use __dict__
+    if include_base:
+        names = dir(obj)
+    else:
+        names = getattr(obj, '__dict__').keys()
+
+        # add dataclass_field names for dataclass classes
+        if dataclasses.is_dataclass(obj):
+            dataclass_fieldnames = getattr(obj, '__dataclass_fields__').keys()
+            names = list(set(list(names) + list(dataclass_fieldnames)))
+
+    members = {None: []}
+    obj_type = None
+    for name in names:
+        try:
+            obj_type = get_object_type(app, safe_getattr(obj, name), obj)
+        except AttributeError:
+            # for dataclasses try to get the attribute from the __dataclass_fields__
+            if dataclasses.is_dataclass(obj):
+                try:
+                    attr = obj.__dataclass_fields__[name]
+                    obj_type = get_object_type(app, attr, obj)
+                except KeyError:
+                    continue
+            # otherwise the member keeps the type of the previous member
+        members[None].append(name)
+        if obj_type is not None:
+            members.setdefault(obj_type, []).append(name)
+    return members